@@ -3,14 +3,49 @@ import os
 import argparse
 import json
 import datetime
-import random
 import subprocess
 import hashlib
 import itertools
 import platform
+import time
+import queue
+import threading
+import gzip
+import shutil
+import tempfile
 
 import requests
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUBMISSION_FILE_TYPES = ['xtc', 'cpt', 'gro', 'log', 'edr', 'tpr']
+
+# bytes sent per request by upload_work
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# content codings we can use, most preferred first, and the suffixes
+# that mark files compressed with them
+ENCODINGS = (['zstd'] if zstandard is not None else []) + ['gzip']
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+# xtcs are already compressed, and the gromppery may recognize the tpr
+COMPRESSIBLE_FILE_TYPES = ['edr', 'log', 'gro', 'cpt']
+
+# each work directory holds a journal of how far its work unit has got,
+# so that work interrupted by the client dying can be picked up again
+JOURNAL_NAME = 'workunit.json'
+SIMULATING = 'simulating'
+UPLOADING = 'uploading'
+
+# times to try resuming a work unit before deciding it can't be finished
+RESUME_ATTEMPTS = 3
+
+# seconds to wait before asking again when no project needs work
+NO_WORK_WAIT = 60
+
 
 def process_command_line(argv):
     '''Parse the command line and do a first-pass on processing them into a
@@ -26,16 +61,41 @@ def process_command_line(argv):
         "--scratch", required=True,
         help="The directory to attach to and work in.")
     parser.add_argument(
-        "--nt", type=int, help="--nt to pass to gmx mdrun")
+        "--nt", type=int,
+        help="--nt to pass to gmx mdrun. With --slots, this is per slot, "
+             "and defaults to an equal share of this machine's cores.")
+    parser.add_argument(
+        "--slots", type=int, default=1,
+        help="Run this many simulations at once, each pinned to its own "
+             "cores and working in its own directory under --scratch.")
     parser.add_argument(
         "--protein", default=None,
         help="Always choose this protein from the gromppery.")
     parser.add_argument(
         "--iterations", default=None, type=int,
         help="Terminate after simulating this number of trajectories.")
+    parser.add_argument(
+        "--pipeline", action='store_true',
+        help="Download the next work unit and upload the last one while "
+             "each work unit runs, rather than one after the other.")
+    parser.add_argument(
+        "--tpr-cache", default=None,
+        help="Keep downloaded tprs in this directory, and only download "
+             "them again when they change on the gromppery.")
 
     args = parser.parse_args(argv[1:])
 
+    if args.slots < 1:
+        parser.error("--slots must be at least 1.")
+
+    if args.slots > 1:
+        if args.nt is None:
+            args.nt = os.cpu_count() // args.slots
+        if args.nt < 1 or args.nt * args.slots > os.cpu_count():
+            parser.error(
+                "%s slots of %s threads don't fit on %s cores." %
+                (args.slots, args.nt, os.cpu_count()))
+
     if args.iterations is None:
         args.iterations = itertools.count()
     else:
@@ -46,32 +106,110 @@ def process_command_line(argv):
 
 def get_tpr_manifest(gromppery):
     '''Connect to the gromppery and get the manifest of availiable tpr
-    tags.
+    tags: a dict mapping the name of each active project to the sha256
+    of its tpr (None if every work unit gets a different tpr).
     '''
 
     url = '/'.join([gromppery, 'tprs.json'])
 
-    tag_list = json.loads(requests.get(url).content.decode('utf-8'))
+    r = requests.get(url)
+    r.raise_for_status()
+
+    return r.json()
+
+
+def request_work(gromppery, hostname=None):
+    '''Ask the gromppery for a lease on a work unit of whichever project
+    most needs one. Returns the lease, whose 'project' is the project's
+    name, or None if no project needs more work.
+    '''
+
+    url = '/'.join([gromppery, 'next-work/'])
+
+    r = requests.post(
+        url, json={'hostname': platform.node() if hostname is None
+                   else hostname})
+
+    if r.status_code == 204:
+        return None
+    r.raise_for_status()
+
+    return r.json()
+
 
-    return tag_list
+def replace_file(fname, content):
+    '''Atomically replace fname with content (bytes). The content is
+    written to a temporary file of its own next to fname first, so slots
+    sharing a directory (e.g. a --tpr-cache) can't write into each
+    other's.
+    '''
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname) or '.',
+                               prefix=os.path.basename(fname)+'.',
+                               suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, fname)
+    finally:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
 
 
-def get_work(gromppery, tag):
+def get_work(gromppery, tag, tpr_cache=None):
     '''Connect to the gromppery and download a the specified tpr.
+
+    If tpr_cache is a directory, the tpr and its ETag are kept there,
+    and later calls only download the tpr again if the gromppery's copy
+    has changed.
     '''
 
     url = '/'.join([gromppery, 'tprs', tag+'.tpr'])
-    r = requests.get(url)
+
+    headers = {'Accept-Encoding': ', '.join(ENCODINGS)}
+    if tpr_cache is not None:
+        cached_tpr = os.path.join(tpr_cache, tag+'.tpr')
+        cached_etag = os.path.join(tpr_cache, tag+'.etag')
+
+        if os.path.isfile(cached_tpr) and os.path.isfile(cached_etag):
+            with open(cached_etag, 'r') as f:
+                headers['If-None-Match'] = f.read()
+
+    r = requests.get(url, headers=headers)
+
+    if r.status_code == 304:
+        with open(cached_tpr, 'rb') as f:
+            return f.read()
 
     assert r.status_code == 200, \
         "Status on get_work to %s was %s" % (url, r.status_code)
 
-    return r.content
+    # requests undoes gzip itself, but not zstd
+    tpr = r.content
+    if r.headers.get('Content-Encoding') == 'zstd':
+        tpr = zstandard.ZstdDecompressor().decompress(tpr)
+
+    if tpr_cache is not None and 'ETag' in r.headers:
+        os.makedirs(tpr_cache, exist_ok=True)
+        # write the tpr first so we never have an etag without its tpr
+        for fname, content in [(cached_tpr, tpr),
+                               (cached_etag, r.headers['ETag'].encode())]:
+            replace_file(fname, content)
+
+    return tpr
+
 
+def simulate(tpr_fname, nt=None, pinoffset=None):
+    '''Run gmx mdrun on a tpr, writing its output next to it.
 
-def simulate(tpr_fname, nt=None):
+    If there's already a checkpoint there, from an earlier run that was
+    interrupted, mdrun carries on from it and appends to that run's
+    output. If pinoffset is given, mdrun's threads are pinned to
+    consecutive logical cores starting from it, so that simulations
+    running side by side don't compete for cores.
+    '''
 
-    base_name = tpr_fname.rstrip('.tpr')
+    base_name = os.path.splitext(tpr_fname)[0]
 
     files = {
         'xtc': base_name+'.xtc',
@@ -82,7 +220,7 @@ def simulate(tpr_fname, nt=None):
         'tpr': tpr_fname
     }
 
-    mdrun_call = map(str, [
+    mdrun_call = [
         'gmx', 'mdrun',
         '-s', files['tpr'],
         '-x', files['xtc'],
@@ -90,12 +228,19 @@ def simulate(tpr_fname, nt=None):
         '-g', files['log'],
         '-cpo', files['cpt'],
         '-c', files['gro'],
-        '-v'])
+        '-v']
 
+    if os.path.isfile(files['cpt']):
+        mdrun_call.extend(['-cpi', files['cpt'], '-append'])
     if nt is not None:
         mdrun_call.extend(['-nt', nt])
+    if pinoffset is not None:
+        # left to itself, mdrun may skip hyperthreads when pinning,
+        # which would spill into the cores of the next slot up
+        mdrun_call.extend(['-pin', 'on', '-pinoffset', pinoffset,
+                           '-pinstride', 1])
 
-    p = subprocess.check_output(mdrun_call)
+    p = subprocess.check_output([str(a) for a in mdrun_call])
 
     # p.wait()
     # if p.poll() != 0:
@@ -126,11 +271,15 @@ def submit_work(gromppery, tag, files, hostname=None):
     url = '/'.join([gromppery, 'tprs', tag, 'submit/'])
     print(url)
 
-    r = requests.post(
-        url,
-        data={'hostname': platform.node() if hostname is None else hostname},
-        files={t: open(files[t], 'rb') for t
-               in ['xtc', 'cpt', 'gro', 'log', 'edr', 'tpr']})
+    with tempfile.TemporaryDirectory() as tmp:
+        files, _ = compress_files(files, server_encodings(url), tmp)
+
+        r = requests.post(
+            url,
+            data={'hostname': platform.node() if hostname is None
+                  else hostname},
+            files={t: open(files[t], 'rb') for t
+                   in ['xtc', 'cpt', 'gro', 'log', 'edr', 'tpr']})
 
     # assert r.status_code == 201, r
     try:
@@ -141,49 +290,572 @@ def submit_work(gromppery, tag, files, hostname=None):
         raise
 
 
-def work(gromppery, scratch, protein=None):
-    '''The main logic of the program. Downloads, runs and submits a
-    random tpr from the gromppery.
+def server_encodings(url):
+    """The content codings the gromppery accepts for uploads to url, as
+    advertised in its Accept-Encoding response header.
+    """
+
+    r = requests.options(url)
+    return [e.strip() for e in r.headers.get('Accept-Encoding', '').split(',')
+            if e.strip()]
+
+
+def compress_files(files, encodings, workdir):
+    """Compress the files worth compressing with the best content coding
+    that both we and the gromppery support.
+
+    Parameters
+    ----------
+    files: dict
+        Paths to the files of a work unit, by type.
+    encodings: list of str
+        Content codings the gromppery accepts.
+    workdir: str
+        Directory to write the compressed copies to.
+
+    Returns
+    -------
+    files: dict
+        Paths to the files to send instead. Compressed files' names end
+        in the coding's suffix, which is how the gromppery recognizes
+        them.
+    used: dict
+        The coding used for each file that was compressed.
+    """
+
+    encoding = next((e for e in ENCODINGS if e in encodings), None)
+    if encoding is None:
+        return files, {}
+
+    files = dict(files)
+    used = {}
+    for ftype in COMPRESSIBLE_FILE_TYPES:
+        out = os.path.join(
+            workdir, os.path.basename(files[ftype]) + SUFFIXES[encoding])
+
+        with open(files[ftype], 'rb') as fin, open(out, 'wb') as fout:
+            if encoding == 'zstd':
+                zstandard.ZstdCompressor().copy_stream(fin, fout)
+            else:
+                # no name or mtime, so the output (and its hash) is the
+                # same every time
+                with gzip.GzipFile(filename='', mode='wb', fileobj=fout,
+                                   mtime=0) as gz:
+                    shutil.copyfileobj(fin, gz)
+
+        files[ftype] = out
+        used[ftype] = encoding
+
+    return files, used
+
+
+def file_sha256(fname):
+
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def upload_work(gromppery, tag, files, hostname=None, state_file=None,
+                chunk_size=CHUNK_SIZE, retries=5):
+    """Submit a (presumably finished) simulation to the gromppery in
+    chunks, resuming where it left off if the connection drops. Files
+    that compress well are compressed first, if the gromppery accepts
+    compressed uploads.
+
+    Parameters
+    ----------
+    gromppery: str
+        URL where the gromppery is found.
+    tag: str
+        Name of the project to which the work unit should be submitted.
+    files: dict
+        Dictionary of paths to files that will be uploaded. Requires
+        keys: ['xtc', 'cpt', 'gro', 'log', 'edr', 'tpr'].
+    hostname: str, default=None
+        Name of this host under which to submit the finished simulation.
+        If none, hostname will automatically be determined by
+        platform.node().
+    state_file: str, default=None
+        If given, the upload's URL is recorded here, so that an upload
+        interrupted by this process dying is picked up again by the
+        next call with the same state_file and files.
+    chunk_size: int, default=CHUNK_SIZE
+        Number of bytes to send per request.
+    retries: int, default=5
+        Give up after this many consecutive failed requests.
+    """
+
+    url = '/'.join([gromppery, 'uploads/'])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files, encodings = compress_files(files, server_encodings(url), tmp)
+
+        return resume_upload(url, tag, files, encodings, hostname,
+                             state_file, chunk_size, retries)
+
+
+def resume_upload(url, tag, files, encodings, hostname, state_file,
+                  chunk_size, retries):
+    """Carry out (or carry on with) an upload. See upload_work.
+    """
+
+    declared = [{'kind': t, 'size': os.path.getsize(files[t]),
+                 'sha256': file_sha256(files[t]),
+                 'encoding': encodings.get(t, '')}
+                for t in SUBMISSION_FILE_TYPES]
+
+    upload = None
+    if state_file is not None and os.path.isfile(state_file):
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+
+        if state['files'] == declared:
+            r = requests.get(state['url'])
+            if r.status_code == 200 and r.json()['pending'] is None:
+                upload = r.json()
+
+    if upload is None:
+        r = requests.post(
+            url,
+            json={'project': tag,
+                  'hostname': platform.node() if hostname is None
+                  else hostname,
+                  'files': declared})
+        r.raise_for_status()
+        upload = r.json()
+
+        if state_file is not None:
+            with open(state_file, 'w') as f:
+                json.dump({'url': upload['url'], 'files': declared}, f)
+
+    failures = 0
+    while True:
+        missing = [(f['kind'], start, end)
+                   for f in upload['files'] for start, end in f['missing']]
+        if not missing:
+            break
+
+        try:
+            for kind, start, end in missing:
+                send_chunks(upload['url'], kind, files[kind], start, end,
+                            chunk_size)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            failures += 1
+            if failures > retries:
+                raise
+            print("Upload interrupted (%s), retrying." % e)
+            time.sleep(2 ** failures)
+
+        # the server knows best what has actually arrived
+        r = requests.get(upload['url'])
+        r.raise_for_status()
+        upload = r.json()
+
+    r = requests.post(upload['url'] + 'finalize/')
+    r.raise_for_status()
+
+    if state_file is not None:
+        os.remove(state_file)
+
+    return r
+
+
+def send_chunks(url, kind, fname, start, end, chunk_size):
+    """Send bytes [start, end) of a file to an upload, a chunk at a time.
+    """
+
+    size = os.path.getsize(fname)
+
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        for offset in range(start, end, chunk_size):
+            data = f.read(min(chunk_size, end - offset))
+            r = requests.put(
+                url + 'files/%s/' % kind, data=data,
+                headers={'Content-Type': 'application/octet-stream',
+                         'Content-Range': 'bytes %s-%s/%s' % (
+                             offset, offset + len(data) - 1, size)})
+            r.raise_for_status()
+
+
+def make_workdir(scratch):
+    '''Make a new directory in scratch, with a name like
+    YEAR-MONTH-DAY-HASH, to run a work unit in.
+    '''
+
+    dirtries = 10
+    for i in range(dirtries):
+        md5 = hashlib.md5(str(datetime.datetime.now().timestamp()) \
+            .encode('utf-8')).hexdigest()[0:4]
+        dirname = os.path.join(
+            scratch,
+            str(datetime.datetime.now().date()) + '-' + md5)
+
+        try:
+            os.mkdir(dirname)
+        except FileExistsError as e:
+            if i < dirtries - 1:
+                continue
+            else:
+                raise e
+        else:
+            return dirname
+
+
+def fetch_work(gromppery, scratch, protein=None, tpr_cache=None):
+    '''Choose a project (protein, or the one the gromppery says needs
+    work most) and download a tpr for it into scratch. Returns the
+    project's name and the tpr's path.
     '''
 
     if protein is None:
-        tag = random.choice(get_tpr_manifest(gromppery))
+        lease = request_work(gromppery)
+        while lease is None:
+            print("No project needs work; waiting.")
+            time.sleep(NO_WORK_WAIT)
+            lease = request_work(gromppery)
+
+        tag = lease['project']
     else:
         tag = protein
 
     tprname = os.path.join(scratch, tag+'.tpr')
     with open(tprname, 'wb') as f:
-        f.write(get_work(gromppery, tag))
+        f.write(get_work(gromppery, tag, tpr_cache))
 
-    workfiles = simulate(f.name)
-    submit_work(gromppery, tag, workfiles)
+    write_journal(scratch, tag, SIMULATING, {'tpr': tprname})
 
+    return tag, tprname
 
-def main(argv=None):
-    args = process_command_line(argv)
 
-    for i in args.iterations:
-        dirtries = 10
-        for i in range(dirtries):
-            md5 = hashlib.md5(str(datetime.datetime.now().timestamp()) \
-                .encode('utf-8')).hexdigest()[0:4]
-            dirname = os.path.join(
-                args.scratch,
-                str(datetime.datetime.now().date()) + '-' + md5)
+def write_journal(workdir, tag, state, files, attempts=0):
+    '''Record that the work unit in workdir has reached state. The
+    journal is replaced atomically, so it's never left half written.
+    '''
+
+    replace_file(
+        os.path.join(workdir, JOURNAL_NAME),
+        json.dumps({'tag': tag, 'state': state, 'files': files,
+                    'attempts': attempts}).encode())
+
+
+def unfinished_work(scratch):
+    '''Find the work directories in scratch whose work units were
+    started but never submitted, oldest first. Returns a list of
+    (workdir, journal) tuples.
+    '''
+
+    found = []
+    for name in os.listdir(scratch):
+        fname = os.path.join(scratch, name, JOURNAL_NAME)
+        if os.path.isfile(fname):
+            with open(fname, 'r') as f:
+                found.append((os.path.getmtime(fname),
+                              os.path.join(scratch, name), json.load(f)))
+
+    return [(workdir, journal) for _, workdir, journal in sorted(found)]
+
+
+def simulate_work(tag, tprname, nt=None, pinoffset=None):
+    '''Run a downloaded work unit, and note in its journal that it's
+    ready to upload.
+    '''
+
+    files = simulate(tprname, nt, pinoffset)
+    write_journal(os.path.dirname(tprname), tag, UPLOADING, files)
+
+    return files
+
+
+def finish_work(gromppery, tag, files):
+    '''Upload a finished work unit, resuming an earlier attempt if there
+    was one, and then clear its journal.
+    '''
+
+    workdir = os.path.dirname(files['tpr'])
+
+    upload_work(gromppery, tag, files,
+                state_file=os.path.join(workdir, 'upload.json'))
+    os.remove(os.path.join(workdir, JOURNAL_NAME))
+
+
+def resume_work(gromppery, scratch, nt=None, pinoffset=None):
+    '''Carry on with every work unit in scratch that was interrupted
+    (by a crash, or the node being preempted) before it was submitted.
+    Simulations continue from their last checkpoint.
+
+    A work unit that has already been resumed RESUME_ATTEMPTS times is
+    probably failing for reasons of its own, and is left where it is
+    with its journal renamed, rather than being tried forever.
+    '''
+
+    for workdir, journal in unfinished_work(scratch):
+        attempts = journal.get('attempts', 0) + 1
+        if attempts > RESUME_ATTEMPTS:
+            print("Giving up on", workdir)
+            fname = os.path.join(workdir, JOURNAL_NAME)
+            os.replace(fname, fname+'.abandoned')
+            continue
+
+        print("Resuming", workdir)
+        write_journal(workdir, journal['tag'], journal['state'],
+                      journal['files'], attempts)
+
+        files = journal['files']
+        if journal['state'] == SIMULATING:
+            files = simulate_work(journal['tag'], files['tpr'], nt,
+                                  pinoffset)
+
+        finish_work(gromppery, journal['tag'], files)
+        print("Finished", workdir)
+
+
+def work(gromppery, scratch, protein=None, tpr_cache=None, nt=None,
+         pinoffset=None):
+    '''The main logic of the program. Downloads, runs and submits a
+    tpr from the gromppery.
+    '''
+
+    tag, tprname = fetch_work(gromppery, scratch, protein, tpr_cache)
+
+    workfiles = simulate_work(tag, tprname, nt, pinoffset)
+    finish_work(gromppery, tag, workfiles)
+
+
+def pipelined_work(gromppery, scratch, iterations, protein=None,
+                   tpr_cache=None, depth=1, nt=None, pinoffset=None):
+    '''Like calling work() once per iteration, except that the next
+    work unit is downloaded while the current one runs, and finished
+    work units are uploaded in the background while the next one runs.
+
+    Parameters
+    ----------
+    gromppery: str
+        URL where the gromppery is found.
+    scratch: str
+        Directory in which to make a directory for each work unit.
+    iterations: iterable
+        One work unit is run per item.
+    protein: str, default=None
+        Always choose this project, rather than asking the
+        gromppery which one needs work.
+    tpr_cache: str, default=None
+        Directory to cache tprs in; see get_work.
+    depth: int, default=1
+        How many downloaded work units may wait to be run, and how
+        many finished ones may wait to be uploaded.
+    nt, pinoffset: int, default=None
+        Passed on to simulate.
+
+    If any stage fails, no new work units are started, work units that
+    have already finished are still uploaded, and then the error is
+    raised.
+    '''
+
+    fetched = queue.Queue(maxsize=depth)
+    finished = queue.Queue(maxsize=depth)
 
+    stop = threading.Event()
+    simulations_done = threading.Event()
+    errors = []
+
+    def fail(e):
+        errors.append(e)
+        stop.set()
+
+    def put(q, item):
+        # don't block forever on a queue whose consumer has given up
+        while not stop.is_set():
             try:
-                os.mkdir(dirname)
-            except FileExistsError as e:
-                if i < dirtries:
-                    continue
-                else:
-                    raise e
-            else:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetcher():
+        try:
+            for i in iterations:
+                dirname = make_workdir(scratch)
+                if not put(fetched, fetch_work(
+                        gromppery, dirname, protein, tpr_cache)):
+                    return
+        except Exception as e:
+            fail(e)
+
+    def uploader():
+        try:
+            for tag, files in drain(finished, simulations_done.is_set):
+                finish_work(gromppery, tag, files)
+                print("Finished", os.path.dirname(files['tpr']))
+        except Exception as e:
+            fail(e)
+
+    fetch_thread = threading.Thread(target=fetcher, daemon=True)
+    upload_thread = threading.Thread(target=uploader, daemon=True)
+    fetch_thread.start()
+    upload_thread.start()
+
+    try:
+        for tag, tprname in drain(
+                fetched, lambda: not fetch_thread.is_alive()):
+            if stop.is_set():
+                break
+            files = simulate_work(tag, tprname, nt, pinoffset)
+            if not put(finished, (tag, files)):
                 break
+    except BaseException as e:
+        fail(e)
+    finally:
+        simulations_done.set()
+
+    upload_thread.join()
+    stop.set()
+    fetch_thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def drain(q, producer_done):
+    '''Yield items from a queue until producer_done() is true and the
+    queue is empty.
+    '''
+
+    while True:
+        try:
+            yield q.get(timeout=0.1)
+        except queue.Empty:
+            if producer_done() and q.empty():
+                return
+
+
+class SharedIterator:
+    '''Hands out the items of an iterable to several threads, and can
+    be made to stop early.
+    '''
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            if self._stopped:
+                raise StopIteration
+            return next(self._iterator)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+
+
+def run_slot(gromppery, scratch, iterations, protein=None, tpr_cache=None,
+             nt=None, pinoffset=None, pipeline=False):
+    '''Run one work unit per item of iterations, one after the other
+    (or pipelined; see pipelined_work), in work directories made in
+    scratch. Any work units left unfinished in scratch by an earlier run
+    are resumed first, and don't count towards iterations.
+    '''
+
+    resume_work(gromppery, scratch, nt, pinoffset)
+
+    if pipeline:
+        pipelined_work(gromppery, scratch, iterations, protein, tpr_cache,
+                       nt=nt, pinoffset=pinoffset)
+        return
 
-        work(args.gromppery, dirname, args.protein)
+    for i in iterations:
+        dirname = make_workdir(scratch)
+
+        work(gromppery, dirname, protein, tpr_cache, nt, pinoffset)
         print("Finished", dirname)
 
+
+def slotted_work(gromppery, scratch, iterations, slots, nt, protein=None,
+                 tpr_cache=None, pipeline=False):
+    '''Run several slots (see run_slot) side by side, sharing the
+    iterations out between them.
+
+    Slot i works in scratch/slot-i and is pinned to nt cores starting
+    from core i*nt, so no two slots share a core. If any slot fails,
+    the rest finish the work unit they are on and stop, and then the
+    error is raised.
+
+    Parameters
+    ----------
+    gromppery: str
+        URL where the gromppery is found.
+    scratch: str
+        Directory in which to make each slot's directory.
+    iterations: iterable
+        One work unit is run per item, by whichever slot is free.
+    slots: int
+        Number of simulations to run at once.
+    nt: int
+        Number of threads (and cores) for each slot's mdrun.
+    protein: str, default=None
+        Always choose this project, rather than asking the
+        gromppery which one needs work.
+    tpr_cache: str, default=None
+        Directory to cache tprs in; see get_work.
+    pipeline: bool, default=False
+        Pipeline each slot's transfers; see pipelined_work.
+    '''
+
+    iterations = SharedIterator(iterations)
+    errors = []
+
+    def slot(i, slot_scratch):
+        try:
+            run_slot(gromppery, slot_scratch, iterations, protein,
+                     tpr_cache, nt=nt, pinoffset=i*nt, pipeline=pipeline)
+        except Exception as e:
+            print("Slot %s failed: %r" % (i, e))
+            errors.append(e)
+            iterations.stop()
+
+    threads = []
+    for i in range(slots):
+        slot_scratch = os.path.join(scratch, 'slot-%s' % i)
+        os.makedirs(slot_scratch, exist_ok=True)
+
+        threads.append(threading.Thread(
+            target=slot, args=(i, slot_scratch), daemon=True))
+        threads[-1].start()
+
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        # mdrun got the interrupt too; let the slots wind down
+        iterations.stop()
+        raise
+
+    if errors:
+        raise errors[0]
+
+
+def main(argv=None):
+    args = process_command_line(argv)
+
+    if args.slots > 1:
+        slotted_work(args.gromppery, args.scratch, args.iterations,
+                     args.slots, args.nt, args.protein, args.tpr_cache,
+                     args.pipeline)
+    else:
+        run_slot(args.gromppery, args.scratch, args.iterations,
+                 args.protein, args.tpr_cache, nt=args.nt,
+                 pipeline=args.pipeline)
+
     return 0
 
 if __name__ == "__main__":
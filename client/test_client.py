@@ -1,16 +1,20 @@
+import io
 import os
+import itertools
 import shutil
 import tempfile
 
 from django.conf import settings
 from django.test import override_settings
+from django.core.management import call_command
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
 
-from tprs.models import Project, Submission
+from tprs.models import Project, Submission, Upload, Lease
 from . import gromppery_client as client
 
 
-@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'),
+                   TPR_POOL_DEPTH=0)
 class ClientTests(StaticLiveServerTestCase):
 
     def setUp(self):
@@ -69,6 +73,8 @@ class ClientTests(StaticLiveServerTestCase):
             tag=self.project.name,
             files=files)
 
+        call_command('validatesubmissions')
+
         self.assertEqual(Submission.objects.count(), 1)
 
         sub = Submission.objects.first()
@@ -76,6 +82,328 @@ class ClientTests(StaticLiveServerTestCase):
             self.assertEqual(getattr(sub, ftype).read(),
                              open(testfile, 'rb').read())
 
+    def test_upload_resumes(self):
+
+        submission_dir = os.path.join(
+            settings.BASE_DIR, 'testdata', 'submission')
+
+        files = {
+            'xtc': os.path.join(submission_dir, 'plcg_sh2_wt.xtc'),
+            'edr': os.path.join(submission_dir, 'plcg_sh2_wt.edr'),
+            'log': os.path.join(submission_dir, 'plcg_sh2_wt.log'),
+            'cpt': os.path.join(submission_dir, 'plcg_sh2_wt.cpt'),
+            'gro': os.path.join(submission_dir, 'plcg_sh2_wt.gro'),
+            'tpr': os.path.join(settings.BASE_DIR, 'testdata',
+                                'plcg_sh2_wt.tpr')
+        }
+        state_file = os.path.join(self.scratchpath, 'upload.json')
+
+        # drop the connection after the first chunk
+        sent = []
+        put = client.requests.put
+
+        def flaky_put(*args, **kwargs):
+            if sent:
+                raise client.requests.ConnectionError("Connection dropped.")
+            sent.append(kwargs['headers']['Content-Range'])
+            return put(*args, **kwargs)
+
+        client.requests.put = flaky_put
+        try:
+            with self.assertRaises(client.requests.ConnectionError):
+                client.upload_work(
+                    self.live_server_url + '/api', self.project.name, files,
+                    state_file=state_file, chunk_size=16384, retries=0)
+        finally:
+            client.requests.put = put
+
+        self.assertTrue(os.path.isfile(state_file))
+        self.assertEqual(Submission.objects.count(), 0)
+
+        client.upload_work(
+            self.live_server_url + '/api', self.project.name, files,
+            state_file=state_file, chunk_size=16384)
+
+        self.assertFalse(os.path.isfile(state_file))
+        upload = Upload.objects.get()
+        self.assertIsNotNone(upload.pending)
+        self.assertEqual(upload.files.get(kind='log').encoding,
+                         client.ENCODINGS[0])
+        self.assertEqual(upload.files.get(kind='xtc').encoding, '')
+
+        call_command('validatesubmissions', stdout=io.StringIO())
+
+        sub = Submission.objects.get()
+        for ftype, testfile in files.items():
+            self.assertEqual(getattr(sub, ftype).read(),
+                             open(testfile, 'rb').read())
+
+    def test_get_work_cached(self):
+
+        fixed_mdp = os.path.join(settings.MEDIA_ROOT, 'testdata', 'fixed.mdp')
+        with open(fixed_mdp, 'w') as mdp:
+            with open(self.project.mdp.path, 'r') as f:
+                for line in f.readlines():
+                    if 'gen_vel' in line.split():
+                        mdp.write('gen_vel = no\n')
+                    else:
+                        mdp.write(line)
+
+        self.project.mdp = fixed_mdp
+        self.project.save()
+
+        tpr_cache = os.path.join(self.scratchpath, 'tprs')
+
+        tpr = client.get_work(self.live_server_url + '/api',
+                              self.project.name, tpr_cache)
+
+        self.assertEqual(tpr, self.project.grompp().read())
+        with open(os.path.join(tpr_cache, self.project.name+'.tpr'),
+                  'rb') as f:
+            self.assertEqual(f.read(), tpr)
+        with open(os.path.join(tpr_cache, self.project.name+'.etag'),
+                  'r') as f:
+            # tagged as the compressed representation the client asked for
+            self.assertEqual(f.read(), '"%s-%s"' % (
+                self.project.tpr_digest(), client.ENCODINGS[0]))
+        # no temporary files left behind
+        self.assertEqual(sorted(os.listdir(tpr_cache)),
+                         [self.project.name+'.etag', self.project.name+'.tpr'])
+
+        self.assertEqual(
+            client.get_work(self.live_server_url + '/api',
+                            self.project.name, tpr_cache),
+            tpr)
+
+    def fake_simulate(self, tpr_fname, nt=None, pinoffset=None):
+        """Stand in for a run of mdrun, by copying the test submission's
+        output files next to tpr_fname.
+        """
+
+        submission_dir = os.path.join(
+            settings.BASE_DIR, 'testdata', 'submission')
+
+        files = {'tpr': tpr_fname}
+        for ftype in ['xtc', 'edr', 'log', 'cpt', 'gro']:
+            files[ftype] = tpr_fname[:-len('.tpr')] + '.' + ftype
+            shutil.copyfile(
+                os.path.join(submission_dir, 'plcg_sh2_wt.' + ftype),
+                files[ftype])
+
+        return files
+
+    def test_pipeline(self):
+
+        simulate = client.simulate
+        client.simulate = self.fake_simulate
+        try:
+            client.pipelined_work(
+                self.live_server_url + '/api', self.scratchpath, range(3),
+                protein=self.project.name)
+        finally:
+            client.simulate = simulate
+
+        self.assertEqual(len(os.listdir(self.scratchpath)), 3)
+
+        call_command('validatesubmissions', stdout=io.StringIO())
+        self.assertEqual(Submission.objects.count(), 3)
+
+    def test_pipeline_upload_failure(self):
+
+        def broken_upload(*args, **kwargs):
+            raise RuntimeError("Upload failed.")
+
+        simulate, upload_work = client.simulate, client.upload_work
+        client.simulate = self.fake_simulate
+        client.upload_work = broken_upload
+        try:
+            # stops, rather than hanging or running forever
+            with self.assertRaises(RuntimeError):
+                client.pipelined_work(
+                    self.live_server_url + '/api', self.scratchpath,
+                    itertools.count(), protein=self.project.name)
+        finally:
+            client.simulate, client.upload_work = simulate, upload_work
+
+        self.assertEqual(Submission.objects.count(), 0)
+
+    def test_simulate_args(self):
+
+        calls = []
+        check_output = client.subprocess.check_output
+        client.subprocess.check_output = calls.append
+        try:
+            files = client.simulate(
+                os.path.join(self.scratchpath, 'trp.tpr'), nt=8, pinoffset=16)
+        finally:
+            client.subprocess.check_output = check_output
+
+        self.assertEqual(files['xtc'],
+                         os.path.join(self.scratchpath, 'trp.xtc'))
+
+        args = calls[0]
+        self.assertEqual(args[args.index('-nt') + 1], '8')
+        self.assertEqual(args[args.index('-pin') + 1], 'on')
+        self.assertEqual(args[args.index('-pinoffset') + 1], '16')
+        self.assertEqual(args[args.index('-pinstride') + 1], '1')
+
+    def test_slots(self):
+
+        runs = []
+
+        def simulate(tpr_fname, nt=None, pinoffset=None):
+            runs.append((tpr_fname, nt, pinoffset))
+            return self.fake_simulate(tpr_fname, nt, pinoffset)
+
+        real_simulate = client.simulate
+        client.simulate = simulate
+        try:
+            client.slotted_work(
+                self.live_server_url + '/api', self.scratchpath, range(4),
+                slots=2, nt=3, protein=self.project.name)
+        finally:
+            client.simulate = real_simulate
+
+        self.assertEqual(len(runs), 4)
+        for tpr_fname, nt, pinoffset in runs:
+            # each slot keeps to its own cores and its own directory
+            slot = os.path.relpath(tpr_fname, self.scratchpath).split(
+                os.sep)[0]
+            self.assertEqual(nt, 3)
+            self.assertEqual(slot, 'slot-%s' % (pinoffset // 3))
+
+        call_command('validatesubmissions', stdout=io.StringIO())
+        self.assertEqual(Submission.objects.count(), 4)
+
+    def test_slots_mdrun_args(self):
+
+        calls = []
+
+        def check_output(args):
+            calls.append(args)
+            self.fake_simulate(args[args.index('-s') + 1])
+
+        real_check_output = client.subprocess.check_output
+        client.subprocess.check_output = check_output
+        try:
+            client.slotted_work(
+                self.live_server_url + '/api', self.scratchpath, range(2),
+                slots=2, nt=3, protein=self.project.name)
+        finally:
+            client.subprocess.check_output = real_check_output
+
+        self.assertEqual(len(calls), 2)
+        for args in calls:
+            base = args[args.index('-s') + 1][:-len('.tpr')]
+            slot = int(os.path.relpath(base, self.scratchpath).split(
+                os.sep)[0][len('slot-'):])
+
+            # each slot gets the next three logical cores, and no others
+            self.assertEqual(args, [
+                'gmx', 'mdrun',
+                '-s', base + '.tpr',
+                '-x', base + '.xtc',
+                '-e', base + '.edr',
+                '-g', base + '.log',
+                '-cpo', base + '.cpt',
+                '-c', base + '.gro',
+                '-v',
+                '-nt', '3',
+                '-pin', 'on', '-pinoffset', str(3 * slot),
+                '-pinstride', '1'])
+
+        self.assertEqual(sorted(args[args.index('-pinoffset') + 1]
+                                for args in calls), ['0', '3'])
+
+    def test_slots_args(self):
+
+        cores = os.cpu_count()
+
+        def parse(*args):
+            return client.process_command_line(
+                ['gromppery_client.py', '--gromppery', 'http://localhost',
+                 '--scratch', self.scratchpath] + list(args))
+
+        # mdrun decides for itself, unless there are several slots
+        self.assertIsNone(parse().nt)
+        if cores > 1:
+            self.assertEqual(parse('--slots', str(cores)).nt, 1)
+
+        with self.assertRaises(SystemExit):
+            parse('--slots', str(cores + 1))
+
+    def test_resume(self):
+
+        workdir = client.make_workdir(self.scratchpath)
+        tag, tprname = client.fetch_work(
+            self.live_server_url + '/api', workdir, self.project.name)
+
+        # the node went down part way through mdrun
+        with open(os.path.join(workdir, 'plcg_sh2_wt.cpt'), 'wb') as f:
+            f.write(b'partial')
+
+        calls = []
+
+        def mdrun(args):
+            calls.append(args)
+            self.fake_simulate(tprname)
+
+        check_output = client.subprocess.check_output
+        client.subprocess.check_output = mdrun
+        try:
+            client.resume_work(self.live_server_url + '/api',
+                               self.scratchpath)
+        finally:
+            client.subprocess.check_output = check_output
+
+        self.assertEqual(len(calls), 1)
+        self.assertIn('-append', calls[0])
+        self.assertEqual(calls[0][calls[0].index('-cpi') + 1],
+                         os.path.join(workdir, 'plcg_sh2_wt.cpt'))
+
+        self.assertEqual(client.unfinished_work(self.scratchpath), [])
+        call_command('validatesubmissions', stdout=io.StringIO())
+        self.assertEqual(Submission.objects.count(), 1)
+
+    def test_resume_gives_up(self):
+
+        workdir = client.make_workdir(self.scratchpath)
+        client.write_journal(
+            workdir, self.project.name, client.SIMULATING,
+            {'tpr': os.path.join(workdir, 'plcg_sh2_wt.tpr')},
+            attempts=client.RESUME_ATTEMPTS)
+
+        client.resume_work(self.live_server_url + '/api', self.scratchpath)
+
+        self.assertEqual(client.unfinished_work(self.scratchpath), [])
+        self.assertTrue(os.path.isfile(os.path.join(
+            workdir, client.JOURNAL_NAME + '.abandoned')))
+
+    def test_get_tpr_manifest(self):
+
+        manifest = client.get_tpr_manifest(self.live_server_url + '/api')
+
+        # the test project generates velocities, so has no single tpr
+        self.assertEqual(manifest, {self.project.name: None})
+
+    def test_next_work(self):
+
+        workdir = client.make_workdir(self.scratchpath)
+
+        simulate = client.simulate
+        client.simulate = self.fake_simulate
+        try:
+            # no protein given, so the gromppery chooses
+            client.work(self.live_server_url + '/api', workdir)
+        finally:
+            client.simulate = simulate
+
+        call_command('validatesubmissions', stdout=io.StringIO())
+
+        lease = Lease.objects.get()
+        self.assertEqual(lease.project, self.project)
+        self.assertEqual(lease.submission, Submission.objects.get())
+
     def test_run(self):
 
         client.main([
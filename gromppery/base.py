@@ -81,6 +81,53 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 100
 }
 
+# Number of pre-built TPRs to keep on hand for each project that
+# generates random velocities (see tprs.pool). 0 disables the pool.
+TPR_POOL_DEPTH = 8
+
+# If True, submissions are spooled to disk and acknowledged with a 202;
+# they are validated afterwards by `./manage.py validatesubmissions`,
+# which must then be kept running. If False, they are validated during
+# the upload request.
+ASYNC_SUBMISSIONS = False
+
+# Seconds to wait before retrying an upload whose validation failed with
+# an error (rather than a verdict), doubling after each failure up to
+# VALIDATION_RETRY_MAX_DELAY.
+VALIDATION_RETRY_DELAY = 60
+VALIDATION_RETRY_MAX_DELAY = 60 * 60
+
+# If True, uploaded xtc, gro and cpt files are checked with `gmx check`
+# rather than by reading their headers in-process (see tprs.formats),
+# and their atom counts aren't compared with the project's.
+GMX_CHECK_UPLOADS = False
+
+# Largest size (in bytes) that a compressed upload may decompress to.
+# Bigger ones are rejected part way through decompressing, before they
+# can fill the disk. None for no limit.
+MAX_DECOMPRESSED_UPLOAD = 8 * 1024 ** 3
+
+# How long (in seconds) a client has to submit a work unit handed out by
+# the next-work endpoint before it is handed out again (see
+# tprs.scheduler).
+LEASE_DURATION = 24 * 60 * 60
+
+# Directory that `./manage.py tier` moves submission files to under a
+# RetentionRule with the "cold" action (see tprs.tiering). Typically a
+# slower, larger volume than MEDIA_ROOT.
+COLD_STORAGE_ROOT = None
+
+# If True, each new alignment's per-frame features (see tprs.features)
+# are computed as soon as it is stored, which needs mdtraj (see
+# requirements-optional.txt). Either way, `./manage.py featurize`
+# computes any that are missing or out of date.
+FEATURIZE_ALIGNMENTS = False
+
+# How long (in seconds) each process may serve its cached copy of the
+# tprs.json manifest before rebuilding it. Saving or deleting a project
+# rebuilds it straight away in the process that did so.
+MANIFEST_CACHE_TIMEOUT = 60
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.10/topics/i18n/
 
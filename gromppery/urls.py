@@ -22,10 +22,27 @@ from tprs import views
 
 router = routers.DefaultRouter()
 router.register(r'tprs', views.ProjectViewSet)
+router.register(r'pending', views.PendingSubmissionViewSet)
+router.register(r'uploads', views.UploadViewSet)
+router.register(r'stats', views.ProjectStatisticsViewSet)
+router.register(r'leases', views.LeaseViewSet)
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^api/tprs/(?P<protein>[\w-]+).tpr$', views.tpr, name='tpr-generate'),
+    url(r'^api/next-work/$', views.next_work, name='next-work'),
+    url(r'^api/tprs/(?P<protein>[\w-]+)/aligned\.xtc$', views.aligned_xtc,
+        name='aligned-xtc'),
+    url(r'^api/alignments/(?P<pk>[0-9]+)/slice\.xtc$', views.alignment_slice,
+        name='alignment-slice'),
+    url(r'^api/submissions/(?P<pk>[0-9]+)/slice\.xtc$',
+        views.submission_slice, name='submission-slice'),
+    url(r'^api/tprs/(?P<protein>[\w-]+)/features\.json$',
+        views.feature_index, name='feature-index'),
+    url(r'^api/alignments/(?P<pk>[0-9]+)/features\.npy$',
+        views.alignment_features, name='alignment-features'),
+    # before the router, whose project list would otherwise answer this
+    url(r'^api/tprs\.json$', views.manifest, name='tpr-manifest'),
     url(r'^api/', include(router.urls)),
     url(r'^api-auth/', include('rest_framework.urls',
                                namespace='rest_framework'))
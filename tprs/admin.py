@@ -1,12 +1,27 @@
 from django.contrib import admin
 
-from .models import Project, Submission, Alignment
+from .models import (
+    Project, Submission, Alignment, PendingSubmission, Upload, Lease,
+    RetentionRule, ArchivedFile, ProjectFeature, FeatureSet)
+
+
+class RetentionRuleInline(admin.TabularInline):
+    model = RetentionRule
+    extra = 0
+
+
+class ProjectFeatureInline(admin.TabularInline):
+    model = ProjectFeature
+    extra = 0
 
 
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
+    inlines = (RetentionRuleInline, ProjectFeatureInline)
     # date_hierarchy = ('created',)
-    list_display = ('__str__', 'n_submissions', 'created', 'mdp', 'top', 'gro')
+    list_display = ('__str__', 'n_submissions', 'active', 'weight',
+                    'target_time', 'created', 'mdp', 'top', 'gro')
+    list_select_related = ('statistics',)
     search_fields = ('name', 'mdp', 'top', 'gro')
     readonly_fields = ('created',)
 
@@ -16,6 +31,7 @@ class SubmissionAdmin(admin.ModelAdmin):
     # date_hierarchy = ('created',)
     list_display = ('__str__', 'hostname', 'project', 'index',
                     'created', 'alignment')
+    list_select_related = ('project', 'alignment')
     list_filter = ('hostname', 'project__name',
                    ('alignment', admin.BooleanFieldListFilter),)
     search_fields = ('project__name', 'hostname', 'project__mdp',
@@ -28,6 +44,7 @@ class AlignmentAdmin(admin.ModelAdmin):
     # date_hierarchy = ('created',)
     list_display = ('__str__', 'project', 'tpr_subset', 'group',
                     'created', 'group_pdb')
+    list_select_related = ('submission__project',)
     list_filter = ('submission__project__name',
                    'submission__hostname')
     lookup_allowed = ('submission__project__name',
@@ -39,3 +56,50 @@ class AlignmentAdmin(admin.ModelAdmin):
                      'submission__project__top',
                      'submission__project__gro',)
     readonly_fields = ('tpr_subset', 'group', 'tpr_subset', 'created')
+
+
+@admin.register(PendingSubmission)
+class PendingSubmissionAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'hostname', 'project', 'status',
+                    'attempts', 'created', 'submission')
+    list_filter = ('status', 'hostname', 'project__name')
+    search_fields = ('project__name', 'hostname', 'detail')
+    readonly_fields = ('created',)
+
+
+@admin.register(Upload)
+class UploadAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'hostname', 'project', 'created', 'updated',
+                    'pending')
+    list_filter = ('hostname', 'project__name')
+    search_fields = ('project__name', 'hostname')
+    readonly_fields = ('created', 'updated')
+
+
+@admin.register(Lease)
+class LeaseAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'hostname', 'project', 'created', 'expires',
+                    'submission')
+    list_select_related = ('project', 'submission')
+    list_filter = ('hostname', 'project__name')
+    search_fields = ('project__name', 'hostname')
+    readonly_fields = ('created',)
+
+
+@admin.register(ArchivedFile)
+class ArchivedFileAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'kind', 'action', 'size', 'encoding',
+                    'created')
+    list_select_related = ('submission__project',)
+    list_filter = ('action', 'kind', 'submission__project__name')
+    search_fields = ('submission__project__name', 'path', 'sha256')
+    readonly_fields = ('created',)
+
+
+@admin.register(FeatureSet)
+class FeatureSetAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'n_frames', 'columns_json', 'updated')
+    list_select_related = ('alignment__submission__project',)
+    list_filter = ('alignment__submission__project__name',)
+    search_fields = ('alignment__submission__project__name', 'array')
+    readonly_fields = ('updated',)
@@ -0,0 +1,165 @@
+"""On-disk caches for files that are expensive to produce with gmx.
+
+Entries are keyed by a hash of everything that went into building them
+(file contents, GROMACS version, ...), so they never have to be
+invalidated explicitly: when a project's files change, its key changes
+and the next request builds a new entry.
+"""
+
+import os
+import fcntl
+import collections
+import hashlib
+import logging
+import tempfile
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# path -> (mtime, size, sha256 of the file's contents), least recently
+# used first; only the last FILE_DIGESTS_SIZE paths are remembered
+FILE_DIGESTS_SIZE = 1024
+_FILE_DIGESTS = collections.OrderedDict()
+_FILE_DIGESTS_LOCK = threading.Lock()
+
+
+def cache_root():
+    """The directory under which all caches are kept. Defaults to
+    MEDIA_ROOT/cache unless GROMPPERY_CACHE_ROOT is set.
+    """
+
+    root = getattr(settings, 'GROMPPERY_CACHE_ROOT', None)
+    if root is None:
+        root = os.path.join(settings.MEDIA_ROOT, 'cache')
+
+    return root
+
+
+def digest(*parts):
+    """Compute a sha256 hex digest over several strings or byte strings.
+
+    Each part is length-prefixed so that ('ab', 'c') and ('a', 'bc')
+    hash differently.
+    """
+
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        h.update(str(len(part)).encode('ascii') + b':')
+        h.update(part)
+
+    return h.hexdigest()
+
+
+def file_digest(path):
+    """Compute the sha256 hex digest of the contents of the file at
+    path. Results for the most recently used paths are remembered for
+    as long as the file's mtime and size are unchanged, so repeated
+    calls don't re-read large files.
+    """
+
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+
+    with _FILE_DIGESTS_LOCK:
+        entry = _FILE_DIGESTS.get(path)
+        if entry is not None and entry[:2] == stamp:
+            _FILE_DIGESTS.move_to_end(path)
+            return entry[2]
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+
+    with _FILE_DIGESTS_LOCK:
+        # replaces any entry for an older version of the file
+        _FILE_DIGESTS[path] = stamp + (h.hexdigest(),)
+        _FILE_DIGESTS.move_to_end(path)
+        while len(_FILE_DIGESTS) > FILE_DIGESTS_SIZE:
+            _FILE_DIGESTS.popitem(last=False)
+
+    return h.hexdigest()
+
+
+class FileCache(object):
+    """A directory of files, each named by its key.
+
+    Builds are single-flight: if several threads or processes ask for
+    the same missing key at once, one of them builds it while the rest
+    wait on a lock file and then read the result.
+
+    Parameters
+    ----------
+    namespace : str
+        Subdirectory of the cache root holding this cache's entries.
+    suffix : str, default=''
+        Extension given to each entry's file name.
+    """
+
+    def __init__(self, namespace, suffix=''):
+        self.namespace = namespace
+        self.suffix = suffix
+
+    @property
+    def root(self):
+        return os.path.join(cache_root(), self.namespace)
+
+    def path(self, key):
+        return os.path.join(self.root, key + self.suffix)
+
+    def get(self, key):
+        """Return the data stored under key, or None if it isn't cached.
+        """
+
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        """Atomically store data under key.
+        """
+
+        os.makedirs(self.root, exist_ok=True)
+
+        fd, tmpname = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmpname, self.path(key))
+        except:
+            os.remove(tmpname)
+            raise
+
+    def get_or_build(self, key, build):
+        """Return the data stored under key, calling build() to make (and
+        store) it if it isn't cached yet.
+        """
+
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        os.makedirs(self.root, exist_ok=True)
+
+        with open(self.path(key) + '.lock', 'wb') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # someone else may have built it while we were waiting
+                data = self.get(key)
+                if data is None:
+                    logger.debug('Cache miss for %s in %s',
+                                 key, self.namespace)
+                    data = build()
+                    self.put(key, data)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        return data
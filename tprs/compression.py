@@ -0,0 +1,167 @@
+"""Content codings for work unit transfers.
+
+TPR downloads are compressed with whatever the client's Accept-Encoding
+allows, and uploaded files may arrive compressed, marked by a suffix on
+their name (e.g. 'run.log.gz'), in which case they are decompressed
+before they are validated or stored. zstd is used if the zstandard
+package is installed; gzip is always available.
+"""
+
+import io
+import gzip
+import zlib
+import shutil
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+SUFFIXES = {
+    GZIP: '.gz',
+    ZSTD: '.zst',
+}
+
+# how much decompress_to reads at once
+CHUNK_SIZE = 1024 * 1024
+
+# what the decompressors raise on corrupt input
+DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error)
+if zstandard is not None:
+    DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+
+
+def available():
+    """The content codings this server can use, most preferred first.
+    """
+
+    if zstandard is not None:
+        return [ZSTD, GZIP]
+
+    return [GZIP]
+
+
+def negotiate(accept_encoding):
+    """Choose a content coding for a response.
+
+    Parameters
+    ----------
+    accept_encoding : str
+        The request's Accept-Encoding header.
+
+    Returns
+    -------
+    encoding : str or None
+        The most preferred coding that both sides support, or None if
+        the response should be sent as it is.
+    """
+
+    qvalues = {}
+    for item in accept_encoding.split(','):
+        params = item.strip().split(';')
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        qvalues[params[0].strip().lower()] = q
+
+    candidates = [(qvalues.get(enc, qvalues.get('*', 0)), -i, enc)
+                  for i, enc in enumerate(available())]
+    q, _, encoding = max(candidates)
+
+    return encoding if q > 0 else None
+
+
+def compress(data, encoding):
+    """Compress bytes with one of the codings in available().
+    """
+
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+
+    # a fixed mtime keeps the output (and so its hash) reproducible
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as f:
+        f.write(data)
+
+    return out.getvalue()
+
+
+def compress_to(fileobj, encoding, out):
+    """Compress everything in fileobj into the file object out, a piece
+    at a time. The streaming counterpart of compress().
+    """
+
+    if encoding == ZSTD:
+        zstandard.ZstdCompressor().copy_stream(fileobj, out)
+        return
+
+    with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as f:
+        shutil.copyfileobj(fileobj, f)
+
+
+def split_suffix(name):
+    """Split the compression suffix, if any, off of a file name.
+
+    Returns
+    -------
+    name : str
+        The name without its compression suffix.
+    encoding : str or None
+        The content coding the suffix stands for.
+    """
+
+    for encoding, suffix in SUFFIXES.items():
+        if name.endswith(suffix):
+            return name[:-len(suffix)], encoding
+
+    return name, None
+
+
+def decompress_to(fileobj, encoding, out, max_size=None):
+    """Decompress everything in fileobj into the file object out, a
+    piece at a time, stopping once more than max_size bytes (if given)
+    have come out.
+
+    Raises
+    ------
+    ValueError
+        If the data isn't valid, decompresses to more than max_size
+        bytes, or zstd is needed but unavailable.
+    """
+
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd-compressed files aren't supported here.")
+        reader = zstandard.ZstdDecompressor().stream_reader(fileobj)
+    else:
+        reader = gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+    size = 0
+    try:
+        for chunk in iter(lambda: reader.read(CHUNK_SIZE), b''):
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise ValueError(
+                    "%s data decompresses to more than the %s bytes "
+                    "allowed." % (encoding, max_size))
+            out.write(chunk)
+    except DECOMPRESSION_ERRORS as e:
+        raise ValueError("Couldn't decompress %s data: %s" % (encoding, e))
+
+
+def advertise(response):
+    """Let clients know which codings they may compress uploads with
+    (RFC 7694).
+    """
+
+    response['Accept-Encoding'] = ', '.join(available())
+
+    return response
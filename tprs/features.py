@@ -0,0 +1,267 @@
+"""Per-frame features of aligned trajectories, computed once.
+
+Each project's ProjectFeatures say which features to compute for its
+alignments (the root mean square deviation from the group PDB and the
+radius of gyration, if it has none). A feature is a function of a batch
+of frames, registered here by name with @register, or named by the
+dotted path of any importable function with the same signature:
+
+    feature(xyz, reference, **params) -> np.ndarray
+
+where xyz has shape (n_frames, n_atoms, 3), reference is the group
+PDB's coordinates and the result has shape (n_frames,) or (n_frames, k).
+
+Every alignment's features are stored as one float32 .npy array (one
+row per frame, one column per feature) in a FeatureSet, which also
+records which features made it. Featurizing an alignment never touches
+any other, so each new submission costs only its own frames.
+"""
+
+import io
+import os
+import json
+import logging
+
+import numpy as np
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from . import cache
+from . import trajectory
+from .models import Alignment, FeatureSet, ProjectFeature
+
+logger = logging.getLogger(__name__)
+
+FEATURES = {}
+
+# computed for projects without any ProjectFeatures
+DEFAULT_FEATURES = [('rmsd', 'rmsd', {}), ('rg', 'rg', {})]
+
+
+def register(name):
+    """Register a feature function under a name, for ProjectFeatures to
+    refer to.
+    """
+
+    def decorator(f):
+        FEATURES[name] = f
+        return f
+
+    return decorator
+
+
+@register('rmsd')
+def rmsd(xyz, reference):
+    """Root mean square deviation (nm) of each frame from the reference,
+    after superposing it.
+    """
+
+    xyz = trajectory.superpose(xyz.copy(), reference)
+
+    return np.sqrt(np.mean(np.sum((xyz - reference) ** 2, axis=2), axis=1))
+
+
+@register('rg')
+def radius_of_gyration(xyz, reference):
+    """Radius of gyration (nm) of each frame, with all atoms weighted
+    equally.
+    """
+
+    centered = xyz - xyz.mean(axis=1, keepdims=True)
+
+    return np.sqrt(np.mean(np.sum(centered ** 2, axis=2), axis=1))
+
+
+@register('distances')
+def distances(xyz, reference, pairs):
+    """Distances (nm) between pairs of atoms in each frame.
+
+    Parameters
+    ----------
+    pairs : list of (int, int)
+        Indices (from 0, in the group PDB) of the atoms in each pair.
+    """
+
+    pairs = np.asarray(pairs)
+
+    return np.linalg.norm(xyz[:, pairs[:, 0]] - xyz[:, pairs[:, 1]], axis=2)
+
+
+def get_feature(kind):
+    """Look up a feature function by registered name or dotted path.
+    """
+
+    if kind in FEATURES:
+        return FEATURES[kind]
+
+    try:
+        return import_string(kind)
+    except ImportError:
+        raise ValueError("No feature called %r is registered or can be "
+                         "imported." % kind)
+
+
+def project_features(project):
+    """The (name, kind, params) of each feature to compute for a
+    project's alignments.
+    """
+
+    specs = [(f.name, f.kind, f.params())
+             for f in ProjectFeature.objects.filter(project=project)]
+
+    return specs or DEFAULT_FEATURES
+
+
+def features_key(specs):
+    """A digest identifying a list of feature specs, to tell whether a
+    FeatureSet is still current.
+    """
+
+    return cache.digest(json.dumps(specs, sort_keys=True))
+
+
+def featurize_xtc(xtc_file, reference, specs,
+                  batch_size=trajectory.BATCH_SIZE):
+    """Compute features of every frame of a trajectory.
+
+    Parameters
+    ----------
+    xtc_file : str
+        Path to the (aligned) trajectory.
+    reference : np.ndarray, shape=(n_atoms, 3)
+        Reference structure, in nm.
+    specs : list of (name, kind, params)
+        The features to compute, as from project_features.
+    batch_size : int, default=trajectory.BATCH_SIZE
+        Number of frames to hold in memory at once.
+
+    Returns
+    -------
+    features : np.ndarray, shape=(n_frames, n_columns), dtype=float32
+    columns : list of str
+        Name of each column. Features with several values per frame get
+        a column each, numbered like distances[0], distances[1].
+    """
+
+    if trajectory.XTCTrajectoryFile is None:
+        raise RuntimeError("Featurizing needs mdtraj to read xtcs.")
+
+    functions = [(name, get_feature(kind), params)
+                 for name, kind, params in specs]
+
+    batches = []
+    columns = None
+    with trajectory.XTCTrajectoryFile(xtc_file, 'r') as f:
+        while True:
+            xyz, _, _, _ = f.read(n_frames=batch_size)
+            if not len(xyz):
+                break
+
+            xyz = xyz.astype(np.float64)
+            values = []
+            names = []
+            for name, function, params in functions:
+                v = np.asarray(function(xyz, reference, **params))
+                if v.ndim == 1:
+                    names.append(name)
+                else:
+                    names.extend('%s[%s]' % (name, i)
+                                 for i in range(v.shape[1]))
+                values.append(v.reshape(len(xyz), -1))
+
+            columns = names
+            batches.append(np.hstack(values).astype(np.float32))
+
+    if not batches:
+        return np.zeros((0, 0), dtype=np.float32), []
+
+    return np.vstack(batches), columns
+
+
+def featurize(alignment, force=False):
+    """Compute and store an alignment's features as its FeatureSet,
+    unless it already has current ones.
+
+    Returns
+    -------
+    feature_set : FeatureSet
+    """
+
+    project = alignment.project
+    specs = project_features(project)
+    key = features_key(specs)
+
+    try:
+        feature_set = alignment.feature_set
+    except FeatureSet.DoesNotExist:
+        feature_set = FeatureSet(alignment=alignment)
+
+    if feature_set.key == key and not force:
+        return feature_set
+
+    features, columns = featurize_xtc(
+        alignment.xtc.path,
+        trajectory.read_pdb_xyz(alignment.group_pdb.path), specs)
+
+    buf = io.BytesIO()
+    np.save(buf, features)
+
+    old_name = feature_set.array.name
+    with transaction.atomic():
+        feature_set.key = key
+        feature_set.columns_json = json.dumps(columns)
+        feature_set.n_frames = len(features)
+        feature_set.array.save(
+            os.path.join('features', project.name, '%s-%03d.npy' % (
+                project.name, alignment.submission.index())),
+            ContentFile(buf.getvalue()), save=False)
+        feature_set.save()
+
+    if old_name and old_name != feature_set.array.name:
+        feature_set.array.storage.delete(old_name)
+
+    return feature_set
+
+
+def featurize_new(alignment):
+    """Featurize a newly stored alignment, logging rather than raising
+    any failure, since the features can be computed later by the
+    featurize command.
+    """
+
+    if trajectory.XTCTrajectoryFile is None:
+        logger.warning("Not featurizing %s: FEATURIZE_ALIGNMENTS is on, "
+                       "but mdtraj isn't installed.", alignment)
+        return None
+
+    try:
+        return featurize(alignment)
+    except Exception as e:
+        logger.warning("Couldn't featurize %s: %s", alignment, e)
+        return None
+
+
+def stale(project=None):
+    """Alignments without current FeatureSets.
+    """
+
+    alignments = Alignment.objects.exclude(xtc='').exclude(
+        group_pdb='').select_related('submission__project', 'feature_set')
+    if project is not None:
+        alignments = alignments.filter(submission__project__name=project)
+
+    keys = {}
+    for aln in alignments.iterator():
+        if aln.project.name not in keys:
+            keys[aln.project.name] = features_key(
+                project_features(aln.project))
+
+        try:
+            if aln.feature_set.key == keys[aln.project.name]:
+                continue
+        except FeatureSet.DoesNotExist:
+            pass
+
+        yield aln
@@ -0,0 +1,420 @@
+"""Readers for the headers of GROMACS trajectory, structure and checkpoint
+files.
+
+These only decode as much of each file as is needed to check that it is
+well-formed and to pull out atom counts, steps and times, which is much
+cheaper than starting a `gmx check` process for every uploaded file.
+All of the binary formats are big-endian XDR.
+"""
+
+import os
+import struct
+import itertools
+from collections import namedtuple
+
+XTC_MAGIC = 1995
+CPT_MAGIC = 171817
+
+# magic, natoms, step, time, then the 3x3 box
+XTC_HEADER = struct.Struct('>iiif9f')
+# natoms again, precision, minint[3], maxint[3], smallidx, byte count
+XTC_COMPRESSED_HEADER = struct.Struct('>if3i3iii')
+XDR_INT = struct.Struct('>i')
+
+# GROMACS only compresses frames with more than this many atoms
+XTC_MAX_UNCOMPRESSED_ATOMS = 9
+
+# frame indexes (see XtcIndex) are a run of byte offset, step, time
+XTC_INDEX_ENTRY = struct.Struct('<qqd')
+XTC_INDEX_SUFFIX = '.idx'
+
+
+class FormatError(ValueError):
+    """Raised when a file isn't what it claims to be.
+    """
+    pass
+
+
+XtcFrame = namedtuple('XtcFrame', ['offset', 'natoms', 'step', 'time', 'box'])
+CptHeader = namedtuple('CptHeader', ['version', 'file_version', 'natoms'])
+
+
+def _read_exactly(f, n):
+
+    data = f.read(n)
+    if len(data) != n:
+        raise FormatError("Unexpected end of file.")
+
+    return data
+
+
+def _pad4(n):
+    return n + (-n % 4)
+
+
+def iter_xtc_frames(f):
+    """Iterate over the frame headers in an xtc file, without decoding
+    any coordinates.
+
+    Parameters
+    ----------
+    f : file-like
+        A seekable binary file object. It is read from the beginning.
+
+    Yields
+    ------
+    frame : XtcFrame
+        The byte offset of the frame within the file, and its atom
+        count, step, time (in ps) and box vectors (in nm).
+    """
+
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+
+    offset = 0
+    while offset < size:
+        header = XTC_HEADER.unpack(_read_exactly(f, XTC_HEADER.size))
+        magic, natoms, step, time = header[:4]
+
+        if magic != XTC_MAGIC:
+            raise FormatError(
+                "Bad xtc magic number %s at byte %s." % (magic, offset))
+
+        coord_natoms = XDR_INT.unpack(_read_exactly(f, XDR_INT.size))[0]
+        if coord_natoms != natoms:
+            raise FormatError(
+                "Frame at byte %s claims both %s and %s atoms." %
+                (offset, natoms, coord_natoms))
+
+        if natoms <= XTC_MAX_UNCOMPRESSED_ATOMS:
+            coord_bytes = 4 * 3 * natoms
+        else:
+            # the compressed header repeats natoms, so step back over it
+            f.seek(-XDR_INT.size, os.SEEK_CUR)
+            compressed = XTC_COMPRESSED_HEADER.unpack(
+                _read_exactly(f, XTC_COMPRESSED_HEADER.size))
+            coord_bytes = _pad4(compressed[-1])
+
+        next_offset = f.tell() + coord_bytes
+        if next_offset > size:
+            raise FormatError(
+                "Frame at byte %s is truncated." % offset)
+
+        yield XtcFrame(offset=offset, natoms=natoms, step=step, time=time,
+                       box=header[4:])
+
+        f.seek(next_offset)
+        offset = next_offset
+
+
+def read_xtc_frames(f):
+    """Read the headers of every frame in an xtc file. See
+    iter_xtc_frames.
+    """
+
+    return list(iter_xtc_frames(f))
+
+
+def xtc_index_path(xtc_path):
+    """Where the frame index of the xtc at xtc_path is kept.
+    """
+
+    return xtc_path + XTC_INDEX_SUFFIX
+
+
+def write_xtc_index(xtc_path, frames=None):
+    """Write the frame index of an xtc file next to it. See XtcIndex.
+
+    Parameters
+    ----------
+    xtc_path : str
+        Path to the xtc file.
+    frames : list of XtcFrame, optional
+        The file's frame headers, if they have already been read.
+
+    Returns
+    -------
+    index : XtcIndex
+    """
+
+    if frames is None:
+        with open(xtc_path, 'rb') as f:
+            frames = read_xtc_frames(f)
+
+    path = xtc_index_path(xtc_path)
+    tmp = '%s.%s.part' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        for frame in frames:
+            f.write(XTC_INDEX_ENTRY.pack(frame.offset, frame.step,
+                                         frame.time))
+
+    # readers never see a partly written index
+    os.replace(tmp, path)
+
+    return XtcIndex(path)
+
+
+def load_xtc_index(xtc_path):
+    """Get the frame index of an xtc file, (re)building it if it's
+    missing or older than the file.
+    """
+
+    path = xtc_index_path(xtc_path)
+
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(xtc_path):
+            return XtcIndex(path)
+    except OSError:
+        pass
+
+    return write_xtc_index(xtc_path)
+
+
+class XtcIndex(object):
+    """The byte offset, step and time of every frame of an xtc file, kept
+    in a sidecar file (see xtc_index_path) of fixed-size little-endian
+    entries, so any one frame can be found without reading the frames
+    before it.
+
+    Parameters
+    ----------
+    path : str
+        Path to the index file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __len__(self):
+        return os.path.getsize(self.path) // XTC_INDEX_ENTRY.size
+
+    def __getitem__(self, i):
+
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("Frame %s of %s." % (i, n))
+
+        with open(self.path, 'rb') as f:
+            f.seek(i * XTC_INDEX_ENTRY.size)
+            return XTC_INDEX_ENTRY.unpack(
+                _read_exactly(f, XTC_INDEX_ENTRY.size))
+
+    def offset(self, i):
+        """The byte offset of frame i in the xtc file.
+        """
+        return self[i][0]
+
+    def time_range(self):
+        """The times of the first and last frames, or None if there are
+        no frames.
+        """
+
+        if not len(self):
+            return None
+
+        return self[0][2], self[-1][2]
+
+    def entries(self, start=0, stop=None, block=4096):
+        """Iterate over the (offset, step, time) of frames start to stop,
+        reading block entries at a time.
+        """
+
+        stop = len(self) if stop is None else min(stop, len(self))
+
+        with open(self.path, 'rb') as f:
+            f.seek(start * XTC_INDEX_ENTRY.size)
+            while start < stop:
+                n = min(block, stop - start)
+                data = _read_exactly(f, n * XTC_INDEX_ENTRY.size)
+                yield from XTC_INDEX_ENTRY.iter_unpack(data)
+                start += n
+
+    def extents(self, frames, xtc_size):
+        """Find where some of the frames lie in the xtc file, merging
+        runs of consecutive frames.
+
+        Parameters
+        ----------
+        frames : range
+            The frames wanted, with a positive step.
+        xtc_size : int
+            Size of the xtc file, where the last frame ends.
+
+        Yields
+        ------
+        offset, length : int
+            A span of bytes of the xtc holding whole frames.
+        """
+
+        if not len(frames):
+            return
+
+        span = None
+        pending = None
+
+        # each frame ends where the next begins, and the last at the end
+        entries = self.entries(frames[0], frames[-1] + 2)
+        offsets = itertools.chain(
+            (offset for offset, _, _ in entries), [xtc_size])
+
+        for i, offset in enumerate(offsets, frames[0]):
+            if pending is not None:
+                if span is not None and span[1] == pending:
+                    span[1] = offset
+                else:
+                    if span is not None:
+                        yield span[0], span[1] - span[0]
+                    span = [pending, offset]
+                pending = None
+
+            if i in frames:
+                pending = offset
+
+        yield span[0], span[1] - span[0]
+
+
+def read_extents(f, extents, chunk_size=1024 * 1024):
+    """Read spans of a file, such as those from XtcIndex.extents, a
+    chunk at a time.
+
+    Parameters
+    ----------
+    f : file-like
+        A seekable binary file object.
+    extents : iterable of (int, int)
+        The offset and length of each span.
+
+    Yields
+    ------
+    chunk : bytes
+    """
+
+    for offset, length in extents:
+        f.seek(offset)
+        while length > 0:
+            chunk = _read_exactly(f, min(chunk_size, length))
+            length -= len(chunk)
+            yield chunk
+
+
+def check_xtc_continuity(frames, rtol=0.01):
+    """Check that the frames of a trajectory are evenly spaced in time
+    and all have the same number of atoms.
+
+    Parameters
+    ----------
+    frames : list of XtcFrame
+        Frame headers, as returned by read_xtc_frames.
+    rtol : float, default=0.01
+        How far, as a fraction of the first frame spacing, any other
+        spacing may deviate from it.
+    """
+
+    for frame in frames[1:]:
+        if frame.natoms != frames[0].natoms:
+            raise FormatError(
+                "Atom count changes from %s to %s at time %s." %
+                (frames[0].natoms, frame.natoms, frame.time))
+
+    if len(frames) < 2:
+        return
+
+    dt = frames[1].time - frames[0].time
+    if dt <= 0:
+        raise FormatError("Frame times are not increasing.")
+
+    for prev, frame in zip(frames, frames[1:]):
+        if abs((frame.time - prev.time) - dt) > rtol * dt:
+            raise FormatError(
+                "Gap in frame times between %s and %s ps (expected "
+                "frames every %s ps)." % (prev.time, frame.time, dt))
+
+
+def read_gro_natoms(f):
+    """Read the atom count of (the first frame of) a gro file, checking
+    that the file actually contains that many atom lines and a box.
+
+    Parameters
+    ----------
+    f : file-like
+        A binary file object. It is read from the beginning.
+    """
+
+    f.seek(0)
+
+    title = f.readline()
+    try:
+        natoms = int(f.readline())
+    except ValueError:
+        raise FormatError("Second line of gro file isn't an atom count.")
+
+    if not title or natoms < 0:
+        raise FormatError("Bad gro header.")
+
+    for i in range(natoms):
+        if not f.readline().strip():
+            raise FormatError(
+                "gro file claims %s atoms but ends after %s." % (natoms, i))
+
+    try:
+        box = [float(b) for b in f.readline().split()]
+    except ValueError:
+        raise FormatError("gro file's box line can't be read.")
+
+    if len(box) not in (3, 9):
+        raise FormatError("gro file's box line can't be read.")
+
+    return natoms
+
+
+def _read_xdr_string(f):
+
+    length = XDR_INT.unpack(_read_exactly(f, XDR_INT.size))[0]
+    if length < 0 or length > 4096:
+        raise FormatError("Bad string length %s in checkpoint." % length)
+
+    return _read_exactly(f, _pad4(length))[:length].decode('latin')
+
+
+def read_cpt_header(f):
+    """Read the header of a checkpoint file, as written by GROMACS'
+    do_cpt_header.
+
+    Parameters
+    ----------
+    f : file-like
+        A binary file object. It is read from the beginning.
+
+    Returns
+    -------
+    header : CptHeader
+        The GROMACS version that wrote the checkpoint, the checkpoint
+        format version and the number of atoms.
+    """
+
+    f.seek(0)
+
+    magic = XDR_INT.unpack(_read_exactly(f, XDR_INT.size))[0]
+    if magic != CPT_MAGIC:
+        raise FormatError("Bad checkpoint magic number %s." % magic)
+
+    # version, build time, build user, build host, program, write time
+    strings = [_read_xdr_string(f) for i in range(6)]
+
+    file_version = XDR_INT.unpack(_read_exactly(f, XDR_INT.size))[0]
+    if file_version >= 13:
+        # double precision flag
+        _read_exactly(f, XDR_INT.size)
+    if file_version >= 12:
+        # generating host
+        _read_xdr_string(f)
+
+    natoms = XDR_INT.unpack(_read_exactly(f, XDR_INT.size))[0]
+    if natoms < 0:
+        raise FormatError("Checkpoint claims %s atoms." % natoms)
+
+    return CptHeader(version=strings[0], file_version=file_version,
+                     natoms=natoms)
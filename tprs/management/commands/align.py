@@ -1,7 +1,11 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from django import db
 from django.core.management.base import BaseCommand, CommandError
 
 from tprs.models import Submission
-from tprs.util import get_tpr_groups
 
 
 class Command(BaseCommand):
@@ -21,6 +25,11 @@ class Command(BaseCommand):
             '--name', required=True, type=str,
             help='The name of the project to make alignments for.')
 
+        parser.add_argument(
+            '--workers', default=1, type=int,
+            help='Run this many alignments at once, each in its own '
+                 'process.')
+
     def handle(self, *args, **options):
 
         self.stdout.write("Aligning all projects to group name " +
@@ -46,7 +55,7 @@ class Command(BaseCommand):
         self.stdout.write("Found " + str(subs.count()) +
                           " submissions to align.")
 
-        groups = get_tpr_groups(subs[0].project.grompp().read())
+        groups = subs[0].project.current_tpr_info().group_names()
         if options['group'] not in groups:
             raise CommandError(
                 ('Group "%s" does not exist in tpr for "%s"; availiable '
@@ -58,8 +67,112 @@ class Command(BaseCommand):
                  'groups are: %s.') %
                 (options['tpr_subset'], subs[0].project.name, groups))
 
-        for sub in subs:
-            self.stdout.write("Aligning " + str(sub))
-            sub.align(
-                group=options['group'],
-                tpr_subset=options['tpr_subset'])
+        subs = list(subs)
+        if options['workers'] > 1:
+            failures = self.align_parallel(
+                subs, options['group'], options['tpr_subset'],
+                options['workers'])
+        else:
+            failures = self.align_serial(
+                subs, options['group'], options['tpr_subset'])
+
+        if failures:
+            raise CommandError(
+                "Failed to align %s of %s submissions: %s" %
+                (len(failures), len(subs),
+                 ", ".join(str(sub) for sub in failures)))
+
+    def align_serial(self, subs, group, tpr_subset):
+
+        failures = []
+        start = time.time()
+
+        for i, sub in enumerate(subs):
+            if not self.align_one(sub, group, tpr_subset):
+                failures.append(sub)
+
+            self.report_progress(i + 1, len(subs), start)
+
+        return failures
+
+    def align_one(self, sub, group, tpr_subset):
+
+        self.stdout.write("Aligning " + str(sub))
+        try:
+            sub.align(group=group, tpr_subset=tpr_subset)
+        except Exception as e:
+            self.stderr.write("Failed to align %s: %s" % (sub, e))
+            return False
+
+        return True
+
+    def align_parallel(self, subs, group, tpr_subset, workers):
+        """Run the expensive part of each alignment in a pool of worker
+        processes, keeping at most two alignments per worker in flight.
+        Results are stored from this process as they come in, so only
+        it talks to the database.
+        """
+
+        project = subs[0].project
+        failures = []
+        queue = iter(subs)
+        n_done = 0
+        start = time.time()
+
+        # the first alignment makes the group PDB that (with the numpy
+        # engine) later ones are superposed onto, so do it up front
+        for sub in queue:
+            if not self.align_one(sub, group, tpr_subset):
+                failures.append(sub)
+
+            n_done += 1
+            self.report_progress(n_done, len(subs), start)
+
+            if project.reference_alignment(group, tpr_subset) is not None:
+                break
+
+        tpr_data = project.subset_tpr(tpr_subset)
+        align = project.aligner(group, tpr_subset)
+
+        in_flight = {}
+
+        # forked workers mustn't share our database connection
+        db.connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                for sub in queue:
+                    self.stdout.write("Aligning " + str(sub))
+                    future = pool.submit(align, sub.xtc.path)
+                    in_flight[future] = sub
+                    if len(in_flight) >= 2 * workers:
+                        break
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sub = in_flight.pop(future)
+                    try:
+                        xtc_file = future.result()
+                        try:
+                            sub.add_alignment(
+                                group, tpr_subset, xtc_file, tpr_data)
+                        finally:
+                            os.remove(xtc_file)
+                    except Exception as e:
+                        self.stderr.write("Failed to align %s: %s" % (sub, e))
+                        failures.append(sub)
+
+                    n_done += 1
+                    self.report_progress(n_done, len(subs), start)
+
+        return failures
+
+    def report_progress(self, n_done, n_total, start):
+
+        elapsed = time.time() - start
+        self.stdout.write(
+            "[%s/%s] %.1f s elapsed, %.2f submissions/s" %
+            (n_done, n_total, elapsed, n_done / elapsed if elapsed else 0))
@@ -1,9 +1,8 @@
 import json
-from collections import Counter
 
 from django.core.management.base import BaseCommand
 
-from tprs.models import Submission
+from tprs.models import ProjectStatistics
 
 
 class Command(BaseCommand):
@@ -11,8 +10,8 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
 
-        c = Counter([s.project.name for s in
-                     Submission.objects.filter(alignment__isnull=True)])
+        c = {stats.project_id: stats.n_unaligned for stats in
+             ProjectStatistics.objects.all() if stats.n_unaligned > 0}
 
         self.stdout.write("Projects without alignments: " +
                           json.dumps(c, sort_keys=True, indent=4))
@@ -0,0 +1,29 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tprs.models import Upload
+
+
+class Command(BaseCommand):
+    help = ('Deletes chunked uploads that were never finalized, along with '
+            'the parts of their files that did arrive.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', default=72, type=float,
+            help='Delete uploads that have been idle for this many hours.')
+
+    def handle(self, *args, **options):
+
+        cutoff = timezone.now() - datetime.timedelta(hours=options['hours'])
+        stale = Upload.objects.filter(pending__isnull=True,
+                                      updated__lt=cutoff)
+
+        n = 0
+        for upload in stale:
+            upload.delete()
+            n += 1
+
+        self.stdout.write("Deleted %s abandoned uploads." % n)
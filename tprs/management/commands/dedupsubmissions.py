@@ -0,0 +1,50 @@
+import functools
+import operator
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from tprs.models import Submission, SUBMISSION_FILE_TYPES, SUBMISSION_STORAGE
+
+
+class Command(BaseCommand):
+    help = ('Moves submission files stored before deduplication into the '
+            'shared, content-addressed store (see tprs.storage), removing '
+            'the old copies.')
+
+    def handle(self, *args, **options):
+
+        n_moved = 0
+        n_removed = 0
+        for sub in Submission.objects.iterator():
+            moved = {}
+            for ftype in SUBMISSION_FILE_TYPES:
+                name = getattr(sub, ftype).name
+                if not name or SUBMISSION_STORAGE.is_blob(name):
+                    continue
+
+                try:
+                    with SUBMISSION_STORAGE.open(name, 'rb') as f:
+                        moved[ftype] = SUBMISSION_STORAGE.save(name, File(f))
+                except Exception as e:
+                    self.stderr.write("Couldn't move %s %s: %s" %
+                                      (sub, ftype, e))
+
+            if not moved:
+                continue
+
+            old_names = [getattr(sub, ftype).name for ftype in moved]
+            Submission.objects.filter(pk=sub.pk).update(**moved)
+            n_moved += len(moved)
+
+            for name in old_names:
+                still_used = functools.reduce(
+                    operator.or_,
+                    [Q(**{ftype: name}) for ftype in SUBMISSION_FILE_TYPES])
+                if not Submission.objects.filter(still_used).exists():
+                    SUBMISSION_STORAGE.delete(name)
+                    n_removed += 1
+
+        self.stdout.write("Moved %s files, removing %s old copies." %
+                          (n_moved, n_removed))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tprs.models import Alignment
+from tprs import features
+
+
+class Command(BaseCommand):
+    help = ("Computes the per-frame features (see tprs.features) of "
+            "alignments that don't have them, or whose project's features "
+            "have changed since they were computed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project', default=None,
+            help='Only featurize alignments of this project.')
+
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Recompute the features of every alignment.')
+
+    def handle(self, *args, **options):
+
+        if options['force']:
+            alignments = Alignment.objects.exclude(xtc='').exclude(
+                group_pdb='')
+            if options['project']:
+                alignments = alignments.filter(
+                    submission__project__name=options['project'])
+        else:
+            alignments = list(features.stale(options['project']))
+
+        n_done = 0
+        n_failed = 0
+        for aln in alignments:
+            try:
+                features.featurize(aln, force=options['force'])
+            except Exception as e:
+                self.stderr.write("Couldn't featurize %s: %s" % (aln, e))
+                n_failed += 1
+                continue
+
+            n_done += 1
+
+        self.stdout.write("Featurized %s alignments." % n_done)
+
+        if n_failed:
+            raise CommandError("%s alignments failed." % n_failed)
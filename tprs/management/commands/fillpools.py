@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from tprs.models import Project
+from tprs.pool import TprPool
+
+
+class Command(BaseCommand):
+    help = ('Fills the pools of pre-built TPRs for projects that generate '
+            'random velocities.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--name', type=str, default=None,
+            help='Only fill the pool for the project with this name.')
+
+        parser.add_argument(
+            '--depth', type=int, default=None,
+            help='Fill pools to this many TPRs instead of TPR_POOL_DEPTH.')
+
+    def handle(self, *args, **options):
+
+        projects = Project.objects.all()
+        if options['name'] is not None:
+            projects = projects.filter(name=options['name'])
+
+        for project in projects:
+            if not project.generates_velocities():
+                continue
+
+            pool = TprPool(project, depth=options['depth'])
+            n_built = pool.fill()
+
+            self.stdout.write("Built %s TPRs for %s (%s in pool)." %
+                              (n_built, project.name, len(pool)))
@@ -0,0 +1,44 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from tprs.models import Submission, Alignment
+from tprs import formats
+
+
+class Command(BaseCommand):
+    help = ('Writes the frame index (see tprs.formats.XtcIndex) of every '
+            'submitted and aligned xtc that is missing one, or whose index '
+            'is older than the xtc.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Rebuild every index, even those that look current.')
+
+    def handle(self, *args, **options):
+
+        n_indexed = 0
+        n_failed = 0
+        for model in [Submission, Alignment]:
+            for obj in model.objects.exclude(xtc='').iterator():
+                path = obj.xtc.path
+                try:
+                    if options['force']:
+                        formats.write_xtc_index(path)
+                    else:
+                        index_path = formats.xtc_index_path(path)
+                        if (os.path.isfile(index_path) and
+                                os.path.getmtime(index_path) >=
+                                os.path.getmtime(path)):
+                            continue
+                        formats.load_xtc_index(path)
+                except (OSError, ValueError) as e:
+                    self.stderr.write("Couldn't index %s: %s" % (obj, e))
+                    n_failed += 1
+                    continue
+
+                n_indexed += 1
+
+        self.stdout.write("Indexed %s trajectories (%s failed)." %
+                          (n_indexed, n_failed))
@@ -0,0 +1,109 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+
+from tprs.models import ArchivedFile, SUBMISSION_FILE_TYPES
+from tprs import tiering
+
+
+class Command(BaseCommand):
+    help = ("Compresses, moves to cold storage or prunes aligned "
+            "submissions' files, as their projects' retention rules say, "
+            "or restores files that were archived.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project', default=None,
+            help='Only apply the rules of this project.')
+
+        parser.add_argument(
+            '--workers', default=1, type=int,
+            help='Deal with this many files at once.')
+
+        parser.add_argument(
+            '--bandwidth', default=None, type=float,
+            help='Read no more than this many MB/s, across all workers.')
+
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="List what would be done, without doing it.")
+
+        parser.add_argument(
+            '--restore', nargs='+', type=int, metavar='SUBMISSION',
+            help='Restore the archived files of these submissions (by '
+                 'primary key) instead.')
+
+        parser.add_argument(
+            '--kind', choices=SUBMISSION_FILE_TYPES, default=None,
+            help='With --restore, only restore this kind of file.')
+
+    def handle(self, *args, **options):
+
+        throttle = tiering.Throttle(
+            options['bandwidth'] * 1e6 if options['bandwidth'] else None)
+
+        if options['restore']:
+            archived = ArchivedFile.objects.filter(
+                submission__in=options['restore']).exclude(path='')
+            if options['kind']:
+                archived = archived.filter(kind=options['kind'])
+
+            jobs = [(self.restore_one, a) for a in archived]
+        else:
+            jobs = [(self.archive_one, task) for task in
+                    tiering.due(options['project'])]
+
+        if options['dry_run']:
+            for _, job in jobs:
+                self.stdout.write("Would %s" % self.describe(job))
+            return
+
+        self.throttle = throttle
+        start = time.time()
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(self.run_threaded, jobs))
+        else:
+            results = [self.run(job) for job in jobs]
+
+        self.stdout.write("Done %s of %s in %.1f s." % (
+            sum(results), len(results), time.time() - start))
+
+        if not all(results):
+            raise CommandError("%s failed." % results.count(False))
+
+    def describe(self, job):
+        if isinstance(job, ArchivedFile):
+            return "restore %s %s" % (job.submission, job.kind)
+
+        sub, kind, action = job
+        return "%s %s %s" % (action, sub, kind)
+
+    def run(self, job):
+
+        f, arg = job
+        try:
+            f(arg)
+        except Exception as e:
+            self.stderr.write("Failed to %s: %s" % (self.describe(arg), e))
+            return False
+
+        self.stdout.write("Did %s" % self.describe(arg))
+        return True
+
+    def run_threaded(self, job):
+        try:
+            return self.run(job)
+        finally:
+            # each thread gets its own connection; don't leak them
+            db.connection.close()
+
+    def archive_one(self, task):
+        sub, kind, action = task
+        tiering.archive(sub, kind, action, self.throttle)
+
+    def restore_one(self, archived):
+        tiering.restore(archived, self.throttle)
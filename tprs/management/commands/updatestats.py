@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from tprs.models import Project, Submission, ProjectStatistics
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the per-project statistics from the submission and '
+            'alignment tables.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--remeasure', action='store_true',
+            help="Also re-read every submission's files to recount its "
+                 "frames, simulated time and size (except submissions "
+                 "with archived files).")
+
+    def handle(self, *args, **options):
+
+        if options['remeasure']:
+            # archived files are no longer there to be measured
+            for sub in Submission.objects.filter(
+                    archived_files__isnull=True):
+                sub.measure()
+                Submission.objects.filter(pk=sub.pk).update(
+                    n_frames=sub.n_frames,
+                    simulated_time=sub.simulated_time,
+                    n_bytes=sub.n_bytes)
+
+        for project in Project.objects.all():
+            stats = ProjectStatistics.recompute(project)
+            self.stdout.write(
+                "%s: %s submissions (%s aligned), %s frames, %.1f ns, "
+                "%s bytes" %
+                (project.name, stats.n_submissions, stats.n_aligned,
+                 stats.n_frames, stats.simulated_time / 1000,
+                 stats.n_bytes))
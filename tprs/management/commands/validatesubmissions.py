@@ -0,0 +1,85 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django import db
+from django.core.management.base import BaseCommand
+
+from tprs.models import PendingSubmission
+
+
+class Command(BaseCommand):
+    help = ('Validates spooled uploads, promoting them to Submissions or '
+            'rejecting them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', default=1, type=int,
+            help='Validate this many uploads at once.')
+
+        parser.add_argument(
+            '--watch', action='store_true',
+            help='Keep polling for new uploads instead of exiting once the '
+                 'spool is empty.')
+
+        parser.add_argument(
+            '--interval', default=5, type=float,
+            help='Seconds to wait between polls when --watch is given.')
+
+        parser.add_argument(
+            '--requeue', action='store_true',
+            help='Before starting, return uploads left half-validated by a '
+                 'killed validator to the queue.')
+
+    def handle(self, *args, **options):
+
+        if options['requeue']:
+            n = PendingSubmission.objects.filter(
+                status=PendingSubmission.VALIDATING).update(
+                status=PendingSubmission.PENDING)
+            self.stdout.write("Requeued %s uploads." % n)
+
+        while True:
+            pending = list(PendingSubmission.ready())
+
+            if pending:
+                self.process_all(pending, options['workers'])
+            elif not options['watch']:
+                break
+            else:
+                time.sleep(options['interval'])
+
+    def process_all(self, pending, workers):
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(self.process_threaded, pending))
+        else:
+            for upload in pending:
+                self.process(upload)
+
+    def process_threaded(self, upload):
+        try:
+            self.process(upload)
+        finally:
+            # each thread gets its own connection; don't leak them
+            db.connection.close()
+
+    def process(self, upload):
+
+        if not upload.claim():
+            return
+
+        try:
+            submission = upload.process()
+        except Exception as e:
+            # not the upload's fault (e.g. gmx went missing), so retry later
+            # rather than stopping the other uploads
+            upload.retry_later(e)
+            self.stderr.write("Error validating %s (will retry after %s): "
+                              "%s" % (upload, upload.not_before, e))
+            return
+
+        if submission is None:
+            self.stdout.write("Rejected %s." % upload)
+        else:
+            self.stdout.write("Accepted %s as %s." % (upload, submission))
@@ -1,14 +1,17 @@
 import os
 import shutil
 import io
+import datetime
 
 from django.test import TestCase, override_settings
 from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.utils import timezone
 
 from ..seralizers import valid_xtc
-from ..models import Project, Submission, Alignment
+from ..models import (
+    Project, Submission, Alignment, ProjectStatistics, Upload)
 
 
 @override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
@@ -136,3 +139,85 @@ class AlignCommandTestCase(TestCase):
         self.assertEqual(
             aln0.group_pdb,
             aln1.group_pdb)
+
+    def test_alignstatus(self):
+
+        out = io.StringIO()
+        call_command('alignstatus', stdout=out)
+        self.assertIn('"plcg_sh2_wt": 1', out.getvalue())
+
+        self.sub.align(group='Protein', tpr_subset='Prot-Masses')
+        self.assertEqual(
+            ProjectStatistics.objects.get(project=self.project).n_aligned, 1)
+
+        out = io.StringIO()
+        call_command('alignstatus', stdout=out)
+        self.assertNotIn('plcg_sh2_wt', out.getvalue())
+
+    def test_align_parallel(self):
+
+        Submission.objects.create(
+            project=self.project,
+            hostname='debug02',
+            xtc='testdata/submission/plcg_sh2_wt.xtc',
+            log='testdata/submission/plcg_sh2_wt.log',
+            edr='testdata/submission/plcg_sh2_wt.edr',
+            gro='testdata/submission/plcg_sh2_wt.gro',
+            cpt='testdata/submission/plcg_sh2_wt.cpt',
+            tpr='testdata/plcg_sh2_wt.tpr')
+
+        out = io.StringIO()
+        call_command(
+            'align',
+            '--name', self.project.name,
+            '--group', 'Protein',
+            '--tpr-subset', 'Prot-Masses',
+            '--workers', '2',
+            stdout=out)
+
+        self.assertEqual(Alignment.objects.count(), 2)
+        self.assertEqual(
+            [os.path.basename(aln.xtc.name) for aln in
+             Alignment.objects.order_by('submission__created')],
+            ['plcg_sh2_wt-000.xtc', 'plcg_sh2_wt-001.xtc'])
+        self.assertIn('[2/2]', out.getvalue())
+
+    def test_align_continues_after_failure(self):
+
+        Submission.objects.create(
+            project=self.project,
+            hostname='debug02',
+            xtc='testdata/submission/nonexistant.xtc',
+            log='testdata/submission/plcg_sh2_wt.log',
+            edr='testdata/submission/plcg_sh2_wt.edr',
+            gro='testdata/submission/plcg_sh2_wt.gro',
+            cpt='testdata/submission/plcg_sh2_wt.cpt',
+            tpr='testdata/plcg_sh2_wt.tpr')
+
+        out = io.StringIO()
+        err = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command(
+                'align',
+                '--name', self.project.name,
+                '--group', 'Protein',
+                '--tpr-subset', 'Prot-Masses',
+                '--workers', '2',
+                stdout=out, stderr=err)
+
+        self.assertEqual(Alignment.objects.count(), 1)
+        self.assertEqual(Alignment.objects.first().submission, self.sub)
+
+    def test_clearuploads(self):
+
+        stale = Upload.objects.create(project=self.project, hostname='a')
+        fresh = Upload.objects.create(project=self.project, hostname='b')
+        os.makedirs(stale.root)
+
+        Upload.objects.filter(pk=stale.pk).update(
+            updated=timezone.now() - datetime.timedelta(days=7))
+
+        call_command('clearuploads', stdout=io.StringIO())
+
+        self.assertEqual(list(Upload.objects.all()), [fresh])
+        self.assertFalse(os.path.exists(stale.root))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 11:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0004_split_group_and_tpr_subset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingSubmission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('xtc', models.FileField(blank=True, upload_to='spool')),
+                ('edr', models.FileField(blank=True, upload_to='spool')),
+                ('tpr', models.FileField(blank=True, upload_to='spool')),
+                ('gro', models.FileField(blank=True, upload_to='spool')),
+                ('log', models.FileField(blank=True, upload_to='spool')),
+                ('cpt', models.FileField(blank=True, upload_to='spool')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('hostname', models.CharField(help_text='Name of the host that completed this WU', max_length=200)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('validating', 'Validating'), ('accepted', 'Accepted'), ('rejected', 'Rejected')], db_index=True, default='pending', max_length=20)),
+                ('detail', models.TextField(blank=True, help_text='Why this upload was rejected, if it was.')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tprs.Project')),
+                ('submission', models.OneToOneField(blank=True, help_text='The Submission this upload was promoted to, if any.', null=True, on_delete=django.db.models.deletion.CASCADE, to='tprs.Submission')),
+            ],
+            options={
+                'ordering': ('created',),
+            },
+        ),
+        migrations.AlterField(
+            model_name='alignment',
+            name='group',
+            field=models.CharField(help_text='The gmx group used to align this alignment', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='alignment',
+            name='group_pdb',
+            field=models.FileField(help_text='The pdb file representing the masses extracted during alignment.', max_length=500, upload_to='alignments', verbose_name='Group PDB file'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def number_submissions(apps, schema_editor):
+    """Give existing submissions the sequence numbers that index() used
+    to compute: their position, by creation time, within their project.
+    """
+
+    Project = apps.get_model('tprs', 'Project')
+    Submission = apps.get_model('tprs', 'Submission')
+
+    for project in Project.objects.all():
+        subs = Submission.objects.filter(project=project).order_by('created')
+        for i, sub_pk in enumerate(subs.values_list('pk', flat=True)):
+            Submission.objects.filter(pk=sub_pk).update(sequence=i)
+
+        project.next_sequence = subs.count()
+        project.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0005_pendingsubmission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='next_sequence',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Sequence number to give the next submission.'),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='sequence',
+            field=models.PositiveIntegerField(editable=False, null=True, help_text='Position of this submission among those for its project, starting from 0.'),
+        ),
+        migrations.RunPython(number_submissions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='submission',
+            name='sequence',
+            field=models.PositiveIntegerField(editable=False, help_text='Position of this submission among those for its project, starting from 0.'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='submission',
+            unique_together=set([('project', 'sequence')]),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 11:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_submissions(apps, schema_editor):
+    """Start each project's statistics off with its submission and
+    alignment counts. Frame counts and sizes need the files to be read,
+    which is left to `./manage.py updatestats --remeasure`.
+    """
+
+    Project = apps.get_model('tprs', 'Project')
+    ProjectStatistics = apps.get_model('tprs', 'ProjectStatistics')
+
+    for project in Project.objects.all():
+        subs = project.submission_set
+        ProjectStatistics.objects.create(
+            project=project,
+            n_submissions=subs.count(),
+            n_aligned=subs.filter(alignment__isnull=False).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0006_submission_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectStatistics',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='statistics', serialize=False, to='tprs.Project')),
+                ('n_submissions', models.PositiveIntegerField(default=0)),
+                ('n_aligned', models.PositiveIntegerField(default=0)),
+                ('n_frames', models.BigIntegerField(default=0)),
+                ('simulated_time', models.FloatField(default=0, help_text='Total simulated time (ps).')),
+                ('n_bytes', models.BigIntegerField(default=0, help_text='Total size of submitted and aligned files.')),
+            ],
+            options={
+                'verbose_name_plural': 'project statistics',
+            },
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='n_bytes',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Total size of the submitted files.'),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='n_frames',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of frames in the xtc.'),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='simulated_time',
+            field=models.FloatField(default=0, editable=False, help_text='Time (ps) between the first and last frames of the xtc.'),
+        ),
+        migrations.RunPython(count_submissions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 11:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0007_projectstatistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TprInfo',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='tpr_info', serialize=False, to='tprs.Project')),
+                ('tpr_key', models.CharField(help_text='Project.tpr_key() of the TPR this was extracted from.', max_length=64)),
+                ('natoms', models.PositiveIntegerField()),
+                ('nsteps', models.BigIntegerField()),
+                ('dt', models.FloatField(help_text='Time step (ps).')),
+                ('nstxout_compressed', models.PositiveIntegerField(help_text='Steps between xtc frames.')),
+                ('nstenergy', models.PositiveIntegerField(help_text='Steps between energy frames.')),
+                ('nstlog', models.PositiveIntegerField(help_text='Steps between log entries.')),
+                ('groups_json', models.TextField(help_text='JSON list of [name, atom count] for each index group.')),
+            ],
+            options={
+                'verbose_name': 'TPR info',
+            },
+        ),
+    ]
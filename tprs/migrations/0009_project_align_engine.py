@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0008_tprinfo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='align_engine',
+            field=models.CharField(choices=[('gmx', 'gmx trjconv'), ('numpy', 'NumPy (needs mdtraj)')], default='gmx', help_text='How to align submissions. gmx trjconv only removes jumps across the box; the NumPy engine also superposes each frame onto the group PDB.', max_length=10),
+        ),
+    ]
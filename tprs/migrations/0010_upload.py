@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 12:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0009_project_align_engine'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hostname', models.CharField(help_text='Name of the host that completed this WU', max_length=200)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('pending', models.OneToOneField(blank=True, help_text='The PendingSubmission this upload was finalized into, if it has been.', null=True, on_delete=django.db.models.deletion.CASCADE, to='tprs.PendingSubmission')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tprs.Project')),
+            ],
+            options={
+                'ordering': ('created',),
+            },
+        ),
+        migrations.CreateModel(
+            name='UploadFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('xtc', 'xtc'), ('edr', 'edr'), ('tpr', 'tpr'), ('gro', 'gro'), ('log', 'log'), ('cpt', 'cpt')], max_length=3)),
+                ('size', models.BigIntegerField(help_text='Size of the file, in bytes.')),
+                ('sha256', models.CharField(help_text='Hex digest of the whole file.', max_length=64)),
+                ('received_json', models.TextField(default='[]', help_text='JSON list of the [start, end) byte ranges received so far, merged and in order.')),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='tprs.Upload')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='uploadfile',
+            unique_together=set([('upload', 'kind')]),
+        ),
+    ]
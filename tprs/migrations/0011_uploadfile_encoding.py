@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 12:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0010_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadfile',
+            name='encoding',
+            field=models.CharField(blank=True, choices=[('gzip', 'gzip'), ('zstd', 'zstd')], help_text='How the file is compressed, if it is. It is decompressed when the upload is validated.', max_length=10),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 12:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0011_uploadfile_encoding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hostname', models.CharField(help_text='Name of the host the work unit was handed to', max_length=200)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires', models.DateTimeField(db_index=True)),
+                ('expected_time', models.FloatField(help_text='Simulated time (ps) the work unit should produce.')),
+            ],
+            options={
+                'ordering': ('created',),
+            },
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='active',
+            field=models.BooleanField(default=True, help_text='Whether next-work hands out work for this project.'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='target_time',
+            field=models.FloatField(blank=True, help_text='Total simulated time (ps) after which next-work stops handing out work for this project. Blank for no limit.', null=True),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='weight',
+            field=models.FloatField(default=1, help_text='Share of the work handed out by next-work that this project gets, relative to the other active projects.'),
+        ),
+        migrations.AddField(
+            model_name='lease',
+            name='project',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leases', to='tprs.Project'),
+        ),
+        migrations.AddField(
+            model_name='lease',
+            name='submission',
+            field=models.OneToOneField(blank=True, help_text='The Submission that fulfilled this lease, if any.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lease', to='tprs.Submission'),
+        ),
+    ]
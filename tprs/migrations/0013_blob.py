@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 12:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import tprs.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0012_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('name', models.CharField(help_text='Storage name of the file.', max_length=100, primary_key=True, serialize=False)),
+                ('sha256', models.CharField(db_index=True, help_text='Hex digest of the file.', max_length=64)),
+                ('size', models.BigIntegerField(help_text='Size of the file, in bytes.')),
+                ('refcount', models.PositiveIntegerField(default=0, help_text='Number of stored references (FileFields) to the file.')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='cpt',
+            field=models.FileField(storage=tprs.storage.DedupStorage(), upload_to='submissions'),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='edr',
+            field=models.FileField(storage=tprs.storage.DedupStorage(), upload_to='submissions'),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='gro',
+            field=models.FileField(storage=tprs.storage.DedupStorage(), upload_to='submissions'),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='log',
+            field=models.FileField(storage=tprs.storage.DedupStorage(), upload_to='submissions'),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='tpr',
+            field=models.FileField(storage=tprs.storage.DedupStorage(), upload_to='submissions'),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='xtc',
+            field=models.FileField(storage=tprs.storage.DedupStorage(), upload_to='submissions'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 12:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0013_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('xtc', 'xtc'), ('edr', 'edr'), ('tpr', 'tpr'), ('gro', 'gro'), ('log', 'log'), ('cpt', 'cpt')], max_length=3)),
+                ('action', models.CharField(choices=[('compress', 'Compress in place'), ('cold', 'Move to cold storage'), ('prune', 'Delete')], max_length=10)),
+                ('sha256', models.CharField(help_text='Hex digest of the original file.', max_length=64)),
+                ('size', models.BigIntegerField(help_text='Size of the original file, in bytes.')),
+                ('path', models.CharField(blank=True, help_text='Where the archived copy is. Blank if it was pruned.', max_length=500)),
+                ('encoding', models.CharField(blank=True, choices=[('gzip', 'gzip'), ('zstd', 'zstd')], help_text='How the archived copy is compressed, if it is.', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_files', to='tprs.Submission')),
+            ],
+            options={
+                'ordering': ('created',),
+            },
+        ),
+        migrations.CreateModel(
+            name='RetentionRule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('xtc', 'xtc'), ('edr', 'edr'), ('tpr', 'tpr'), ('gro', 'gro'), ('log', 'log'), ('cpt', 'cpt')], max_length=3)),
+                ('action', models.CharField(choices=[('compress', 'Compress in place'), ('cold', 'Move to cold storage'), ('prune', 'Delete')], max_length=10)),
+                ('after_hours', models.FloatField(default=0, help_text='How long after alignment to wait before acting.')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retention_rules', to='tprs.Project')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='retentionrule',
+            unique_together=set([('project', 'kind')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedfile',
+            unique_together=set([('submission', 'kind')]),
+        ),
+    ]
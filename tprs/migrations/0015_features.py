@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 12:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0014_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeatureSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('array', models.FileField(max_length=500, upload_to='features')),
+                ('key', models.CharField(help_text="Digest of the features computed, to tell when the project's features have changed.", max_length=64)),
+                ('columns_json', models.TextField(help_text='Name of each column of the array, as a JSON list.')),
+                ('n_frames', models.PositiveIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('alignment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='feature_set', to='tprs.Alignment')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProjectFeature',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name of the column(s) holding the feature.', max_length=50)),
+                ('kind', models.CharField(help_text='A registered feature (rmsd, rg or distances) or the dotted path of a function computing one.', max_length=200)),
+                ('params_json', models.TextField(blank=True, default='{}', help_text='Keyword arguments for the feature, as a JSON object; e.g. {"pairs": [[0, 10]]} for distances.')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='features', to='tprs.Project')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='projectfeature',
+            unique_together=set([('project', 'name')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 12:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tprs', '0015_features'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingsubmission',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, help_text='Number of times validating this upload has failed with an error, rather than a verdict.'),
+        ),
+        migrations.AddField(
+            model_name='pendingsubmission',
+            name='not_before',
+            field=models.DateTimeField(blank=True, help_text='When to next try validating this upload, after an error.', null=True),
+        ),
+    ]
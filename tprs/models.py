@@ -1,34 +1,306 @@
 import tempfile
 import os
+import shutil
 import logging
 import subprocess
 import io
+import json
+import functools
+import datetime
 
-from django.db import models
+import numpy as np
+
+from django.db import models, transaction, IntegrityError
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.cache import caches
+from django.urls import reverse
+from django.utils import timezone
 
 from . import util
+from . import cache
+from . import formats
+from . import trajectory
+from . import compression
+from .pool import TprPool
+from .storage import DedupStorage
 
 logger = logging.getLogger(__name__)
 
+SUBMISSION_FILE_TYPES = ['xtc', 'edr', 'tpr', 'gro', 'log', 'cpt']
+
+TPR_CACHE = cache.FileCache('tprs', suffix='.tpr')
+SUBSET_TPR_CACHE = cache.FileCache('subset-tprs', suffix='.tpr')
+GROUP_PDB_CACHE = cache.FileCache('group-pdbs', suffix='.pdb')
+GROUP_NDX_CACHE = cache.FileCache('group-ndxs', suffix='.ndx')
+COMPRESSED_TPR_CACHE = cache.FileCache('compressed-tprs')
+
+# key of the tpr manifest in Django's (in-memory, by default) cache
+MANIFEST_CACHE_KEY = 'tprs-manifest'
+
+# submitted files are stored once however many submissions share them
+SUBMISSION_STORAGE = DedupStorage()
+
 
 class Project(models.Model):
 
     class Meta:
         ordering = ('name',)
 
+    GMX_ENGINE = 'gmx'
+    NUMPY_ENGINE = 'numpy'
+    ALIGN_ENGINES = (
+        (GMX_ENGINE, 'gmx trjconv'),
+        (NUMPY_ENGINE, 'NumPy (needs mdtraj)'),
+    )
+
     name = models.CharField(max_length=200, primary_key=True)
     top = models.FileField(upload_to='projects/top')
     mdp = models.FileField(upload_to='projects/mdp')
     gro = models.FileField(upload_to='projects/gro')
 
+    align_engine = models.CharField(
+        max_length=10, choices=ALIGN_ENGINES, default=GMX_ENGINE,
+        help_text='How to align submissions. gmx trjconv only removes '
+                  'jumps across the box; the NumPy engine also superposes '
+                  'each frame onto the group PDB.')
+
+    weight = models.FloatField(
+        default=1,
+        help_text='Share of the work handed out by next-work that this '
+                  'project gets, relative to the other active projects.')
+    target_time = models.FloatField(
+        null=True, blank=True,
+        help_text='Total simulated time (ps) after which next-work stops '
+                  'handing out work for this project. Blank for no limit.')
+    active = models.BooleanField(
+        default=True,
+        help_text='Whether next-work hands out work for this project.')
+
     created = models.DateTimeField(auto_now_add=True)
 
+    next_sequence = models.PositiveIntegerField(
+        default=0, editable=False,
+        help_text='Sequence number to give the next submission.')
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Project, cls).from_db(db, field_names, values)
+        # the name it was loaded under, to tell a rename from an update
+        instance._saved_name = instance.name
+
+        return instance
+
+    def save(self, *args, **kwargs):
+        # next_sequence is only advanced (atomically) by Submission.save(),
+        # so don't let a stale copy of it overwrite the database's. A
+        # renamed project is saved as a new row, which needs every field.
+        if (not self._state.adding and kwargs.get('update_fields') is None
+                and self.name == getattr(self, '_saved_name', None)):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'next_sequence']
+
+        super(Project, self).save(*args, **kwargs)
+        self._saved_name = self.name
+        caches['default'].delete(MANIFEST_CACHE_KEY)
+
+    def delete(self, *args, **kwargs):
+        result = super(Project, self).delete(*args, **kwargs)
+        caches['default'].delete(MANIFEST_CACHE_KEY)
+
+        return result
+
+    def natoms(self):
+        """The number of atoms in this project's system, according to its
+        gro file.
+        """
+
+        with open(self.gro.path, 'rb') as f:
+            return formats.read_gro_natoms(f)
+
+    def current_tpr_info(self):
+        """Get the TprInfo describing this project's current TPR,
+        (re)building it if the project's files have changed since it was
+        last extracted.
+        """
+
+        key = self.tpr_key()
+
+        try:
+            info = self.tpr_info
+        except TprInfo.DoesNotExist:
+            info = TprInfo(project=self)
+
+        if info.tpr_key != key:
+            info.extract(self.grompp().read(), util.parse_mdp(self.mdp.path))
+            info.tpr_key = key
+            info.save()
+
+        return info
+
+    def tpr_key(self):
+        """A hash of everything that goes into this project's TPR: the
+        contents of the mdp, top and gro files and the GROMACS version.
+        """
+
+        return cache.digest(
+            cache.file_digest(self.mdp.path),
+            cache.file_digest(self.top.path),
+            cache.file_digest(self.gro.path),
+            util.gmx_version())
+
     def grompp(self):
+        """Build a TPR for this project, returning it as a file-like
+        object.
+
+        TPRs are cached on disk under tpr_key(), so grompp is only run
+        the first time a given set of project files is requested;
+        concurrent requests for a missing TPR wait on a single build.
+        """
+
+        tpr_data = TPR_CACHE.get_or_build(self.tpr_key(), self._grompp)
+
+        return io.BytesIO(tpr_data)
+
+    def subset_tpr(self, tpr_subset):
+        """Build this project's TPR subset to the atoms in the group
+        tpr_subset (see util.subset_tpr), returning it as bytes.
+
+        Like grompp(), results are cached on disk, keyed on tpr_key()
+        and the subset group.
+        """
+
+        return SUBSET_TPR_CACHE.get_or_build(
+            cache.digest(self.tpr_key(), tpr_subset),
+            lambda: util.subset_tpr(self.grompp().read(), tpr_subset))
+
+    def group_indices(self, tpr_subset, group):
+        """Indices of the atoms of group within this project's TPR subset
+        to tpr_subset (see util.get_group_indices). Cached like
+        subset_tpr().
+        """
+
+        tpr_data = self.subset_tpr(tpr_subset)
+        ndx = GROUP_NDX_CACHE.get_or_build(
+            cache.digest(self.tpr_key(), tpr_subset, group),
+            lambda: ('[ %s ]\n%s\n' % (group, ' '.join(
+                str(i + 1) for i in util.get_group_indices(tpr_data, group))
+            )).encode('ascii'))
+
+        return util.read_ndx(ndx)[group]
+
+    def reference_alignment(self, group, tpr_subset):
+        """An existing Alignment of this project with the given group and
+        subset that has a group PDB, or None if there isn't one yet.
+        """
+
+        return Alignment.objects.filter(
+            submission__project__name=self.name,
+            group=group, tpr_subset=tpr_subset).exclude(
+            group_pdb='').first()
+
+    def aligner(self, group, tpr_subset):
+        """Get a function that aligns one of this project's trajectories
+        using its align_engine.
+
+        The function takes the path to an xtc and returns the path to a
+        new temporary file holding the aligned xtc. It can be pickled, so
+        it can be run in worker processes that don't touch the database.
+        """
+
+        if self.align_engine == self.NUMPY_ENGINE:
+            ref_aln = self.reference_alignment(group, tpr_subset)
+            reference = None
+            if ref_aln is not None:
+                reference = trajectory.read_pdb_xyz(ref_aln.group_pdb.path)
+
+            return functools.partial(
+                trajectory.align,
+                atom_indices=self.group_indices(tpr_subset, group),
+                reference=reference)
+
+        return functools.partial(
+            util.align, tpr_data=self.subset_tpr(tpr_subset), group=group)
+
+    def compressed_tpr(self, encoding):
+        """This project's TPR (as returned by grompp()), compressed with
+        one of compression.available(). Cached like grompp().
+        """
+
+        return COMPRESSED_TPR_CACHE.get_or_build(
+            cache.digest(self.tpr_key(), encoding),
+            lambda: compression.compress(self.grompp().read(), encoding))
+
+    def tpr_digest(self):
+        """The sha256 hex digest of this project's TPR, as returned by
+        grompp().
+        """
+
+        path = TPR_CACHE.path(self.tpr_key())
+        if not os.path.isfile(path):
+            self.grompp()
+
+        # file_digest only rereads the file if it has been rebuilt
+        return cache.file_digest(path)
+
+    def tpr_modified(self):
+        """The time (as a POSIX timestamp) at which this project's
+        current TPR was built.
+        """
+
+        path = TPR_CACHE.path(self.tpr_key())
+        if not os.path.isfile(path):
+            self.grompp()
+
+        return os.path.getmtime(path)
+
+    def generates_velocities(self):
+        """True if this project's mdp generates velocities with a random
+        seed (gen_vel = yes, gen_seed = -1), so that every grompp run
+        gives a different TPR.
+        """
+
+        mdp = util.parse_mdp(self.mdp.path)
+
+        return (mdp.get('gen_vel', 'no').lower() == 'yes' and
+                int(mdp.get('gen_seed', '-1')) == -1)
+
+    def work_unit_tpr(self):
+        """Get the TPR to hand out for a single work unit, as a
+        file-like object.
+
+        For most projects this is just the (cached) output of grompp().
+        Projects that generate random velocities instead need a distinct
+        TPR for each work unit, so those are taken from the project's
+        TprPool, which is refilled in the background. If the pool has
+        run dry, a TPR is built on the spot.
+        """
+
+        if not self.generates_velocities():
+            return self.grompp()
+
+        pool = TprPool(self)
+        tpr_data = pool.take()
+
+        if settings.TPR_POOL_DEPTH > 0:
+            pool.fill_async()
+
+        if tpr_data is None:
+            logger.info('TPR pool for %s is empty; running grompp.', self)
+            tpr_data = self._grompp()
+
+        return io.BytesIO(tpr_data)
+
+    def _grompp(self):
 
         with tempfile.NamedTemporaryFile(suffix=".tpr") as tmp:
 
@@ -57,27 +329,37 @@ class Project(models.Model):
                     "grompp failed with return code %s" % p.returncode)
 
             with open(tmp.name, 'rb') as f:
-                tpr = io.BytesIO(f.read())
+                tpr_data = f.read()
 
-        return tpr
+        return tpr_data
 
     @property
     def n_submissions(self):
-        # print(dir(self))
-        return self.submission_set.count()
+        try:
+            return self.statistics.n_submissions
+        except ProjectStatistics.DoesNotExist:
+            return 0
+
+    @property
+    def simulated_time(self):
+        try:
+            return self.statistics.simulated_time
+        except ProjectStatistics.DoesNotExist:
+            return 0
 
 
 class Submission(models.Model):
 
     class Meta:
         ordering = ('created', )
+        unique_together = (('project', 'sequence'),)
 
-    xtc = models.FileField(upload_to='submissions')
-    edr = models.FileField(upload_to='submissions')
-    tpr = models.FileField(upload_to='submissions')
-    gro = models.FileField(upload_to='submissions')
-    log = models.FileField(upload_to='submissions')
-    cpt = models.FileField(upload_to='submissions')
+    xtc = models.FileField(upload_to='submissions', storage=SUBMISSION_STORAGE)
+    edr = models.FileField(upload_to='submissions', storage=SUBMISSION_STORAGE)
+    tpr = models.FileField(upload_to='submissions', storage=SUBMISSION_STORAGE)
+    gro = models.FileField(upload_to='submissions', storage=SUBMISSION_STORAGE)
+    log = models.FileField(upload_to='submissions', storage=SUBMISSION_STORAGE)
+    cpt = models.FileField(upload_to='submissions', storage=SUBMISSION_STORAGE)
 
     project = models.ForeignKey(Project)
     created = models.DateTimeField(auto_now_add=True)
@@ -86,16 +368,95 @@ class Submission(models.Model):
         max_length=200,
         help_text='Name of the host that completed this WU')
 
+    sequence = models.PositiveIntegerField(
+        editable=False,
+        help_text='Position of this submission among those for its project, '
+                  'starting from 0.')
+
+    n_frames = models.PositiveIntegerField(
+        default=0, editable=False,
+        help_text='Number of frames in the xtc.')
+    simulated_time = models.FloatField(
+        default=0, editable=False,
+        help_text='Time (ps) between the first and last frames of the xtc.')
+    n_bytes = models.BigIntegerField(
+        default=0, editable=False,
+        help_text='Total size of the submitted files.')
+
     def __str__(self):
         return " ".join([self.project.name, "submission", str(self.index())])
 
+    def save(self, *args, **kwargs):
+
+        if self._state.adding and self.sequence is None:
+            self.measure()
+
+            # take the next number from the project's counter; the update
+            # locks the project row until the submission is inserted, so
+            # concurrent submissions can't get the same number
+            with transaction.atomic():
+                Project.objects.filter(pk=self.project_id).update(
+                    next_sequence=models.F('next_sequence') + 1)
+                self.sequence = Project.objects.values_list(
+                    'next_sequence', flat=True).get(pk=self.project_id) - 1
+
+                super(Submission, self).save(*args, **kwargs)
+
+                ProjectStatistics.add(
+                    self.project,
+                    n_submissions=1,
+                    n_frames=self.n_frames,
+                    simulated_time=self.simulated_time,
+                    n_bytes=self.n_bytes)
+
+                Lease.fulfil(self)
+
+            if self.xtc:
+                index_xtc(self.xtc, getattr(self, '_xtc_frames', None))
+
+            return
+
+        return super(Submission, self).save(*args, **kwargs)
+
+    def measure(self):
+        """Fill in n_frames, simulated_time and n_bytes from this
+        submission's files. Missing or unreadable files count as empty.
+        """
+
+        try:
+            frames = formats.read_xtc_frames(self.xtc)
+            # kept for the frame index, written once the xtc is stored
+            self._xtc_frames = frames
+        except (OSError, ValueError) as e:
+            logger.warning("Couldn't read frames of %s: %s", self.xtc, e)
+            frames = []
+        finally:
+            # uploads still need to be read when they are saved
+            if self.xtc._committed:
+                self.xtc.close()
+
+        self.n_frames = len(frames)
+        self.simulated_time = (
+            frames[-1].time - frames[0].time if frames else 0)
+
+        self.n_bytes = 0
+        for ftype in SUBMISSION_FILE_TYPES:
+            try:
+                self.n_bytes += getattr(self, ftype).size
+            except (OSError, ValueError):
+                pass
+
+    def xtc_index(self):
+        """The frame index of this submission's xtc (see formats.XtcIndex),
+        built if it hasn't been already.
+        """
+        return formats.load_xtc_index(self.xtc.path)
+
     def index(self):
         """Return the index of this submission, where the ith submission
         for a given project has index i.
         """
-        return Submission.objects.filter(
-            project=self.project,
-            created__lt=self.created).count()
+        return self.sequence
 
     @property
     def has_alignment(self):
@@ -105,12 +466,34 @@ class Submission(models.Model):
 
     def align(self, group, tpr_subset):
 
-        tpr_data = util.subset_tpr(self.project.grompp().read(), tpr_subset)
-        xtc_data = util.align(self.xtc.path, tpr_data, group)
+        tpr_data = self.project.subset_tpr(tpr_subset)
+        xtc_file = self.project.aligner(group, tpr_subset)(self.xtc.path)
+
+        try:
+            return self.add_alignment(group, tpr_subset, xtc_file, tpr_data)
+        finally:
+            os.remove(xtc_file)
+
+    def add_alignment(self, group, tpr_subset, xtc_file, tpr_data):
+        """Store an already-aligned trajectory as this submission's
+        Alignment. Split out of align() so that the expensive gmx calls
+        can run elsewhere (e.g. in the align command's worker processes).
+
+        Parameters
+        ----------
+        group : str
+            Name of the group used to align the trajectory.
+        tpr_subset : str
+            Name of the group the project TPR was subset to.
+        xtc_file : str
+            Path to the aligned trajectory, as returned by util.align.
+            It is copied into storage a chunk at a time, and left where
+            it is.
+        tpr_data : bytes
+            The subset TPR the trajectory was aligned with.
+        """
 
-        prev_aln = Alignment.objects.filter(
-            submission__project__name=self.project.name,
-            group=group).first()
+        prev_aln = self.project.reference_alignment(group, tpr_subset)
 
         aln = Alignment.objects.create(submission=self, group=group,
                                        tpr_subset=tpr_subset)
@@ -121,24 +504,31 @@ class Submission(models.Model):
 
         # Build the xtc file
         fname = '{p}-{i:03d}.xtc'.format(p=self.project.name, i=self.index())
-        aln.xtc.save(
-            os.path.join(settings.MEDIA_ROOT, 'alignments', self.project.name,
-                         fname),
-            ContentFile(xtc_data),
-            save=True)
+        with open(xtc_file, 'rb') as f:
+            aln.xtc.save(
+                os.path.join(settings.MEDIA_ROOT, 'alignments',
+                             self.project.name, fname),
+                File(f),
+                save=True)
+
+        index_xtc(aln.xtc)
+
+        ProjectStatistics.add(
+            self.project, n_aligned=1, n_bytes=aln.xtc.size)
 
         if prev_aln:
             logger.debug('For aln %s, setting group_pdb with old aln %s',
                          aln, prev_aln)
-            if prev_aln.group_pdb.name:
-                aln.group_pdb = prev_aln.group_pdb
-                aln.save()
+            aln.group_pdb = prev_aln.group_pdb
+            aln.save()
         else:
             logger.debug('For aln %s, making new group_pdb', aln)
 
             # group is 'System' because the TPR is already subsetted to
             # have the appropriate set of atoms
-            group_pdb = util.make_pdb(xtc_data, tpr_data, group=group)
+            group_pdb = GROUP_PDB_CACHE.get_or_build(
+                cache.digest(self.project.tpr_key(), tpr_subset, group),
+                lambda: util.make_pdb(xtc_file, tpr_data, group=group))
 
             fname = '{p}-{g}.pdb'.format(
                 p=self.project.name, g=tpr_subset.lower())
@@ -147,6 +537,13 @@ class Submission(models.Model):
                              self.project.name, fname),
                 ContentFile(group_pdb))
 
+        if settings.FEATURIZE_ALIGNMENTS:
+            # imported here since the features module imports this one
+            from .features import featurize_new
+            featurize_new(aln)
+
+        return aln
+
 
 class Alignment(models.Model):
 
@@ -178,3 +575,959 @@ class Alignment(models.Model):
     @property
     def project(self):
         return self.submission.project
+
+    def xtc_index(self):
+        """The frame index of the aligned xtc (see formats.XtcIndex),
+        built if it hasn't been already.
+        """
+        return formats.load_xtc_index(self.xtc.path)
+
+
+def index_xtc(xtc, frames=None):
+    """Write the frame index of a stored xtc next to it. Failures are
+    logged rather than raised, since the index can be rebuilt whenever
+    it's needed.
+
+    Parameters
+    ----------
+    xtc : FieldFile
+        The stored xtc.
+    frames : list of formats.XtcFrame, optional
+        Its frame headers, if they have already been read.
+    """
+
+    try:
+        formats.write_xtc_index(xtc.path, frames)
+    except (OSError, ValueError) as e:
+        logger.warning("Couldn't index frames of %s: %s", xtc, e)
+
+
+class TprInfo(models.Model):
+    """Metadata about a project's TPR: its index groups and the run
+    parameters that matter for planning and aligning work.
+
+    Extracted once per distinct TPR (see Project.current_tpr_info) so
+    that group names and atom counts can be looked up without running
+    grompp and gmx select.
+    """
+
+    class Meta:
+        verbose_name = 'TPR info'
+
+    project = models.OneToOneField(
+        Project, primary_key=True, related_name='tpr_info')
+    tpr_key = models.CharField(
+        max_length=64,
+        help_text='Project.tpr_key() of the TPR this was extracted from.')
+
+    natoms = models.PositiveIntegerField()
+    nsteps = models.BigIntegerField()
+    dt = models.FloatField(help_text='Time step (ps).')
+    nstxout_compressed = models.PositiveIntegerField(
+        help_text='Steps between xtc frames.')
+    nstenergy = models.PositiveIntegerField(
+        help_text='Steps between energy frames.')
+    nstlog = models.PositiveIntegerField(
+        help_text='Steps between log entries.')
+
+    groups_json = models.TextField(
+        help_text='JSON list of [name, atom count] for each index group.')
+
+    def __str__(self):
+        return "TPR info for %s" % self.project_id
+
+    @property
+    def groups(self):
+        """The index groups in the TPR, as a list of (name, atom count)
+        pairs.
+        """
+        return [tuple(g) for g in json.loads(self.groups_json)]
+
+    def group_names(self):
+        return tuple(name for name, natoms in self.groups)
+
+    @property
+    def simulated_time(self):
+        """Length (ps) of the simulation this TPR runs."""
+        return self.nsteps * self.dt
+
+    def extract(self, tpr_data, mdp):
+        """Fill in this object's fields from a TPR and the (parsed) mdp it
+        was built from.
+        """
+
+        groups = util.get_tpr_group_sizes(tpr_data)
+        self.groups_json = json.dumps(groups)
+        self.natoms = dict(groups).get('System') or 0
+
+        # defaults are grompp's; nstxtcout is the pre-5.0 name
+        self.nsteps = int(mdp.get('nsteps', 0))
+        self.dt = float(mdp.get('dt', 0.001))
+        self.nstxout_compressed = int(mdp.get(
+            'nstxout_compressed', mdp.get('nstxtcout', 0)))
+        self.nstenergy = int(mdp.get('nstenergy', 1000))
+        self.nstlog = int(mdp.get('nstlog', 1000))
+
+
+class ProjectStatistics(models.Model):
+    """Running totals over a project's submissions and alignments.
+
+    These are updated as submissions and alignments are saved and
+    deleted (see ProjectStatistics.add and the post_delete receivers
+    below), so reading them costs a single query no matter how many
+    submissions there are. The updatestats command rebuilds them from
+    scratch.
+    """
+
+    class Meta:
+        verbose_name_plural = 'project statistics'
+
+    project = models.OneToOneField(
+        Project, primary_key=True, related_name='statistics')
+
+    n_submissions = models.PositiveIntegerField(default=0)
+    n_aligned = models.PositiveIntegerField(default=0)
+    n_frames = models.BigIntegerField(default=0)
+    simulated_time = models.FloatField(
+        default=0, help_text='Total simulated time (ps).')
+    n_bytes = models.BigIntegerField(
+        default=0, help_text='Total size of submitted and aligned files.')
+
+    def __str__(self):
+        return "Statistics for %s" % self.project
+
+    @property
+    def n_unaligned(self):
+        return self.n_submissions - self.n_aligned
+
+    @classmethod
+    def add(cls, project, create=True, **deltas):
+        """Atomically add the given amounts to a project's totals, e.g.
+        ProjectStatistics.add(project, n_submissions=1). With create=False,
+        projects without totals (e.g. because they're being deleted) are
+        left without them.
+        """
+
+        # by pk, so that the instance doesn't cache a stale copy of these
+        if create:
+            cls.objects.get_or_create(project_id=project.pk)
+        cls.objects.filter(project_id=project.pk).update(
+            **{field: models.F(field) + delta
+               for field, delta in deltas.items()})
+
+    @classmethod
+    def recompute(cls, project):
+        """Rebuild a project's totals from its submissions and
+        alignments.
+        """
+
+        subs = Submission.objects.filter(project=project)
+        totals = subs.aggregate(
+            n_submissions=models.Count('pk'),
+            n_aligned=models.Count('alignment'),
+            n_frames=models.Sum('n_frames'),
+            simulated_time=models.Sum('simulated_time'),
+            n_bytes=models.Sum('n_bytes'))
+
+        totals['n_bytes'] = totals['n_bytes'] or 0
+        for aln in Alignment.objects.filter(submission__project=project):
+            try:
+                totals['n_bytes'] += aln.xtc.size
+            except (OSError, ValueError):
+                pass
+
+        stats, _ = cls.objects.get_or_create(project=project)
+        for field, total in totals.items():
+            setattr(stats, field, total or 0)
+        stats.save()
+
+        return stats
+
+
+@receiver(post_delete, sender=Submission)
+def submission_deleted(sender, instance, **kwargs):
+    """Take a deleted submission out of its project's totals, however it
+    was deleted (including in bulk, or along with its project).
+    """
+
+    ProjectStatistics.add(
+        Project(pk=instance.project_id), create=False,
+        n_submissions=-1,
+        n_frames=-instance.n_frames,
+        simulated_time=-instance.simulated_time,
+        n_bytes=-instance.n_bytes)
+
+
+@receiver(post_delete, sender=Submission)
+def submission_files_deleted(sender, instance, **kwargs):
+    """Release a deleted submission's blobs (see tprs.storage). Files
+    stored before deduplication are left where they are.
+    """
+
+    for ftype in SUBMISSION_FILE_TYPES:
+        SUBMISSION_STORAGE.release(getattr(instance, ftype).name)
+
+
+@receiver(pre_save, sender=Submission)
+def submission_files_replacing(sender, instance, **kwargs):
+    """Note which stored files a submission is about to replace, to be
+    released by submission_files_replaced once the new ones are stored.
+    """
+
+    instance._replaced_files = []
+    if instance._state.adding:
+        return
+
+    old = Submission.objects.filter(pk=instance.pk).values(
+        *SUBMISSION_FILE_TYPES).first()
+    if old is None:
+        return
+
+    for ftype in SUBMISSION_FILE_TYPES:
+        field = getattr(instance, ftype)
+        # an uncommitted file will be stored afresh, taking a new
+        # reference even if its content is the same
+        if old[ftype] and (old[ftype] != field.name or
+                           not field._committed):
+            instance._replaced_files.append(old[ftype])
+
+
+@receiver(post_save, sender=Submission)
+def submission_files_replaced(sender, instance, **kwargs):
+
+    for name in getattr(instance, '_replaced_files', []):
+        SUBMISSION_STORAGE.release(name)
+    instance._replaced_files = []
+
+
+@receiver(post_delete, sender=Alignment)
+def alignment_deleted(sender, instance, **kwargs):
+    """Take a deleted alignment out of its project's totals.
+    """
+
+    n_bytes = 0
+    try:
+        n_bytes = instance.xtc.size
+    except (OSError, ValueError):
+        pass
+
+    # cascades delete alignments before their submissions, so this is
+    # still there
+    project_id = Submission.objects.filter(
+        pk=instance.submission_id).values_list('project', flat=True).first()
+    if project_id is None:
+        return
+
+    ProjectStatistics.add(Project(pk=project_id), create=False,
+                          n_aligned=-1, n_bytes=-n_bytes)
+
+
+class PendingSubmission(models.Model):
+    """A work unit that has been uploaded, but not yet validated.
+
+    Uploads are spooled here so that the submit endpoint can return as
+    soon as the files are on disk. The validatesubmissions command later
+    runs them through SubmissionSerializer and either promotes them to
+    a Submission or marks them as rejected.
+    """
+
+    class Meta:
+        ordering = ('created',)
+
+    PENDING = 'pending'
+    VALIDATING = 'validating'
+    ACCEPTED = 'accepted'
+    REJECTED = 'rejected'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (VALIDATING, 'Validating'),
+        (ACCEPTED, 'Accepted'),
+        (REJECTED, 'Rejected'),
+    )
+
+    xtc = models.FileField(upload_to='spool', blank=True)
+    edr = models.FileField(upload_to='spool', blank=True)
+    tpr = models.FileField(upload_to='spool', blank=True)
+    gro = models.FileField(upload_to='spool', blank=True)
+    log = models.FileField(upload_to='spool', blank=True)
+    cpt = models.FileField(upload_to='spool', blank=True)
+
+    project = models.ForeignKey(Project)
+    created = models.DateTimeField(auto_now_add=True)
+
+    hostname = models.CharField(
+        max_length=200,
+        help_text='Name of the host that completed this WU')
+
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=PENDING,
+        db_index=True)
+    detail = models.TextField(
+        blank=True,
+        help_text='Why this upload was rejected, if it was.')
+
+    submission = models.OneToOneField(
+        Submission, null=True, blank=True,
+        help_text='The Submission this upload was promoted to, if any.')
+
+    attempts = models.PositiveIntegerField(
+        default=0,
+        help_text='Number of times validating this upload has failed with '
+                  'an error, rather than a verdict.')
+    not_before = models.DateTimeField(
+        null=True, blank=True,
+        help_text='When to next try validating this upload, after an '
+                  'error.')
+
+    def __str__(self):
+        return " ".join([self.project.name, "upload", str(self.pk)])
+
+    @classmethod
+    def ready(cls, now=None):
+        """Uploads waiting to be validated, other than those backing off
+        after an error.
+        """
+
+        now = now or timezone.now()
+
+        return cls.objects.filter(status=cls.PENDING).filter(
+            models.Q(not_before__isnull=True) | models.Q(not_before__lte=now))
+
+    def retry_later(self, error, now=None):
+        """Return this upload to the queue after validating it failed
+        with an error (e.g. gmx went missing), to be tried again after a
+        delay that doubles with each failure, up to
+        settings.VALIDATION_RETRY_MAX_DELAY seconds.
+        """
+
+        now = now or timezone.now()
+
+        self.attempts += 1
+        delay = min(settings.VALIDATION_RETRY_DELAY * 2 ** (self.attempts - 1),
+                    settings.VALIDATION_RETRY_MAX_DELAY)
+
+        self.status = self.PENDING
+        self.not_before = now + datetime.timedelta(seconds=delay)
+        self.detail = "Attempt %s failed: %s" % (self.attempts, error)
+
+        PendingSubmission.objects.filter(pk=self.pk).update(
+            status=self.status, attempts=self.attempts,
+            not_before=self.not_before, detail=self.detail)
+
+    def claim(self):
+        """Atomically mark this upload as being validated. Returns False if
+        someone else got to it first.
+        """
+
+        n_claimed = PendingSubmission.objects.filter(
+            pk=self.pk, status=self.PENDING).update(status=self.VALIDATING)
+
+        return n_claimed == 1
+
+    def process(self):
+        """Validate the spooled files, promoting them to a Submission if
+        they pass and recording why not if they don't. The spooled copies
+        are removed either way, once that is committed; if anything fails
+        first, no Submission is left behind to be duplicated by a retry.
+        """
+
+        # imported here since the serializers module imports this one
+        from .seralizers import SubmissionSerializer
+
+        spooled = [getattr(self, ftype) for ftype in SUBMISSION_FILE_TYPES]
+
+        files = {}
+        for ftype, f in zip(SUBMISSION_FILE_TYPES, spooled):
+            f.open('rb')
+            files[ftype] = File(f.file, name=os.path.basename(f.name))
+
+        try:
+            s = SubmissionSerializer(data=dict(
+                project=reverse('project-detail', args=(self.project.pk,)),
+                hostname=self.hostname,
+                **files))
+
+            valid = s.is_valid()
+
+            with transaction.atomic():
+                if valid:
+                    self.submission = s.save()
+                    self.status = self.ACCEPTED
+                else:
+                    logger.error('Rejected %s: %s', self, s.errors)
+                    self.status = self.REJECTED
+                    self.detail = str(s.errors)
+
+                for ftype in SUBMISSION_FILE_TYPES:
+                    setattr(self, ftype, '')
+                self.save()
+
+                transaction.on_commit(functools.partial(
+                    remove_spooled, [(f.storage, f.name) for f in spooled]))
+        finally:
+            for f in files.values():
+                f.close()
+
+        return self.submission
+
+
+def remove_spooled(files):
+    """Delete (storage, name) pairs of spooled files, if they're there.
+    """
+
+    for storage, name in files:
+        if name:
+            storage.delete(name)
+
+
+class Upload(models.Model):
+    """A resumable upload of a work unit's files.
+
+    Clients declare the size and sha256 of each file when the upload is
+    created, send the files in chunks (in any order, and again after an
+    interruption), and then finalize the upload, which turns it into a
+    PendingSubmission. Files the server already has a copy of are
+    filled in when the upload is created and needn't be sent at all.
+    """
+
+    class Meta:
+        ordering = ('created',)
+
+    project = models.ForeignKey(Project)
+    hostname = models.CharField(
+        max_length=200,
+        help_text='Name of the host that completed this WU')
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    pending = models.OneToOneField(
+        PendingSubmission, null=True, blank=True,
+        help_text='The PendingSubmission this upload was finalized into, '
+                  'if it has been.')
+
+    def __str__(self):
+        return " ".join([self.project.name, "chunked upload", str(self.pk)])
+
+    @property
+    def root(self):
+        return os.path.join(settings.MEDIA_ROOT, 'uploads', str(self.pk))
+
+    def finalize(self):
+        """Check that every file has arrived intact and move them into the
+        spool as a new PendingSubmission.
+
+        Raises
+        ------
+        ValueError
+            If a file is missing, incomplete or doesn't match its sha256.
+        """
+
+        if self.pending_id is not None:
+            raise ValueError("Upload has already been finalized.")
+
+        files = {f.kind: f for f in self.files.all()}
+
+        missing = set(SUBMISSION_FILE_TYPES) - set(files)
+        if missing:
+            raise ValueError(
+                "Upload has no %s file." % ", ".join(sorted(missing)))
+
+        for f in files.values():
+            if f.missing():
+                raise ValueError(
+                    "%s file is missing bytes %s." % (f.kind, f.missing()))
+            if cache.file_digest(f.path) != f.sha256:
+                raise ValueError(
+                    "%s file doesn't match its sha256." % f.kind)
+
+        pending = PendingSubmission(project=self.project,
+                                    hostname=self.hostname)
+
+        # moving is cheaper than copying through the storage API
+        for kind, f in files.items():
+            name = default_storage.get_available_name(
+                os.path.join('spool', '%s-upload%s.%s%s' % (
+                    self.project.name, self.pk, kind,
+                    compression.SUFFIXES.get(f.encoding, ''))))
+            os.makedirs(os.path.dirname(default_storage.path(name)),
+                        exist_ok=True)
+            os.rename(f.path, default_storage.path(name))
+            getattr(pending, kind).name = name
+
+        with transaction.atomic():
+            pending.save()
+            self.pending = pending
+            self.save()
+
+        shutil.rmtree(self.root, ignore_errors=True)
+
+        return pending
+
+    def delete(self, *args, **kwargs):
+        root = self.root
+        super(Upload, self).delete(*args, **kwargs)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+class UploadFile(models.Model):
+    """One of the files of an Upload, and which parts of it have arrived.
+    """
+
+    class Meta:
+        unique_together = (('upload', 'kind'),)
+
+    upload = models.ForeignKey(Upload, related_name='files')
+    kind = models.CharField(
+        max_length=3, choices=[(t, t) for t in SUBMISSION_FILE_TYPES])
+
+    size = models.BigIntegerField(help_text='Size of the file, in bytes.')
+    sha256 = models.CharField(
+        max_length=64, help_text='Hex digest of the whole file.')
+    encoding = models.CharField(
+        max_length=10, blank=True,
+        choices=[(e, e) for e in compression.SUFFIXES],
+        help_text='How the file is compressed, if it is. It is '
+                  'decompressed when the upload is validated.')
+
+    received_json = models.TextField(
+        default='[]',
+        help_text='JSON list of the [start, end) byte ranges received so '
+                  'far, merged and in order.')
+
+    def __str__(self):
+        return "%s (%s)" % (self.upload, self.kind)
+
+    @property
+    def path(self):
+        return os.path.join(self.upload.root, self.kind)
+
+    @property
+    def received(self):
+        return json.loads(self.received_json)
+
+    def missing(self):
+        """The [start, end) byte ranges that haven't arrived yet.
+        """
+
+        missing = []
+        pos = 0
+        for start, end in self.received + [[self.size, self.size]]:
+            if start > pos:
+                missing.append([pos, start])
+            pos = max(pos, end)
+
+        return missing
+
+    def write(self, offset, stream, length, chunk_size=1024*1024):
+        """Write length bytes read from stream into the file, starting at
+        offset, and record that they've arrived.
+        """
+
+        if offset < 0 or length <= 0 or offset + length > self.size:
+            raise ValueError(
+                "Bytes %s-%s are outside a %s byte file." %
+                (offset, offset + length, self.size))
+
+        os.makedirs(self.upload.root, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            written = 0
+            while written < length:
+                data = stream.read(min(chunk_size, length - written))
+                if not data:
+                    break
+                os.pwrite(fd, data, offset + written)
+                written += len(data)
+        finally:
+            os.close(fd)
+
+        if written != length:
+            raise ValueError(
+                "Expected %s bytes, but got %s." % (length, written))
+
+        # other chunks of this file may be arriving at the same time
+        with transaction.atomic():
+            f = UploadFile.objects.select_for_update().get(pk=self.pk)
+            self.received_json = json.dumps(
+                merge_ranges(f.received + [[offset, offset + length]]))
+            self.save(update_fields=['received_json'])
+
+            # so that clearuploads knows this upload is still alive
+            Upload.objects.filter(pk=self.upload_id).update(
+                updated=timezone.now())
+
+    def fill_from(self, path):
+        """Fill in the whole file from a copy the server already has.
+        """
+
+        os.makedirs(self.upload.root, exist_ok=True)
+        shutil.copyfile(path, self.path)
+
+        self.received_json = json.dumps([[0, self.size]])
+        self.save(update_fields=['received_json'])
+
+
+class Lease(models.Model):
+    """A work unit handed out by the next-work endpoint (see
+    tprs.scheduler).
+
+    Until it is fulfilled by a submission or expires, a lease counts the
+    simulated time its work unit should produce towards its project's
+    progress, so that work already in flight isn't handed out again.
+    Expired leases are reclaimed (deleted) by the scheduler.
+    """
+
+    class Meta:
+        ordering = ('created',)
+
+    project = models.ForeignKey(Project, related_name='leases')
+    hostname = models.CharField(
+        max_length=200,
+        help_text='Name of the host the work unit was handed to')
+
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(db_index=True)
+
+    expected_time = models.FloatField(
+        help_text='Simulated time (ps) the work unit should produce.')
+
+    submission = models.OneToOneField(
+        Submission, null=True, blank=True, related_name='lease',
+        help_text='The Submission that fulfilled this lease, if any.')
+
+    def __str__(self):
+        return " ".join([self.project.name, "lease", str(self.pk)])
+
+    @classmethod
+    def outstanding(cls, now=None):
+        """Leases that are neither fulfilled nor expired.
+        """
+
+        return cls.objects.filter(
+            submission=None, expires__gt=now or timezone.now())
+
+    @classmethod
+    def reclaim(cls, now=None):
+        """Delete leases that expired without being fulfilled, returning
+        how many there were.
+        """
+
+        n_deleted, _ = cls.objects.filter(
+            submission=None, expires__lte=now or timezone.now()).delete()
+
+        return n_deleted
+
+    @classmethod
+    def fulfil(cls, submission):
+        """Mark the oldest unfulfilled lease handed to the submission's
+        host for its project as fulfilled by it. Work units of a project
+        are interchangeable, so which one doesn't matter. Returns the
+        lease, or None if the host had none (e.g. it chose the project
+        itself).
+        """
+
+        with transaction.atomic():
+            lease = cls.objects.select_for_update().filter(
+                project_id=submission.project_id,
+                hostname=submission.hostname,
+                submission=None).order_by('created', 'pk').first()
+
+            if lease is not None:
+                lease.submission = submission
+                lease.save(update_fields=['submission'])
+
+        return lease
+
+
+def tpr_manifest():
+    """The manifest served at tprs.json: a JSON object mapping the name
+    of each active project to the sha256 of its TPR (or null, if every
+    work unit gets a TPR of its own; see Project.work_unit_tpr).
+
+    The manifest is built once and kept in Django's cache until a
+    project is saved or deleted, or for MANIFEST_CACHE_TIMEOUT seconds
+    (since other processes' caches don't hear about those).
+
+    Returns
+    -------
+    body : bytes
+        The manifest, encoded as JSON.
+    etag : str
+        A (quoted) ETag for body.
+    """
+
+    manifest = caches['default'].get(MANIFEST_CACHE_KEY)
+
+    if manifest is None:
+        digests = {}
+        for project in Project.objects.filter(active=True):
+            try:
+                digests[project.name] = (
+                    None if project.generates_velocities()
+                    else project.tpr_digest())
+            except Exception:
+                # one broken project shouldn't take the manifest down
+                logger.exception("Leaving %s out of the manifest.", project)
+
+        body = json.dumps(digests, sort_keys=True).encode('utf-8')
+        manifest = (body, '"%s"' % cache.digest(body))
+
+        caches['default'].set(MANIFEST_CACHE_KEY, manifest,
+                              settings.MANIFEST_CACHE_TIMEOUT)
+
+    return manifest
+
+
+class Blob(models.Model):
+    """A file stored once by DedupStorage (see tprs.storage), and how many
+    references there are to it.
+    """
+
+    name = models.CharField(
+        max_length=100, primary_key=True,
+        help_text='Storage name of the file.')
+    sha256 = models.CharField(
+        max_length=64, db_index=True,
+        help_text='Hex digest of the file.')
+    size = models.BigIntegerField(help_text='Size of the file, in bytes.')
+    refcount = models.PositiveIntegerField(
+        default=0,
+        help_text='Number of stored references (FileFields) to the file.')
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def acquire(cls, name, sha256, size):
+        """Add a reference to the blob called name, creating it if it
+        doesn't exist yet.
+        """
+
+        with transaction.atomic():
+            n_updated = cls.objects.filter(name=name).update(
+                refcount=models.F('refcount') + 1)
+            if n_updated:
+                return
+
+            try:
+                with transaction.atomic():
+                    cls.objects.create(name=name, sha256=sha256, size=size,
+                                       refcount=1)
+            except IntegrityError:
+                # someone else created it first
+                cls.objects.filter(name=name).update(
+                    refcount=models.F('refcount') + 1)
+
+    @classmethod
+    def release(cls, name):
+        """Drop a reference to the blob called name. Returns True if that
+        was the last one, in which case the Blob is deleted and it's up
+        to the caller to remove the file.
+        """
+
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                return False
+
+            if blob.refcount > 1:
+                cls.objects.filter(name=name).update(
+                    refcount=models.F('refcount') - 1)
+                return False
+
+            blob.delete()
+
+        return True
+
+
+class RetentionRule(models.Model):
+    """What the tier command does with one kind of a project's submission
+    files once the submission has been aligned (see tprs.tiering).
+    """
+
+    class Meta:
+        unique_together = (('project', 'kind'),)
+
+    COMPRESS = 'compress'
+    COLD = 'cold'
+    PRUNE = 'prune'
+    ACTIONS = (
+        (COMPRESS, 'Compress in place'),
+        (COLD, 'Move to cold storage'),
+        (PRUNE, 'Delete'),
+    )
+
+    project = models.ForeignKey(Project, related_name='retention_rules')
+    kind = models.CharField(
+        max_length=3, choices=[(t, t) for t in SUBMISSION_FILE_TYPES])
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    after_hours = models.FloatField(
+        default=0,
+        help_text='How long after alignment to wait before acting.')
+
+    def __str__(self):
+        return "%s: %s %s files" % (self.project, self.action, self.kind)
+
+
+class ArchivedFile(models.Model):
+    """The manifest entry for a submission file that has been compressed,
+    moved to cold storage or pruned by the tier command, which is enough
+    to restore it (unless it was pruned).
+    """
+
+    class Meta:
+        ordering = ('created',)
+        unique_together = (('submission', 'kind'),)
+
+    submission = models.ForeignKey(Submission, related_name='archived_files')
+    kind = models.CharField(
+        max_length=3, choices=[(t, t) for t in SUBMISSION_FILE_TYPES])
+    action = models.CharField(max_length=10, choices=RetentionRule.ACTIONS)
+
+    sha256 = models.CharField(
+        max_length=64, help_text='Hex digest of the original file.')
+    size = models.BigIntegerField(
+        help_text='Size of the original file, in bytes.')
+
+    path = models.CharField(
+        max_length=500, blank=True,
+        help_text='Where the archived copy is. Blank if it was pruned.')
+    encoding = models.CharField(
+        max_length=10, blank=True,
+        choices=[(e, e) for e in compression.SUFFIXES],
+        help_text='How the archived copy is compressed, if it is.')
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "%s (%s, %s)" % (self.submission, self.kind, self.action)
+
+
+@receiver(post_delete, sender=ArchivedFile)
+def archived_file_deleted(sender, instance, **kwargs):
+    """Remove an archived copy once no ArchivedFile refers to it (they
+    may be shared, like blobs). This waits for the deletion to commit,
+    so a rollback doesn't leave the manifest pointing at nothing.
+    """
+
+    path = instance.path
+    if not path:
+        return
+
+    def remove():
+        if ArchivedFile.objects.filter(path=path).exists():
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    transaction.on_commit(remove)
+
+
+class ProjectFeature(models.Model):
+    """A per-frame feature to compute for each of a project's alignments
+    (see tprs.features).
+    """
+
+    class Meta:
+        ordering = ('id',)
+        unique_together = (('project', 'name'),)
+
+    project = models.ForeignKey(Project, related_name='features')
+    name = models.CharField(
+        max_length=50,
+        help_text='Name of the column(s) holding the feature.')
+    kind = models.CharField(
+        max_length=200,
+        help_text='A registered feature (rmsd, rg or distances) or the '
+                  'dotted path of a function computing one.')
+    params_json = models.TextField(
+        blank=True, default='{}',
+        help_text='Keyword arguments for the feature, as a JSON object; '
+                  'e.g. {"pairs": [[0, 10]]} for distances.')
+
+    def __str__(self):
+        return "%s: %s" % (self.project, self.name)
+
+    def params(self):
+        return json.loads(self.params_json or '{}')
+
+    def clean(self):
+        from .features import get_feature
+
+        try:
+            get_feature(self.kind)
+        except ValueError as e:
+            raise ValidationError({'kind': str(e)})
+
+        try:
+            if not isinstance(self.params(), dict):
+                raise ValueError
+        except ValueError:
+            raise ValidationError(
+                {'params_json': 'Must be a JSON object.'})
+
+
+class FeatureSet(models.Model):
+    """The features (see tprs.features) of every frame of an alignment,
+    stored as a float32 .npy array with a row per frame and a column per
+    feature.
+    """
+
+    alignment = models.OneToOneField(Alignment, related_name='feature_set')
+    array = models.FileField(upload_to='features', max_length=500)
+
+    key = models.CharField(
+        max_length=64,
+        help_text='Digest of the features computed, to tell when the '
+                  "project's features have changed.")
+    columns_json = models.TextField(
+        help_text='Name of each column of the array, as a JSON list.')
+    n_frames = models.PositiveIntegerField(default=0)
+
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "Features of %s" % self.alignment.submission
+
+    def columns(self):
+        return json.loads(self.columns_json)
+
+    def load(self, mmap_mode=None):
+        """Read the array (see numpy.load for mmap_mode).
+        """
+        return np.load(self.array.path, mmap_mode=mmap_mode)
+
+
+def merge_ranges(ranges):
+    """Merge overlapping or adjacent [start, end) ranges, returning them
+    in order.
+    """
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        elif end > start:
+            merged.append([start, end])
+
+    return merged
+
+
+def known_content(project, sha256):
+    """Find a file the server already has with the given sha256, for
+    uploads to skip sending. Returns its path, or None.
+    """
+
+    # unless velocities are randomized, every WU's tpr is the project's
+    if sha256 == project.tpr_digest():
+        return TPR_CACHE.path(project.tpr_key())
+
+    blob = Blob.objects.filter(sha256=sha256).first()
+    if blob is not None:
+        return SUBMISSION_STORAGE.path(blob.name)
+
+    return None
@@ -0,0 +1,160 @@
+"""Pools of pre-built TPRs for projects that need a fresh TPR per work
+unit.
+
+Projects that generate velocities with a random seed get different
+starting velocities from every grompp run, so they can't be served
+from the TPR cache. Instead, each such project keeps a directory of
+TPRs built ahead of time; every work unit consumes one of them and a
+background thread tops the pool back up.
+"""
+
+import os
+import fcntl
+import uuid
+import logging
+import tempfile
+import threading
+
+from django.conf import settings
+
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+
+class TprPool(object):
+    """The pool of pre-built TPRs for a single project.
+
+    Entries are kept in a directory named for the project's tpr_key(),
+    so changing the project's files orphans the old entries rather than
+    handing them out.
+
+    Parameters
+    ----------
+    project : tprs.models.Project
+        The project whose TPRs this pool holds.
+    depth : int, default=settings.TPR_POOL_DEPTH
+        The number of TPRs fill() keeps on hand.
+    """
+
+    def __init__(self, project, depth=None):
+        self.project = project
+        self.depth = settings.TPR_POOL_DEPTH if depth is None else depth
+
+    @property
+    def project_root(self):
+        return os.path.join(cache.cache_root(), 'pool', self.project.name)
+
+    @property
+    def root(self):
+        return os.path.join(self.project_root, self.project.tpr_key())
+
+    def entries(self):
+        try:
+            return sorted(f for f in os.listdir(self.root)
+                          if f.endswith('.tpr'))
+        except FileNotFoundError:
+            return []
+
+    def __len__(self):
+        return len(self.entries())
+
+    def take(self):
+        """Remove one TPR from the pool and return its contents, or None
+        if the pool is empty.
+        """
+
+        for entry in self.entries():
+            path = os.path.join(self.root, entry)
+            claimed = path + '.' + uuid.uuid4().hex
+
+            # rename is atomic, so exactly one caller gets each entry
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+
+            try:
+                with open(claimed, 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                # removed as stale between the rename and the read
+                continue
+            finally:
+                if os.path.isfile(claimed):
+                    os.remove(claimed)
+
+        return None
+
+    def fill(self):
+        """Build TPRs until the pool holds self.depth of them. Returns
+        the number built, which is 0 if another thread or process is
+        already filling this pool.
+        """
+
+        os.makedirs(self.root, exist_ok=True)
+
+        with open(os.path.join(self.project_root, 'fill.lock'), 'wb') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+
+            try:
+                self._remove_stale()
+
+                n_built = 0
+                while len(self) < self.depth:
+                    tpr_data = self.project._grompp()
+
+                    fd, tmpname = tempfile.mkstemp(
+                        dir=self.root, suffix='.part')
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(tpr_data)
+                    os.replace(tmpname,
+                               os.path.join(self.root,
+                                            uuid.uuid4().hex + '.tpr'))
+                    n_built += 1
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        logger.debug('Added %s TPRs to pool for %s.',
+                     n_built, self.project.name)
+
+        return n_built
+
+    def fill_async(self):
+        """Start a background thread that fills the pool.
+        """
+
+        def fill():
+            try:
+                self.fill()
+            except Exception:
+                logger.exception('Failed to fill TPR pool for %s.',
+                                 self.project.name)
+
+        t = threading.Thread(target=fill, daemon=True)
+        t.start()
+
+        return t
+
+    def _remove_stale(self):
+        """Remove entries built from old versions of the project's files.
+        """
+
+        current = os.path.basename(self.root)
+
+        for key in os.listdir(self.project_root):
+            path = os.path.join(self.project_root, key)
+            if key != current and os.path.isdir(path):
+                for entry in os.listdir(path):
+                    try:
+                        os.remove(os.path.join(path, entry))
+                    except FileNotFoundError:
+                        pass
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    logger.warning('Could not remove stale TPR pool %s.',
+                                   path)
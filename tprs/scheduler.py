@@ -0,0 +1,105 @@
+"""Choosing which project the next work unit comes from.
+
+Every active project should get a share of the simulated time handed
+out in proportion to its weight. A project's progress is the simulated
+time already submitted for it plus that of its outstanding leases, and
+its deficit is how far that falls short of its share of everyone's
+progress; the next work unit goes to the project with the largest
+deficit. Projects that have reached their target_time aren't served.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.db import models as db_models, transaction
+from django.utils import timezone
+
+from .models import Project, Lease
+
+
+def deficits(progress, weights):
+    """How far behind its weighted share of the total progress each
+    project is.
+
+    Parameters
+    ----------
+    progress : dict
+        Simulated time (submitted and in flight) of each project, by
+        name.
+    weights : dict
+        Weight of each project, by name. Must be positive.
+
+    Returns
+    -------
+    deficits : dict
+        Each project's share of the total progress minus its own
+        progress. Negative for projects ahead of their share.
+    """
+
+    total_progress = sum(progress.values())
+    total_weight = sum(weights.values())
+
+    return {name: weights[name] / total_weight * total_progress - p
+            for name, p in progress.items()}
+
+
+def choose_project(now=None):
+    """Pick the active project with the largest deficit, or None if no
+    project needs more work.
+    """
+
+    # order_by() stops Lease's default ordering splitting up the groups
+    in_flight = dict(
+        Lease.outstanding(now).order_by().values_list('project').annotate(
+            db_models.Sum('expected_time')))
+
+    projects = {}
+    progress = {}
+    for project in Project.objects.filter(
+            active=True, weight__gt=0).select_related('statistics'):
+        p = project.simulated_time + in_flight.get(project.pk, 0)
+        if project.target_time is not None and p >= project.target_time:
+            continue
+
+        projects[project.pk] = project
+        progress[project.pk] = p
+
+    if not projects:
+        return None
+
+    d = deficits(progress, {name: p.weight for name, p in projects.items()})
+
+    # ties go to the first project by name, so choices are repeatable
+    return projects[max(sorted(d), key=d.get)]
+
+
+def next_work(hostname, now=None):
+    """Reclaim expired leases, choose a project (see choose_project) and
+    lease one of its work units to hostname for settings.LEASE_DURATION
+    seconds.
+
+    Returns
+    -------
+    lease : Lease or None
+        The new lease, or None if no project needs more work.
+    """
+
+    now = now or timezone.now()
+
+    Lease.reclaim(now)
+
+    project = choose_project(now)
+    if project is None:
+        return None
+
+    # this may run grompp and gmx dump the first time, which mustn't hold
+    # a write lock on the database meanwhile; a concurrent request may
+    # choose the same project, which only evens out over later leases
+    expected_time = project.current_tpr_info().simulated_time
+
+    with transaction.atomic():
+        return Lease.objects.create(
+            project=project,
+            hostname=hostname,
+            expires=now + datetime.timedelta(seconds=settings.LEASE_DURATION),
+            expected_time=expected_time)
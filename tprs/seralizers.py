@@ -1,23 +1,53 @@
+import os
 import subprocess
 import tempfile
 
 from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.urls import reverse
 
 from rest_framework import serializers
 
 from . import models
+from . import formats
+from . import compression
 
 
 def valid_xtc(tmpfile):
-    return valid_gmx_check(tmpfile, '.xtc')
+
+    if settings.GMX_CHECK_UPLOADS:
+        return valid_gmx_check(tmpfile, '.xtc')
+
+    try:
+        frames = formats.read_xtc_frames(tmpfile)
+        formats.check_xtc_continuity(frames)
+    except formats.FormatError as e:
+        raise serializers.ValidationError("Invalid xtc file: %s" % e)
+
+    if not frames:
+        raise serializers.ValidationError("The xtc file has no frames.")
 
 
 def valid_gro(tmpfile):
-    return valid_gmx_check(tmpfile, '.gro')
+
+    if settings.GMX_CHECK_UPLOADS:
+        return valid_gmx_check(tmpfile, '.gro')
+
+    try:
+        formats.read_gro_natoms(tmpfile)
+    except formats.FormatError as e:
+        raise serializers.ValidationError("Invalid gro file: %s" % e)
 
 
 def valid_cpt(tmpfile):
-    return valid_gmx_check(tmpfile, '.cpt')
+
+    if settings.GMX_CHECK_UPLOADS:
+        return valid_gmx_check(tmpfile, '.cpt')
+
+    try:
+        formats.read_cpt_header(tmpfile)
+    except formats.FormatError as e:
+        raise serializers.ValidationError("Invalid cpt file: %s" % e)
 
 
 def valid_gmx_check(tmpfile, suffix):
@@ -56,6 +86,49 @@ def validate_file_for_tpr(flag, file, tpr, timeout=None):
             p.stdout.decode('ascii'))
 
 
+class DecompressingFileField(serializers.FileField):
+    """A FileField that decompresses files whose names carry a compression
+    suffix (see tprs.compression), so that validators and storage only
+    ever see the original file.
+    """
+
+    def to_internal_value(self, data):
+
+        data = super(DecompressingFileField, self).to_internal_value(data)
+
+        name, encoding = compression.split_suffix(data.name)
+        if encoding is None:
+            return data
+
+        out = TemporaryUploadedFile(
+            name, 'application/octet-stream', None, None)
+        data.seek(0)
+
+        try:
+            compression.decompress_to(
+                data, encoding, out,
+                max_size=settings.MAX_DECOMPRESSED_UPLOAD)
+        except ValueError as e:
+            out.close()
+            raise serializers.ValidationError(str(e))
+
+        out.size = out.tell()
+        out.seek(0)
+
+        return out
+
+
+class TprInfoSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = models.TprInfo
+        fields = ['natoms', 'nsteps', 'dt', 'simulated_time',
+                  'nstxout_compressed', 'nstenergy', 'nstlog', 'groups']
+
+    simulated_time = serializers.FloatField(read_only=True)
+    groups = serializers.ListField(read_only=True)
+
+
 class ProjectSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
@@ -69,6 +142,9 @@ class ProjectSerializer(serializers.HyperlinkedModelSerializer):
     submissions = serializers.PrimaryKeyRelatedField(
         source='submission_set', many=True, read_only=True)
 
+    # null until the project's TPR has been built at least once
+    tpr_info = TprInfoSerializer(read_only=True, allow_null=True)
+
 
 class SubmissionSerializer(serializers.HyperlinkedModelSerializer):
 
@@ -77,12 +153,18 @@ class SubmissionSerializer(serializers.HyperlinkedModelSerializer):
         exclude = []
         read_only_fields = ['created']
 
-    xtc = serializers.FileField(validators=[valid_xtc])
-    gro = serializers.FileField(validators=[valid_gro])
-    cpt = serializers.FileField(validators=[valid_cpt])
+    xtc = DecompressingFileField(validators=[valid_xtc])
+    gro = DecompressingFileField(validators=[valid_gro])
+    cpt = DecompressingFileField(validators=[valid_cpt])
+    edr = DecompressingFileField()
+    log = DecompressingFileField()
+    tpr = DecompressingFileField()
 
     def validate(self, data):
 
+        if not settings.GMX_CHECK_UPLOADS:
+            self.validate_natoms(data)
+
         # verify TPRs match
         with tempfile.NamedTemporaryFile(suffix='.tpr') as s1:
             s1.write(data['project'].grompp().read())
@@ -94,10 +176,127 @@ class SubmissionSerializer(serializers.HyperlinkedModelSerializer):
 
                 validate_file_for_tpr('-s2', s2.name, s1.name)
 
-            with tempfile.NamedTemporaryFile(suffix='.xtc') as xtc:
-                [xtc.write(c) for c in data['xtc'].chunks()]
-                xtc.flush()
+        return data
 
-                # validate_file_for_tpr('-f', xtc.name, s1.name)
+    def validate_natoms(self, data):
+        """Check the gro, cpt and xtc hold as many atoms as the project.
+        Only used when the field validators read the files in-process,
+        in which case they have already checked these parse; with
+        GMX_CHECK_UPLOADS, files gmx accepts mustn't be refused because
+        tprs.formats can't read them.
+        """
 
-        return data
+        try:
+            natoms = data['project'].natoms()
+            gro_natoms = formats.read_gro_natoms(data['gro'])
+            cpt_natoms = formats.read_cpt_header(data['cpt']).natoms
+            xtc_natoms = formats.read_xtc_frames(data['xtc'])[0].natoms
+        except formats.FormatError as e:
+            raise serializers.ValidationError(str(e))
+
+        if gro_natoms != natoms or cpt_natoms != natoms:
+            raise serializers.ValidationError(
+                "Project has %s atoms, but submitted gro has %s and cpt "
+                "has %s." % (natoms, gro_natoms, cpt_natoms))
+
+        # xtcs may only hold a subset of atoms (see compressed-x-grps)
+        if xtc_natoms > natoms:
+            raise serializers.ValidationError(
+                "Submitted xtc has %s atoms, but the project only has %s." %
+                (xtc_natoms, natoms))
+
+
+class PendingSubmissionSerializer(serializers.HyperlinkedModelSerializer):
+
+    class Meta:
+        model = models.PendingSubmission
+        exclude = []
+        read_only_fields = ['created', 'status', 'detail']
+
+    # files are only checked once the upload is validated
+    xtc = serializers.FileField()
+    edr = serializers.FileField()
+    tpr = serializers.FileField()
+    gro = serializers.FileField()
+    log = serializers.FileField()
+    cpt = serializers.FileField()
+
+    submission = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class ProjectStatisticsSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = models.ProjectStatistics
+        fields = ['project', 'n_submissions', 'n_aligned', 'n_unaligned',
+                  'n_frames', 'simulated_time', 'n_bytes']
+
+    n_unaligned = serializers.IntegerField(read_only=True)
+
+
+class LeaseSerializer(serializers.HyperlinkedModelSerializer):
+
+    class Meta:
+        model = models.Lease
+        fields = ['url', 'project', 'tpr', 'hostname', 'created', 'expires',
+                  'expected_time', 'submission']
+
+    # the project's name, which is what clients need to fetch and submit
+    project = serializers.PrimaryKeyRelatedField(read_only=True)
+    submission = serializers.PrimaryKeyRelatedField(read_only=True)
+    tpr = serializers.SerializerMethodField()
+
+    def get_tpr(self, lease):
+        url = reverse('tpr-generate', args=(lease.project_id,))
+        request = self.context.get('request')
+
+        return url if request is None else request.build_absolute_uri(url)
+
+
+class UploadFileSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = models.UploadFile
+        fields = ['kind', 'size', 'sha256', 'encoding', 'received',
+                  'missing']
+
+    received = serializers.ListField(read_only=True)
+    missing = serializers.ListField(read_only=True)
+
+
+class UploadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = models.Upload
+        fields = ['id', 'url', 'project', 'hostname', 'created', 'files',
+                  'pending']
+        read_only_fields = ['created', 'pending']
+
+    url = serializers.HyperlinkedIdentityField(view_name='upload-detail')
+    files = UploadFileSerializer(many=True)
+    pending = serializers.HyperlinkedRelatedField(
+        view_name='pendingsubmission-detail', read_only=True)
+
+    def validate_files(self, files):
+
+        kinds = sorted(f['kind'] for f in files)
+        if kinds != sorted(models.SUBMISSION_FILE_TYPES):
+            raise serializers.ValidationError(
+                "Expected one each of %s files, got %s." %
+                (", ".join(models.SUBMISSION_FILE_TYPES), ", ".join(kinds)))
+
+        return files
+
+    def create(self, validated_data):
+
+        files = validated_data.pop('files')
+        upload = models.Upload.objects.create(**validated_data)
+
+        for f in files:
+            upload_file = models.UploadFile.objects.create(upload=upload, **f)
+
+            known = models.known_content(upload.project, f['sha256'])
+            if known is not None and os.path.getsize(known) == f['size']:
+                upload_file.fill_from(known)
+
+        return upload
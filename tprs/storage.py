@@ -0,0 +1,108 @@
+"""Content-addressed storage for submission files.
+
+Most of what clients submit is stored many times over: every work unit
+of a project sends back the same TPR, for instance. DedupStorage keeps
+one copy of each distinct file, named for its sha256, and counts the
+references to it with a tprs.models.Blob, so a copy is only removed
+once nothing refers to it any more.
+"""
+
+import os
+import hashlib
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+from .formats import XTC_INDEX_SUFFIX
+
+BLOB_DIR = 'blobs'
+
+
+@deconstructible
+class DedupStorage(FileSystemStorage):
+    """A FileSystemStorage that saves byte-identical files once.
+
+    Files are named blobs/<first two digits of sha256>/<sha256><ext>,
+    keeping the extension of the name they were saved under, since gmx
+    goes by extensions. Files saved before this storage was used keep
+    their names and are deleted as usual.
+    """
+
+    def is_blob(self, name):
+        return name.startswith(BLOB_DIR + '/')
+
+    def delete_sidecars(self, name):
+        """Remove files kept next to a deleted file, such as its frame
+        index.
+        """
+
+        try:
+            os.remove(self.path(name) + XTC_INDEX_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def get_available_name(self, name, max_length=None):
+        # _save chooses the name, and sharing one is the point
+        return name
+
+    def _save(self, name, content):
+        # imported here since the models module imports this one
+        from .models import Blob
+
+        blob_dir = self.path(BLOB_DIR)
+        os.makedirs(blob_dir, exist_ok=True)
+
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=blob_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                content.seek(0)
+                for chunk in content.chunks():
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            sha256 = h.hexdigest()
+            name = '/'.join([BLOB_DIR, sha256[:2],
+                             sha256 + os.path.splitext(name)[1]])
+
+            with transaction.atomic():
+                Blob.acquire(name, sha256, size)
+
+                path = self.path(name)
+                if not os.path.isfile(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.chmod(tmp, 0o644)
+                    os.replace(tmp, path)
+        finally:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+
+        return name
+
+    def release(self, name):
+        """Drop one reference to a blob, removing it if that was the last.
+        Names of files that aren't blobs are left alone.
+        """
+
+        from .models import Blob
+
+        if not self.is_blob(name):
+            return
+
+        # remove the file before anyone else can take a new reference
+        with transaction.atomic():
+            if Blob.release(name):
+                super(DedupStorage, self).delete(name)
+                self.delete_sidecars(name)
+
+    def delete(self, name):
+
+        if self.is_blob(name):
+            self.release(name)
+        else:
+            super(DedupStorage, self).delete(name)
+            self.delete_sidecars(name)
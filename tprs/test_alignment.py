@@ -1,12 +1,23 @@
+import io
 import os
 import shutil
+import unittest
+
+import numpy as np
 
 from django.test import TestCase, override_settings
 from django.conf import settings
 from django.core.management.base import CommandError
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APITestCase
 
 from .seralizers import valid_xtc
-from .models import Project, Submission, Alignment
+from .models import Project, Submission, Alignment, SUBSET_TPR_CACHE
+from . import cache
+from . import formats
+from . import trajectory
 
 
 @override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
@@ -55,6 +66,10 @@ class SubmissionAlignmentTest(TestCase):
         except:
             self.fail("Aligned xtc didn't validate!")
 
+        self.assertTrue(os.path.isfile(formats.xtc_index_path(aln.xtc.path)))
+        self.assertEqual(len(aln.xtc_index()),
+                         len(formats.read_xtc_frames(aln.xtc)))
+
         self.assertEqual(
             aln.group_pdb.path,
             os.path.join(
@@ -96,3 +111,233 @@ class SubmissionAlignmentTest(TestCase):
         self.assertEqual(
             aln0.group_pdb,
             aln1.group_pdb)
+
+    def test_subset_tpr_cached(self):
+
+        key = cache.digest(self.project.tpr_key(), 'Prot-Masses')
+        self.assertIsNone(SUBSET_TPR_CACHE.get(key))
+
+        self.sub.align(group='Protein', tpr_subset='Prot-Masses')
+
+        self.assertIsNotNone(SUBSET_TPR_CACHE.get(key))
+        self.assertEqual(SUBSET_TPR_CACHE.get(key),
+                         self.project.subset_tpr('Prot-Masses'))
+
+    @unittest.skipIf(trajectory.XTCTrajectoryFile is None,
+                     "mdtraj isn't installed")
+    @override_settings(FEATURIZE_ALIGNMENTS=True)
+    def test_align_numpy(self):
+
+        self.project.align_engine = Project.NUMPY_ENGINE
+        self.project.save()
+
+        sub2 = Submission.objects.create(
+            project=self.project,
+            hostname='debug01',
+            xtc='testdata/submission/plcg_sh2_wt.xtc',
+            log='testdata/submission/plcg_sh2_wt.log',
+            edr='testdata/submission/plcg_sh2_wt.edr',
+            gro='testdata/submission/plcg_sh2_wt.gro',
+            cpt='testdata/submission/plcg_sh2_wt.cpt',
+            tpr='testdata/plcg_sh2_wt.tpr')
+
+        aln0 = self.sub.align(group='Protein', tpr_subset='Prot-Masses')
+        aln1 = sub2.align(group='Protein', tpr_subset='Prot-Masses')
+
+        with open(self.sub.xtc.path, 'rb') as f:
+            n_frames = len(formats.read_xtc_frames(f))
+        n_atoms = len(self.project.group_indices('Prot-Masses', 'Protein'))
+
+        frames = formats.read_xtc_frames(aln1.xtc)
+        self.assertEqual(len(frames), n_frames)
+        self.assertEqual(frames[0].natoms, n_atoms)
+
+        # features are computed as each alignment is stored
+        self.assertEqual(aln1.feature_set.n_frames, n_frames)
+        self.assertEqual(aln1.feature_set.columns(), ['rmsd', 'rg'])
+
+        # later alignments are superposed onto the first's group PDB
+        reference = trajectory.read_pdb_xyz(aln0.group_pdb.path)
+        xyz, _, _, _ = trajectory.XTCTrajectoryFile(aln1.xtc.path).read()
+        np.testing.assert_allclose(
+            xyz.mean(axis=1),
+            np.repeat(reference.mean(axis=0)[None], n_frames, axis=0),
+            atol=2e-3)
+
+
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
+class AlignedXtcViewTests(APITestCase):
+
+    def setUp(self):
+        shutil.copytree(
+            os.path.join(settings.BASE_DIR, 'testdata'),
+            os.path.join(settings.MEDIA_ROOT, 'testdata'))
+
+        self.project = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        # stand-ins for aligned trajectories
+        for hostname in ['debug01', 'debug02', 'debug01']:
+            sub = Submission.objects.create(
+                project=self.project,
+                hostname=hostname,
+                xtc='testdata/submission/plcg_sh2_wt.xtc')
+            Alignment.objects.create(
+                submission=sub, group='Protein', tpr_subset='Prot-Masses',
+                xtc='testdata/submission/plcg_sh2_wt.xtc')
+
+        with open(os.path.join(settings.MEDIA_ROOT, 'testdata',
+                               'submission', 'plcg_sh2_wt.xtc'), 'rb') as f:
+            self.xtc = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT)
+
+    def get(self, **params):
+        url = reverse('aligned-xtc', kwargs={'protein': 'plcg_sh2_wt'})
+        return self.client.get(url, params)
+
+    def test_aligned_xtc(self):
+
+        response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+
+        content = b''.join(response.streaming_content)
+        self.assertEqual(content, self.xtc * 3)
+
+        # still a valid xtc, with every submission's frames
+        with open(os.path.join(settings.MEDIA_ROOT, 'testdata',
+                               'submission', 'plcg_sh2_wt.xtc'), 'rb') as f:
+            n_frames = len(formats.read_xtc_frames(f))
+        self.assertEqual(len(formats.read_xtc_frames(io.BytesIO(content))),
+                         3 * n_frames)
+
+    def test_aligned_xtc_filtered(self):
+
+        response = self.get(hostname='debug01')
+        self.assertEqual(b''.join(response.streaming_content), self.xtc * 2)
+
+        response = self.get(since='2000-01-01', until='2000-01-02')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+        response = self.get(since='2000-01-01T12:00:00')
+        self.assertEqual(b''.join(response.streaming_content), self.xtc * 3)
+
+        response = self.get(since='yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_aligned_xtc_no_project(self):
+
+        url = reverse('aligned-xtc', kwargs={'protein': 'nonexistant'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
+class XtcSliceViewTests(APITestCase):
+
+    def setUp(self):
+        shutil.copytree(
+            os.path.join(settings.BASE_DIR, 'testdata'),
+            os.path.join(settings.MEDIA_ROOT, 'testdata'))
+
+        self.project = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        # alanine dipeptide stands in for an aligned trajectory
+        self.xtc = os.path.join(settings.MEDIA_ROOT, 'testdata', 'alanine.xtc')
+        with open(os.path.join(settings.MEDIA_ROOT, 'testdata',
+                               'alanine.pdb'), 'w') as f:
+            for i in range(22):
+                f.write('ATOM  %5d %-4s ALA A   1    %8.3f%8.3f%8.3f'
+                        '  1.00  0.00\n' %
+                        (i + 1, 'CA' if i % 8 == 4 else 'H', 0, 0, 0))
+
+        self.sub = Submission.objects.create(
+            project=self.project, hostname='debug01',
+            xtc='testdata/alanine.xtc')
+        self.aln = Alignment.objects.create(
+            submission=self.sub, group='Protein', tpr_subset='Prot-Masses',
+            xtc='testdata/alanine.xtc', group_pdb='testdata/alanine.pdb')
+
+        with open(self.xtc, 'rb') as f:
+            self.data = f.read()
+            self.frames = formats.read_xtc_frames(f)
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT)
+
+    def get(self, name='alignment-slice', **params):
+        pk = self.aln.pk if name == 'alignment-slice' else self.sub.pk
+        return self.client.get(reverse(name, args=(pk,)), params)
+
+    def frame_bytes(self, i):
+        start = self.frames[i].offset
+        end = (self.frames[i + 1].offset if i + 1 < len(self.frames)
+               else len(self.data))
+        return self.data[start:end]
+
+    def test_frame_slice(self):
+
+        response = self.get(start=10, stop=20, stride=3)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            b''.join(self.frame_bytes(i) for i in [10, 13, 16, 19]))
+
+        response = self.get()
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+        response = self.get(name='submission-slice', start=-2)
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.frame_bytes(499) + self.frame_bytes(500))
+
+        response = self.get(start=600)
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    @unittest.skipIf(trajectory.XTCTrajectoryFile is None,
+                     "mdtraj isn't installed")
+    def test_atom_slice(self):
+
+        response = self.get(stride=100, atoms='1-3,22')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        sliced = os.path.join(settings.MEDIA_ROOT, 'sliced.xtc')
+        with open(sliced, 'wb') as f:
+            f.write(b''.join(response.streaming_content))
+
+        xyz, time, _, _ = trajectory.XTCTrajectoryFile(sliced).read()
+        full, full_time, _, _ = trajectory.XTCTrajectoryFile(
+            self.xtc).read()
+
+        self.assertEqual(xyz.shape, (6, 4, 3))
+        np.testing.assert_allclose(time, full_time[::100])
+        np.testing.assert_allclose(xyz, full[::100][:, [0, 1, 2, 21]],
+                                   atol=1e-3)
+
+        response = self.get(names='CA', start=0, stop=1)
+        with open(sliced, 'wb') as f:
+            f.write(b''.join(response.streaming_content))
+        xyz, _, _, _ = trajectory.XTCTrajectoryFile(sliced).read()
+        np.testing.assert_allclose(xyz, full[:1, [4, 12, 20]], atol=1e-3)
+
+    def test_bad_slice(self):
+
+        for params in [{'stride': 0}, {'start': 'first'}, {'atoms': 'CA'},
+                       {'names': 'CB'}]:
+            response = self.get(**params)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST, params)
+
+        # submissions have no group pdb
+        response = self.get(name='submission-slice', names='CA')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,87 @@
+import os
+import shutil
+import hashlib
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.test import override_settings, SimpleTestCase
+
+from . import cache
+
+
+@override_settings(
+    GROMPPERY_CACHE_ROOT=os.path.join(settings.BASE_DIR, 'test-cache'))
+class FileCacheTests(SimpleTestCase):
+
+    def tearDown(self):
+        if os.path.isdir(settings.GROMPPERY_CACHE_ROOT):
+            shutil.rmtree(settings.GROMPPERY_CACHE_ROOT)
+
+    def test_digest_is_unambiguous(self):
+
+        self.assertEqual(cache.digest('ab', b'c'), cache.digest(b'ab', 'c'))
+        self.assertNotEqual(cache.digest('ab', 'c'), cache.digest('a', 'bc'))
+
+    def test_get_or_build(self):
+
+        c = cache.FileCache('test', suffix='.dat')
+
+        self.assertIsNone(c.get('key'))
+        self.assertEqual(c.get_or_build('key', lambda: b'data'), b'data')
+        self.assertEqual(c.get('key'), b'data')
+        self.assertTrue(os.path.isfile(c.path('key')))
+
+        # cached data is returned without building again
+        self.assertEqual(
+            c.get_or_build('key', lambda: self.fail('Rebuilt entry!')),
+            b'data')
+
+    def test_single_flight(self):
+
+        c = cache.FileCache('test')
+        builds = []
+
+        def build():
+            builds.append(None)
+            time.sleep(0.2)
+            return b'data'
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(c.get_or_build('key', build)))
+            for i in range(8)]
+
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(results, [b'data'] * 8)
+
+    def test_file_digests_bounded(self):
+
+        root = settings.GROMPPERY_CACHE_ROOT
+        os.makedirs(root)
+        paths = [os.path.join(root, str(i)) for i in range(3)]
+        for path in paths:
+            with open(path, 'wb') as f:
+                f.write(path.encode())
+
+        with mock.patch.object(cache, 'FILE_DIGESTS_SIZE', 2), \
+                mock.patch.dict(cache._FILE_DIGESTS, clear=True):
+            for path in paths:
+                self.assertEqual(cache.file_digest(path),
+                                 hashlib.sha256(path.encode()).hexdigest())
+
+            # only the most recently used paths are remembered
+            self.assertEqual(list(cache._FILE_DIGESTS), paths[1:])
+
+            # a changed file replaces its entry, rather than adding one
+            with open(paths[2], 'wb') as f:
+                f.write(b'changed')
+            os.utime(paths[2], ns=(0, 0))
+            self.assertEqual(cache.file_digest(paths[2]),
+                             hashlib.sha256(b'changed').hexdigest())
+            self.assertEqual(list(cache._FILE_DIGESTS), paths[1:])
@@ -0,0 +1,66 @@
+import io
+
+from django.test import SimpleTestCase
+
+from . import compression
+
+
+class CompressionTests(SimpleTestCase):
+
+    def test_negotiate(self):
+
+        best = compression.available()[0]
+
+        self.assertEqual(compression.negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(compression.negotiate('*'), best)
+        self.assertEqual(compression.negotiate('zstd;q=0.5, gzip'), 'gzip')
+        self.assertIsNone(compression.negotiate(''))
+        self.assertIsNone(compression.negotiate('gzip;q=0, br'))
+        self.assertIsNone(compression.negotiate('*;q=0'))
+
+    def test_round_trip(self):
+
+        data = b'Step Time\n' * 1000
+
+        for encoding in compression.available():
+            compressed = compression.compress(data, encoding)
+            self.assertLess(len(compressed), len(data))
+
+            out = io.BytesIO()
+            compression.decompress_to(io.BytesIO(compressed), encoding, out)
+            self.assertEqual(out.getvalue(), data)
+
+            streamed = io.BytesIO()
+            compression.compress_to(io.BytesIO(data), encoding, streamed)
+            out = io.BytesIO()
+            compression.decompress_to(
+                io.BytesIO(streamed.getvalue()), encoding, out)
+            self.assertEqual(out.getvalue(), data)
+
+    def test_max_size(self):
+
+        # a few KB that decompress to 10 MB
+        data = b'\0' * (10 * 1024 * 1024)
+
+        for encoding in compression.available():
+            compressed = compression.compress(data, encoding)
+
+            out = io.BytesIO()
+            with self.assertRaises(ValueError):
+                compression.decompress_to(io.BytesIO(compressed), encoding,
+                                          out, max_size=1024 * 1024)
+            # stopped before writing past the limit
+            self.assertLessEqual(len(out.getvalue()), 1024 * 1024)
+
+            out = io.BytesIO()
+            compression.decompress_to(io.BytesIO(compressed), encoding, out,
+                                      max_size=len(data))
+            self.assertEqual(len(out.getvalue()), len(data))
+
+    def test_split_suffix(self):
+
+        self.assertEqual(compression.split_suffix('a.log.gz'),
+                         ('a.log', 'gzip'))
+        self.assertEqual(compression.split_suffix('a.log.zst'),
+                         ('a.log', 'zstd'))
+        self.assertEqual(compression.split_suffix('a.log'), ('a.log', None))
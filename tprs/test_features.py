@@ -0,0 +1,206 @@
+import io
+import os
+import shutil
+import unittest
+
+import numpy as np
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from .models import (Project, Submission, Alignment, FeatureSet,
+                     ProjectFeature)
+from . import features
+from . import trajectory
+
+
+def spread(xyz, reference, scale=1):
+    """A custom feature, for tests: the largest extent along each axis.
+    """
+    return scale * (xyz.max(axis=1) - xyz.min(axis=1))
+
+
+class FeatureTests(SimpleTestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.reference = random.uniform(size=(10, 3))
+
+        # rotate about z and translate each frame
+        theta = np.linspace(0, np.pi, 4)
+        rot = np.zeros((4, 3, 3))
+        rot[:, 0, 0] = rot[:, 1, 1] = np.cos(theta)
+        rot[:, 0, 1] = -np.sin(theta)
+        rot[:, 1, 0] = np.sin(theta)
+        rot[:, 2, 2] = 1
+        self.xyz = (np.matmul(self.reference, rot) +
+                    random.uniform(size=(4, 1, 3)))
+
+    def test_rmsd(self):
+
+        np.testing.assert_allclose(
+            features.rmsd(self.xyz, self.reference), 0, atol=1e-6)
+
+        moved = self.xyz.copy()
+        moved[:, 0] += [0.3, 0.4, 0]
+        self.assertTrue(np.all(features.rmsd(moved, self.reference) > 0))
+
+    def test_rg(self):
+
+        xyz = np.array([[[-1, 0, 0], [1, 0, 0]],
+                        [[0, -2, 5], [0, 2, 5]]], dtype=float)
+        np.testing.assert_allclose(
+            features.radius_of_gyration(xyz, None), [1, 2])
+
+        # rigid motions don't change it
+        rg = features.radius_of_gyration(self.xyz, None)
+        np.testing.assert_allclose(rg, rg[0])
+
+    def test_distances(self):
+
+        d = features.distances(self.xyz, None, pairs=[[0, 1], [2, 5]])
+        self.assertEqual(d.shape, (4, 2))
+        np.testing.assert_allclose(
+            d[:, 0], np.linalg.norm(self.reference[0] - self.reference[1]))
+
+    def test_get_feature(self):
+
+        self.assertIs(features.get_feature('rg'),
+                      features.radius_of_gyration)
+        self.assertIs(features.get_feature('tprs.test_features.spread'),
+                      spread)
+
+        with self.assertRaises(ValueError):
+            features.get_feature('nonexistant')
+
+    def test_clean(self):
+
+        with self.assertRaises(ValidationError):
+            ProjectFeature(name='x', kind='nonexistant').clean()
+        with self.assertRaises(ValidationError):
+            ProjectFeature(name='x', kind='rg', params_json='[1]').clean()
+
+        ProjectFeature(name='x', kind='distances',
+                       params_json='{"pairs": [[0, 1]]}').clean()
+
+
+@unittest.skipIf(trajectory.XTCTrajectoryFile is None,
+                 "mdtraj isn't installed")
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
+class FeaturizeTests(APITestCase):
+
+    def setUp(self):
+        shutil.copytree(
+            os.path.join(settings.BASE_DIR, 'testdata'),
+            os.path.join(settings.MEDIA_ROOT, 'testdata'))
+
+        self.project = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        # alanine dipeptide stands in for an aligned trajectory, with its
+        # first frame as the group PDB
+        xtc = os.path.join(settings.MEDIA_ROOT, 'testdata', 'alanine.xtc')
+        self.xyz, _, _, _ = trajectory.XTCTrajectoryFile(xtc).read()
+        with open(os.path.join(settings.MEDIA_ROOT, 'testdata',
+                               'alanine.pdb'), 'w') as f:
+            for i, (x, y, z) in enumerate(self.xyz[0] * 10):
+                f.write('ATOM  %5d  C   ALA A   1    %8.3f%8.3f%8.3f'
+                        '  1.00  0.00\n' % (i + 1, x, y, z))
+
+        self.alignments = [self.add_alignment() for i in range(2)]
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT)
+
+    def add_alignment(self):
+        sub = Submission.objects.create(
+            project=self.project, hostname='debug01',
+            xtc='testdata/alanine.xtc')
+        return Alignment.objects.create(
+            submission=sub, group='Protein', tpr_subset='Prot-Masses',
+            xtc='testdata/alanine.xtc', group_pdb='testdata/alanine.pdb')
+
+    def featurize(self):
+        out = io.StringIO()
+        call_command('featurize', stdout=out)
+        return out.getvalue()
+
+    def test_featurize(self):
+
+        self.assertIn('Featurized 2 alignments', self.featurize())
+
+        fs = FeatureSet.objects.get(alignment=self.alignments[0])
+        self.assertEqual(fs.columns(), ['rmsd', 'rg'])
+        self.assertEqual(fs.n_frames, len(self.xyz))
+
+        array = fs.load()
+        self.assertEqual(array.dtype, np.float32)
+        self.assertEqual(array.shape, (len(self.xyz), 2))
+        self.assertAlmostEqual(array[0, 0], 0, places=3)
+        np.testing.assert_allclose(
+            array[:, 1],
+            features.radius_of_gyration(self.xyz.astype(float), None),
+            rtol=1e-5)
+
+        # only new alignments are featurized
+        self.assertIn('Featurized 0 alignments', self.featurize())
+        self.add_alignment()
+        self.assertIn('Featurized 1 alignments', self.featurize())
+
+    def test_project_features(self):
+
+        ProjectFeature.objects.create(
+            project=self.project, name='d', kind='distances',
+            params_json='{"pairs": [[0, 1], [0, 21]]}')
+        ProjectFeature.objects.create(
+            project=self.project, name='spread',
+            kind='tprs.test_features.spread', params_json='{"scale": 2}')
+
+        self.featurize()
+
+        fs = FeatureSet.objects.get(alignment=self.alignments[1])
+        self.assertEqual(fs.columns(), ['d[0]', 'd[1]', 'spread[0]',
+                                        'spread[1]', 'spread[2]'])
+        np.testing.assert_allclose(
+            fs.load()[:, 2:],
+            2 * (self.xyz.max(axis=1) - self.xyz.min(axis=1)), rtol=1e-5)
+
+        # changing the project's features makes every set stale
+        ProjectFeature.objects.filter(name='spread').delete()
+        self.assertEqual(len(list(features.stale())), 2)
+        self.featurize()
+
+        fs.refresh_from_db()
+        self.assertEqual(fs.columns(), ['d[0]', 'd[1]'])
+        self.assertEqual(fs.load().shape, (len(self.xyz), 2))
+
+    def test_feature_index(self):
+
+        self.featurize()
+
+        response = self.client.get(
+            reverse('feature-index', kwargs={'protein': 'plcg_sh2_wt'}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(response.data['n_frames'], 2 * len(self.xyz))
+        entries = response.data['feature_sets']
+        self.assertEqual([e['first_frame'] for e in entries],
+                         [0, len(self.xyz)])
+        self.assertEqual(entries[0]['columns'], ['rmsd', 'rg'])
+
+        response = self.client.get(entries[1]['url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        array = np.load(io.BytesIO(b''.join(response.streaming_content)))
+        np.testing.assert_array_equal(
+            array, FeatureSet.objects.get(
+                alignment=self.alignments[1]).load())
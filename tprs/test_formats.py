@@ -0,0 +1,228 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from . import formats
+
+
+def xtc_frame(natoms, step, time, payload=b'\x01\x02\x03'):
+    """Build a single xtc frame. Frames with more than 9 atoms get a
+    'compressed' coordinate block holding payload.
+    """
+
+    box = [3.0, 0, 0, 0, 3.0, 0, 0, 0, 3.0]
+    frame = formats.XTC_HEADER.pack(
+        formats.XTC_MAGIC, natoms, step, time, *box)
+
+    if natoms <= formats.XTC_MAX_UNCOMPRESSED_ATOMS:
+        frame += formats.XDR_INT.pack(natoms)
+        frame += struct.pack('>%sf' % (3 * natoms), *([0.5] * 3 * natoms))
+    else:
+        frame += formats.XTC_COMPRESSED_HEADER.pack(
+            natoms, 1000.0, 0, 0, 0, 10, 10, 10, 5, len(payload))
+        frame += payload + b'\x00' * (-len(payload) % 4)
+
+    return frame
+
+
+def xdr_string(s):
+    data = s.encode('latin')
+    return (formats.XDR_INT.pack(len(data)) + data +
+            b'\x00' * (-len(data) % 4))
+
+
+def cpt_header(natoms, file_version=17):
+
+    header = formats.XDR_INT.pack(formats.CPT_MAGIC)
+    header += b''.join(xdr_string(s) for s in
+                       ['VERSION 2018.3', 'today', 'user', 'host',
+                        'gmx mdrun', 'now'])
+    header += formats.XDR_INT.pack(file_version)
+    header += formats.XDR_INT.pack(0)
+    header += xdr_string('node01')
+    header += formats.XDR_INT.pack(natoms)
+
+    return header + b'\x00' * 64
+
+
+class XtcTests(SimpleTestCase):
+
+    def test_compressed_frames(self):
+
+        data = b''.join(xtc_frame(1000, 5000 * i, 10.0 * i, b'x' * (i + 1))
+                        for i in range(4))
+
+        frames = formats.read_xtc_frames(io.BytesIO(data))
+
+        self.assertEqual(len(frames), 4)
+        self.assertEqual([f.natoms for f in frames], [1000] * 4)
+        self.assertEqual([f.step for f in frames], [0, 5000, 10000, 15000])
+        self.assertEqual([f.time for f in frames], [0, 10, 20, 30])
+        self.assertEqual(frames[0].offset, 0)
+        self.assertEqual(frames[1].offset, len(xtc_frame(1000, 0, 0, b'x')))
+
+        formats.check_xtc_continuity(frames)
+
+    def test_real_xtc(self):
+
+        with open(os.path.join(settings.BASE_DIR,
+                               'testdata/alanine.xtc'), 'rb') as f:
+            frames = formats.read_xtc_frames(f)
+
+        self.assertEqual(len(frames), 501)
+        self.assertEqual(frames[0].natoms, 22)
+        self.assertEqual(frames[0].step, 250000)
+        self.assertAlmostEqual(frames[-1].time, 1000, places=3)
+
+        formats.check_xtc_continuity(frames)
+
+    def test_uncompressed_frames(self):
+
+        data = b''.join(xtc_frame(3, i, 2.0 * i) for i in range(3))
+        frames = formats.read_xtc_frames(io.BytesIO(data))
+
+        self.assertEqual([f.natoms for f in frames], [3] * 3)
+        self.assertEqual(frames[0].box[0], 3.0)
+
+    def test_truncated(self):
+
+        data = b''.join(xtc_frame(1000, i, i) for i in range(2))
+
+        with self.assertRaises(formats.FormatError):
+            formats.read_xtc_frames(io.BytesIO(data[:-5]))
+
+    def test_garbage(self):
+
+        with self.assertRaises(formats.FormatError):
+            formats.read_xtc_frames(io.BytesIO(os.urandom(1000)))
+
+    def test_time_gap(self):
+
+        frames = formats.read_xtc_frames(io.BytesIO(b''.join(
+            xtc_frame(1000, 0, t) for t in [0, 10, 20, 40])))
+
+        with self.assertRaises(formats.FormatError):
+            formats.check_xtc_continuity(frames)
+
+
+class XtcIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.xtc = os.path.join(self.dir, 'traj.xtc')
+
+        with open(self.xtc, 'wb') as f:
+            for i in range(5):
+                f.write(xtc_frame(1000, 500 * i, 2.5 * i, b'x' * (i + 1)))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_index(self):
+
+        index = formats.write_xtc_index(self.xtc)
+
+        self.assertEqual(index.path, self.xtc + '.idx')
+        self.assertEqual(os.path.getsize(index.path),
+                         5 * formats.XTC_INDEX_ENTRY.size)
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.time_range(), (0, 10))
+        self.assertEqual(index[-1][1], 2000)
+
+        with self.assertRaises(IndexError):
+            index[5]
+
+        # offsets land on frames
+        with open(self.xtc, 'rb') as f:
+            frames = formats.read_xtc_frames(f)
+            for i, frame in enumerate(frames):
+                self.assertEqual(index[i], (frame.offset, frame.step,
+                                            frame.time))
+
+                f.seek(index.offset(i))
+                header = formats.XTC_HEADER.unpack(
+                    f.read(formats.XTC_HEADER.size))
+                self.assertEqual(header[:4], (formats.XTC_MAGIC, 1000,
+                                              frame.step, frame.time))
+
+    def test_extents(self):
+
+        index = formats.write_xtc_index(self.xtc)
+        size = os.path.getsize(self.xtc)
+        offsets = [index.offset(i) for i in range(5)] + [size]
+
+        # consecutive frames are read in one go
+        self.assertEqual(list(index.extents(range(1, 4), size)),
+                         [(offsets[1], offsets[4] - offsets[1])])
+        self.assertEqual(list(index.extents(range(0, 5, 2), size)),
+                         [(offsets[i], offsets[i + 1] - offsets[i])
+                          for i in [0, 2, 4]])
+        self.assertEqual(list(index.extents(range(0), size)), [])
+
+        with open(self.xtc, 'rb') as f:
+            data = f.read()
+            self.assertEqual(
+                b''.join(formats.read_extents(
+                    f, index.extents(range(5), size), chunk_size=7)),
+                data)
+
+    def test_load_rebuilds_stale(self):
+
+        with open(formats.xtc_index_path(self.xtc), 'wb') as f:
+            f.write(b'')
+        index = formats.load_xtc_index(self.xtc)
+        self.assertEqual(len(index), 0)
+
+        # the xtc has since been rewritten
+        mtime = os.path.getmtime(self.xtc) + 10
+        os.utime(self.xtc, (mtime, mtime))
+        self.assertEqual(len(formats.load_xtc_index(self.xtc)), 5)
+
+        os.remove(index.path)
+        self.assertEqual(len(formats.load_xtc_index(self.xtc)), 5)
+
+
+class GroTests(SimpleTestCase):
+
+    def test_read_gro_natoms(self):
+
+        with open(os.path.join(settings.BASE_DIR,
+                               'testdata/plcg_sh2_wt.gro'), 'rb') as f:
+            natoms = formats.read_gro_natoms(f)
+            f.seek(0)
+            self.assertEqual(natoms, int(f.read().splitlines()[1]))
+
+    def test_truncated_gro(self):
+
+        with open(os.path.join(settings.BASE_DIR,
+                               'testdata/plcg_sh2_wt.gro'), 'rb') as f:
+            lines = f.read().splitlines(True)
+
+        with self.assertRaises(formats.FormatError):
+            formats.read_gro_natoms(io.BytesIO(b''.join(lines[:-10])))
+
+    def test_garbage(self):
+
+        with self.assertRaises(formats.FormatError):
+            formats.read_gro_natoms(io.BytesIO(b'title\nnot a number\n'))
+
+
+class CptTests(SimpleTestCase):
+
+    def test_read_cpt_header(self):
+
+        header = formats.read_cpt_header(io.BytesIO(cpt_header(1234)))
+
+        self.assertEqual(header.natoms, 1234)
+        self.assertEqual(header.version, 'VERSION 2018.3')
+        self.assertEqual(header.file_version, 17)
+
+    def test_garbage(self):
+
+        with self.assertRaises(formats.FormatError):
+            formats.read_cpt_header(io.BytesIO(os.urandom(1000)))
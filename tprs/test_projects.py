@@ -1,3 +1,4 @@
+import gzip
 import tempfile
 import subprocess
 import os
@@ -10,7 +11,9 @@ from django.test import override_settings
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from .models import Project
+from . import util
+from .models import Project, TprInfo, TPR_CACHE
+from .pool import TprPool
 
 
 def check_tpr(data):
@@ -27,10 +30,16 @@ def check_tpr(data):
                        check=True)
 
 
-# doesn't create any files, so just operate out of the root for /testdata/
-@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR))
+# only creates cached tprs, so just operate out of the root for /testdata/
+@override_settings(
+    MEDIA_ROOT=os.path.join(settings.BASE_DIR),
+    GROMPPERY_CACHE_ROOT=os.path.join(settings.BASE_DIR, 'test-cache'))
 class ProjectModelTests(APITestCase):
 
+    def tearDown(self):
+        if os.path.isdir(settings.GROMPPERY_CACHE_ROOT):
+            shutil.rmtree(settings.GROMPPERY_CACHE_ROOT)
+
     def test_make_tpr(self):
 
         proj = Project.objects.create(
@@ -43,8 +52,101 @@ class ProjectModelTests(APITestCase):
         tpr = proj.grompp()
         check_tpr(tpr.read())
 
+    def test_tpr_cached(self):
+
+        proj = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        self.assertIsNone(TPR_CACHE.get(proj.tpr_key()))
+
+        tpr_data = proj.grompp().read()
+        self.assertEqual(TPR_CACHE.get(proj.tpr_key()), tpr_data)
+        self.assertEqual(proj.grompp().read(), tpr_data)
+
+    def test_tpr_key_follows_files(self):
+
+        proj = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+        other = Project.objects.create(
+            name='alanine',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        self.assertEqual(proj.tpr_key(), other.tpr_key())
+
+        other.mdp = 'testdata/plcg_sh2_wt.top'
+        self.assertNotEqual(proj.tpr_key(), other.tpr_key())
+
+    def test_tpr_info(self):
+
+        proj = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        info = proj.current_tpr_info()
+
+        self.assertEqual(info.tpr_key, proj.tpr_key())
+        self.assertEqual(info.natoms, proj.natoms())
+        self.assertEqual(info.nsteps, 2500)
+        self.assertAlmostEqual(info.dt, 0.004)
+        self.assertAlmostEqual(info.simulated_time, 10)
+        self.assertEqual(info.nstxout_compressed, 2500)
+        self.assertEqual(info.nstenergy, 2500)
+        self.assertEqual(info.group_names()[0], 'System')
+        self.assertIn(('Protein', info.groups[1][1]), info.groups)
+
+        # stored, so later lookups don't go back to gmx
+        proj = Project.objects.get(pk='plcg_sh2_wt')
+        groups, util.get_tpr_group_sizes = util.get_tpr_group_sizes, None
+        try:
+            self.assertEqual(proj.current_tpr_info().groups, info.groups)
+        finally:
+            util.get_tpr_group_sizes = groups
+
+        self.assertEqual(TprInfo.objects.count(), 1)
+
+    def test_tpr_pool(self):
+
+        proj = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        self.assertTrue(proj.generates_velocities())
+
+        pool = TprPool(proj, depth=2)
+        self.assertIsNone(pool.take())
 
-@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
+        self.assertEqual(pool.fill(), 2)
+        self.assertEqual(len(pool), 2)
+
+        tpr1 = pool.take()
+        tpr2 = pool.take()
+        check_tpr(tpr1)
+        check_tpr(tpr2)
+
+        # velocities are generated separately for each work unit
+        self.assertNotEqual(tpr1, tpr2)
+        self.assertEqual(len(pool), 0)
+
+
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'),
+                   TPR_POOL_DEPTH=0)
 class ProjectViewTests(APITestCase):
 
     def setUp(self):
@@ -55,6 +157,22 @@ class ProjectViewTests(APITestCase):
     def tearDown(self):
         shutil.rmtree(settings.MEDIA_ROOT)
 
+    def fixed_mdp(self):
+        """Write a copy of the test mdp that doesn't generate velocities,
+        returning its path.
+        """
+
+        fixed_mdp = os.path.join(settings.MEDIA_ROOT, 'testdata', 'fixed.mdp')
+        with open(fixed_mdp, 'w') as mdp:
+            with open('testdata/plcg_sh2_wt.mdp', 'r') as f:
+                for line in f.readlines():
+                    if 'gen_vel' in line.split():
+                        mdp.write('gen_vel = no\n')
+                    else:
+                        mdp.write(line)
+
+        return fixed_mdp
+
     def test_tpr_view(self):
 
         Project.objects.create(
@@ -70,6 +188,123 @@ class ProjectViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         check_tpr(response.content)
 
+    def test_tpr_view_from_pool(self):
+
+        proj = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        pool = TprPool(proj, depth=1)
+        pool.fill()
+
+        url = reverse('tpr-generate', kwargs={'protein': 'plcg_sh2_wt'})
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        check_tpr(response.content)
+        self.assertEqual(len(pool), 0)
+
+    def test_tpr_view_conditional(self):
+
+        proj = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp=self.fixed_mdp(),
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        url = reverse('tpr-generate', kwargs={'protein': 'plcg_sh2_wt'})
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"%s"' % proj.tpr_digest())
+        self.assertIn('Last-Modified', response)
+        check_tpr(response.content)
+
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"bogus"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_tpr_view_compressed(self):
+
+        proj = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp=self.fixed_mdp(),
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        url = reverse('tpr-generate', kwargs={'protein': 'plcg_sh2_wt'})
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=1, br')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['ETag'], '"%s-gzip"' % proj.tpr_digest())
+        check_tpr(gzip.decompress(response.content))
+
+        response = self.client.get(
+            url, HTTP_ACCEPT_ENCODING='gzip',
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # the uncompressed TPR's tag doesn't match the compressed one's
+        response = self.client.get(
+            url, HTTP_ACCEPT_ENCODING='gzip',
+            HTTP_IF_NONE_MATCH='"%s"' % proj.tpr_digest())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        check_tpr(response.content)
+
+    def test_manifest(self):
+
+        fixed = Project.objects.create(
+            name='fixed',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp=self.fixed_mdp(),
+            top='testdata/plcg_sh2_wt.top')
+        Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top')
+        Project.objects.create(
+            name='retired',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top',
+            active=False)
+
+        url = reverse('tpr-manifest')
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'fixed': fixed.tpr_digest(),
+                                           'plcg_sh2_wt': None})
+
+        # served from the cache, without touching the database
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # but rebuilt when a project changes
+        fixed.active = False
+        fixed.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'plcg_sh2_wt': None})
+
     def test_nonexistant_tpr_view(self):
 
         Project.objects.create(
@@ -110,5 +345,9 @@ class ProjectViewTests(APITestCase):
         response = self.client.get(reverse('project-list'))
         self.assertEqual(len(response.data['results']), 1)
 
+        tpr_info = response.data['results'][0]['tpr_info']
+        self.assertEqual(tpr_info['nsteps'], 2500)
+        self.assertEqual(tpr_info['groups'][0][0], 'System')
+
         tprdata = Project.objects.first().grompp()
         self.assertGreater(len(tprdata.read()), 100)
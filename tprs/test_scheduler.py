@@ -0,0 +1,155 @@
+import os
+import shutil
+import datetime
+import collections
+
+from django.urls import reverse
+from django.conf import settings
+from django.test import override_settings, SimpleTestCase
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from .models import Project, Submission, Lease
+from . import scheduler
+
+
+class DeficitTests(SimpleTestCase):
+
+    def test_deficits(self):
+
+        d = scheduler.deficits({'a': 10, 'b': 10}, {'a': 1, 'b': 3})
+        self.assertEqual(d, {'a': -5, 'b': 5})
+
+        # nothing done yet, so nobody is behind
+        d = scheduler.deficits({'a': 0, 'b': 0}, {'a': 1, 'b': 3})
+        self.assertEqual(d, {'a': 0, 'b': 0})
+
+
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
+class NextWorkTests(APITestCase):
+
+    def setUp(self):
+        shutil.copytree(
+            os.path.join(settings.BASE_DIR, 'testdata'),
+            os.path.join(settings.MEDIA_ROOT, 'testdata'))
+
+        try:
+            self.project = self.create_project('plcg_sh2_wt')
+        except:
+            self.tearDown()
+            raise
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT)
+
+    def create_project(self, name, **kwargs):
+        return Project.objects.create(
+            name=name,
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top',
+            **kwargs)
+
+    def next_work(self, hostname='debug01'):
+        return self.client.post(reverse('next-work'),
+                                {'hostname': hostname}, format='json')
+
+    def test_next_work(self):
+
+        response = self.next_work()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(response.data['project'], self.project.name)
+        self.assertTrue(response.data['tpr'].endswith(
+            reverse('tpr-generate', args=(self.project.name,))))
+        self.assertEqual(response.data['expected_time'],
+                         self.project.current_tpr_info().simulated_time)
+
+        lease = Lease.objects.get()
+        self.assertEqual(lease.hostname, 'debug01')
+        self.assertAlmostEqual(
+            (lease.expires - lease.created).total_seconds(),
+            settings.LEASE_DURATION, places=0)
+
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_next_work_needs_hostname(self):
+
+        response = self.client.post(reverse('next-work'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_weights(self):
+
+        self.create_project('heavy', weight=3)
+
+        projects = collections.Counter(
+            self.next_work().data['project'] for i in range(8))
+
+        self.assertEqual(projects, {self.project.name: 2, 'heavy': 6})
+
+    def test_deficit_from_submissions(self):
+
+        # a project that's had lots done already waits for the others
+        self.create_project('new')
+        for i in range(3):
+            Lease.objects.create(
+                project=self.project, hostname='debug01',
+                expires=timezone.now() + datetime.timedelta(hours=1),
+                expected_time=10)
+
+        projects = [self.next_work().data['project'] for i in range(3)]
+        self.assertEqual(projects, ['new', 'new', 'new'])
+
+    def test_target_time(self):
+
+        self.project.target_time = (
+            1.5 * self.project.current_tpr_info().simulated_time)
+        self.project.save()
+
+        # the second work unit in flight will take it past its target
+        self.assertEqual(self.next_work().status_code, 201)
+        self.assertEqual(self.next_work().status_code, 201)
+        self.assertEqual(self.next_work().status_code, 204)
+
+    def test_inactive(self):
+
+        self.project.active = False
+        self.project.save()
+
+        self.assertEqual(self.next_work().status_code, 204)
+
+    def test_expired_leases_reclaimed(self):
+
+        self.project.target_time = (
+            self.project.current_tpr_info().simulated_time)
+        self.project.save()
+
+        past = timezone.now() - datetime.timedelta(
+            seconds=2 * settings.LEASE_DURATION)
+        scheduler.next_work('debug01', now=past)
+
+        self.assertEqual(self.next_work('debug02').status_code, 201)
+        self.assertEqual(
+            list(Lease.objects.values_list('hostname', flat=True)),
+            ['debug02'])
+
+    def test_lease_fulfilled(self):
+
+        self.next_work()
+        self.next_work('debug02')
+
+        submission_dir = os.path.join(
+            settings.MEDIA_ROOT, 'testdata', 'submission')
+        sub = Submission.objects.create(
+            project=self.project, hostname='debug01',
+            tpr=os.path.join(settings.MEDIA_ROOT, 'testdata/plcg_sh2_wt.tpr'),
+            **{ftype: os.path.join(submission_dir, 'plcg_sh2_wt.' + ftype)
+               for ftype in ['xtc', 'log', 'edr', 'gro', 'cpt']})
+
+        self.assertEqual(sub.lease.hostname, 'debug01')
+        self.assertEqual(
+            list(Lease.outstanding().values_list('hostname', flat=True)),
+            ['debug02'])
@@ -1,18 +1,28 @@
 import io
 import os
+import hashlib
 import shutil
+from unittest import mock
 
 from django.urls import reverse
 from django.conf import settings
 from django.test import override_settings
+from django.core.management import call_command
+from django.utils import timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from .models import Project, Submission
+from .models import (
+    Project, Submission, Alignment, PendingSubmission, ProjectStatistics,
+    Upload, Blob)
+from . import formats
+from . import compression
 
 
-@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'),
+                   ASYNC_SUBMISSIONS=False)
 class SubmissionViewTests(APITestCase):
 
     def setUp(self):
@@ -81,6 +91,135 @@ class SubmissionViewTests(APITestCase):
         self.assertEqual(sub2.index(), 0)
         self.assertEqual(sub3.index(), 1)
 
+    def test_index_is_stored(self):
+
+        subdata = {
+            'hostname': 'debug01',
+            'xtc': self.filepath('plcg_sh2_wt.xtc'),
+            'log': self.filepath('plcg_sh2_wt.log'),
+            'edr': self.filepath('plcg_sh2_wt.edr'),
+            'gro': self.filepath('plcg_sh2_wt.gro'),
+            'cpt': self.filepath('plcg_sh2_wt.cpt'),
+            'tpr': os.path.join(settings.MEDIA_ROOT,
+                                'testdata/plcg_sh2_wt.tpr'),
+        }
+
+        for i in range(3):
+            Submission.objects.create(project=self.project, **subdata)
+
+        subs = list(Submission.objects.filter(project=self.project))
+        with self.assertNumQueries(0):
+            self.assertEqual([s.index() for s in subs], [0, 1, 2])
+
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.next_sequence, 3)
+
+        # saving a stale copy of the project doesn't reset the counter
+        stale = Project.objects.get(pk=self.project.pk)
+        Submission.objects.create(project=self.project, **subdata)
+        stale.save()
+
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.next_sequence, 4)
+
+        # renaming (the name is the primary key) saves it as a new row,
+        # as the admin does
+        stale.name = 'plcg_sh2_renamed'
+        stale.save()
+        self.assertEqual(
+            Project.objects.get(name='plcg_sh2_renamed').gro.name,
+            self.project.gro.name)
+        stale.save()
+
+    def test_statistics(self):
+
+        subdata = {
+            'hostname': 'debug01',
+            'xtc': self.filepath('plcg_sh2_wt.xtc'),
+            'log': self.filepath('plcg_sh2_wt.log'),
+            'edr': self.filepath('plcg_sh2_wt.edr'),
+            'gro': self.filepath('plcg_sh2_wt.gro'),
+            'cpt': self.filepath('plcg_sh2_wt.cpt'),
+            'tpr': os.path.join(settings.MEDIA_ROOT,
+                                'testdata/plcg_sh2_wt.tpr'),
+        }
+
+        with open(subdata['xtc'], 'rb') as f:
+            frames = formats.read_xtc_frames(f)
+
+        sub1 = Submission.objects.create(project=self.project, **subdata)
+        Submission.objects.create(project=self.project, **subdata)
+
+        stats = ProjectStatistics.objects.get(project=self.project)
+        self.assertEqual(stats.n_submissions, 2)
+        self.assertEqual(stats.n_aligned, 0)
+        self.assertEqual(stats.n_frames, 2 * len(frames))
+        self.assertAlmostEqual(
+            stats.simulated_time, 2 * (frames[-1].time - frames[0].time),
+            places=3)
+        self.assertEqual(stats.n_bytes, 2 * sub1.n_bytes)
+        self.assertEqual(self.project.n_submissions, 2)
+
+        response = self.client.get(reverse('projectstatistics-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['project'],
+                         self.project.name)
+        self.assertEqual(response.data['results'][0]['n_submissions'], 2)
+        self.assertEqual(response.data['results'][0]['n_unaligned'], 2)
+
+        sub1.delete()
+        stats.refresh_from_db()
+        self.assertEqual(stats.n_submissions, 1)
+        self.assertEqual(stats.n_frames, len(frames))
+
+        self.assertEqual(
+            ProjectStatistics.recompute(self.project).n_frames, len(frames))
+
+    def test_statistics_bulk_delete(self):
+
+        subdata = {
+            'hostname': 'debug01',
+            'xtc': self.filepath('plcg_sh2_wt.xtc'),
+            'log': self.filepath('plcg_sh2_wt.log'),
+            'edr': self.filepath('plcg_sh2_wt.edr'),
+            'gro': self.filepath('plcg_sh2_wt.gro'),
+            'cpt': self.filepath('plcg_sh2_wt.cpt'),
+            'tpr': os.path.join(settings.MEDIA_ROOT,
+                                'testdata/plcg_sh2_wt.tpr'),
+        }
+
+        subs = [Submission.objects.create(project=self.project, **subdata)
+                for i in range(3)]
+        for sub in subs[:2]:
+            Alignment.objects.create(
+                submission=sub, group='Protein', tpr_subset='Prot-Masses',
+                xtc='testdata/submission/plcg_sh2_wt.xtc')
+        stats = ProjectStatistics.recompute(self.project)
+        self.assertEqual(stats.n_aligned, 2)
+
+        def assert_current():
+            stats.refresh_from_db()
+            recomputed = ProjectStatistics.recompute(self.project)
+            for field in ['n_submissions', 'n_aligned', 'n_frames',
+                          'n_bytes']:
+                self.assertEqual(getattr(stats, field),
+                                 getattr(recomputed, field), field)
+
+        # as from the admin's bulk delete
+        Alignment.objects.filter(submission=subs[0]).delete()
+        assert_current()
+        self.assertEqual(stats.n_aligned, 1)
+
+        # cascades to the remaining alignment
+        Submission.objects.filter(pk__in=[subs[1].pk, subs[2].pk]).delete()
+        assert_current()
+        self.assertEqual(stats.n_submissions, 1)
+        self.assertEqual(stats.n_aligned, 0)
+
+        # the project's statistics go with it
+        self.project.delete()
+        self.assertFalse(ProjectStatistics.objects.exists())
+
     def test_submit_project(self):
 
         url = reverse('project-submit', args=('plcg_sh2_wt',))
@@ -113,6 +252,149 @@ class SubmissionViewTests(APITestCase):
         submission = Submission.objects.last()
         self.assertEqual(submission.index(), 1)
 
+    def test_submissions_deduplicated(self):
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        self.client.post(url, self.good_data, format='multipart')
+
+        for f in self.good_data.values():
+            if hasattr(f, 'seek'):
+                f.seek(0)
+        self.client.post(url, self.good_data, format='multipart')
+
+        sub1, sub2 = Submission.objects.all()
+        for ftype in ['xtc', 'log', 'edr', 'gro', 'cpt', 'tpr']:
+            self.assertEqual(getattr(sub1, ftype).name,
+                             getattr(sub2, ftype).name)
+            self.assertTrue(getattr(sub1, ftype).name.endswith('.' + ftype))
+
+        self.assertEqual(Blob.objects.count(), 6)
+        self.assertEqual(set(Blob.objects.values_list('refcount', flat=True)),
+                         {2})
+
+        tpr = Blob.objects.get(name=sub1.tpr.name)
+        self.good_data['tpr'].seek(0)
+        self.assertEqual(
+            tpr.sha256,
+            hashlib.sha256(self.good_data['tpr'].read()).hexdigest())
+        self.assertEqual(sub1.tpr.size, tpr.size)
+
+        # the xtc is indexed as it's stored
+        index_path = formats.xtc_index_path(sub1.xtc.path)
+        self.assertTrue(os.path.isfile(index_path))
+        self.assertEqual(len(sub1.xtc_index()), sub1.n_frames)
+
+        # files stay until the last submission using them goes
+        sub1.delete()
+        self.assertEqual(Blob.objects.get(name=sub2.tpr.name).refcount, 1)
+        self.assertTrue(os.path.isfile(sub2.tpr.path))
+        self.assertTrue(os.path.isfile(index_path))
+
+        sub2.delete()
+        self.assertEqual(Blob.objects.count(), 0)
+        self.assertFalse(os.path.isfile(sub2.tpr.path))
+        self.assertFalse(os.path.isfile(index_path))
+
+    def test_blobs_released(self):
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        for i in range(2):
+            for f in self.good_data.values():
+                if hasattr(f, 'seek'):
+                    f.seek(0)
+            self.client.post(url, self.good_data, format='multipart')
+
+        sub1, sub2 = Submission.objects.all()
+        old_log = sub1.log.name
+
+        # replacing a file releases the one it replaces
+        sub1.log = SimpleUploadedFile('plcg_sh2_wt.log', b'another log')
+        sub1.save()
+        self.assertEqual(Blob.objects.get(name=old_log).refcount, 1)
+        self.assertEqual(Blob.objects.get(name=sub1.log.name).refcount, 1)
+
+        # saving without touching the files leaves them be
+        sub1.hostname = 'debug02'
+        sub1.save()
+        self.assertEqual(Blob.objects.get(name=sub1.tpr.name).refcount, 2)
+
+        # as does deleting through a queryset, bypassing Submission.delete
+        Submission.objects.filter(pk__in=[sub1.pk, sub2.pk]).delete()
+        self.assertEqual(Blob.objects.count(), 0)
+        self.assertFalse(os.path.isfile(sub1.log.path))
+        self.assertFalse(os.path.isfile(sub2.tpr.path))
+
+    def test_dedupsubmissions(self):
+
+        names = {}
+        for ftype in ['xtc', 'log', 'edr', 'gro', 'cpt']:
+            names[ftype] = 'testdata/submission/plcg_sh2_wt.' + ftype
+        names['tpr'] = 'testdata/plcg_sh2_wt.tpr'
+
+        sub = Submission.objects.create(
+            project=self.project, hostname='debug01', **names)
+        with open(sub.xtc.path, 'rb') as f:
+            xtc = f.read()
+
+        call_command('dedupsubmissions', stdout=io.StringIO())
+
+        sub.refresh_from_db()
+        self.assertTrue(sub.xtc.name.startswith('blobs/'))
+        self.assertEqual(sub.xtc.read(), xtc)
+        self.assertFalse(os.path.exists(
+            os.path.join(settings.MEDIA_ROOT, names['xtc'])))
+        self.assertEqual(Blob.objects.count(), 6)
+
+        call_command('indexframes', stdout=io.StringIO())
+        self.assertEqual(len(sub.xtc_index()), sub.n_frames)
+
+    def test_submit_compressed(self):
+
+        log = self.good_data['log'].read()
+        gro = self.good_data['gro'].read()
+
+        self.good_data['log'] = SimpleUploadedFile(
+            'plcg_sh2_wt.log.gz', compression.compress(log, 'gzip'))
+        self.good_data['gro'] = SimpleUploadedFile(
+            'plcg_sh2_wt.gro.gz', compression.compress(gro, 'gzip'))
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        response = self.client.post(url, self.good_data, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('gzip', response['Accept-Encoding'])
+
+        # stored as they were before compression
+        submission = Submission.objects.get()
+        self.assertEqual(submission.log.read(), log)
+        self.assertEqual(submission.gro.read(), gro)
+        self.assertFalse(submission.gro.name.endswith('.gz'))
+
+    def test_submit_bogus_compressed(self):
+
+        self.good_data['log'] = SimpleUploadedFile(
+            'plcg_sh2_wt.log.gz', b'not really gzipped')
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        response = self.client.post(url, self.good_data, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Submission.objects.count(), 0)
+
+    @override_settings(MAX_DECOMPRESSED_UPLOAD=1024 * 1024)
+    def test_submit_compression_bomb(self):
+
+        self.good_data['log'] = SimpleUploadedFile(
+            'plcg_sh2_wt.log.gz',
+            compression.compress(b'\0' * (10 * 1024 * 1024), 'gzip'))
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        response = self.client.post(url, self.good_data, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('allowed', str(response.data['log']))
+        self.assertEqual(Submission.objects.count(), 0)
+
     def test_submit_bogus_tpr(self):
 
         self.good_data['tpr'] = io.BytesIO(
@@ -153,6 +435,32 @@ class SubmissionViewTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_submit_mismatched_gro(self):
+
+        # a well-formed gro file, but for a much smaller system
+        lines = self.good_data['gro'].read().splitlines(True)
+        self.good_data['gro'] = io.BytesIO(
+            lines[0] + b'3\n' + b''.join(lines[2:5]) + lines[-1])
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        response = self.client.post(url, self.good_data, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Submission.objects.count(), 0)
+
+    @override_settings(GMX_CHECK_UPLOADS=True)
+    def test_submit_gmx_checked(self):
+
+        # what gmx accepts goes, even if our own parsers can't read it
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        with mock.patch.object(formats, 'read_gro_natoms',
+                               side_effect=formats.FormatError('unreadable')):
+            response = self.client.post(url, self.good_data,
+                                        format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Submission.objects.count(), 1)
+
     # This test is disabled at present because I cannot figure out a
     # good way to check this.
 
@@ -165,3 +473,323 @@ class SubmissionViewTests(APITestCase):
     #     response = self.client.post(url, self.good_data, format='multipart')
 
     #     self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'),
+                   ASYNC_SUBMISSIONS=True)
+class AsyncSubmissionViewTests(APITestCase):
+
+    def setUp(self):
+        shutil.copytree(
+            os.path.join(settings.BASE_DIR, 'testdata'),
+            os.path.join(settings.MEDIA_ROOT, 'testdata'))
+
+        try:
+            self.project = Project.objects.create(
+                name='plcg_sh2_wt',
+                gro='testdata/plcg_sh2_wt.gro',
+                mdp='testdata/plcg_sh2_wt.mdp',
+                top='testdata/plcg_sh2_wt.top'
+            )
+
+            self.good_data = {
+                'hostname': 'debug01',
+                'xtc': open(self.filepath('plcg_sh2_wt.xtc'), 'rb'),
+                'log': open(self.filepath('plcg_sh2_wt.log'), 'rb'),
+                'edr': open(self.filepath('plcg_sh2_wt.edr'), 'rb'),
+                'gro': open(self.filepath('plcg_sh2_wt.gro'), 'rb'),
+                'cpt': open(self.filepath('plcg_sh2_wt.cpt'), 'rb'),
+                'tpr': open(os.path.join(settings.MEDIA_ROOT,
+                                         'testdata/plcg_sh2_wt.tpr'), 'rb'),
+            }
+        except:
+            self.tearDown()
+            raise
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT)
+
+    def filepath(self, fname):
+        return os.path.join(settings.MEDIA_ROOT,
+                            'testdata/submission/', fname)
+
+    def test_submit_project(self):
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        response = self.client.post(url, self.good_data, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Submission.objects.count(), 0)
+        self.assertEqual(PendingSubmission.objects.count(), 1)
+        self.assertEqual(response.data['status'], PendingSubmission.PENDING)
+        self.assertEqual(response['Location'], response.data['url'])
+
+        call_command('validatesubmissions', stdout=io.StringIO())
+
+        self.assertEqual(Submission.objects.count(), 1)
+        pending = PendingSubmission.objects.get()
+        self.assertEqual(pending.status, PendingSubmission.ACCEPTED)
+        self.assertEqual(pending.submission, Submission.objects.get())
+        self.assertFalse(pending.xtc)
+
+        response = self.client.get(response.data['url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], PendingSubmission.ACCEPTED)
+        self.assertEqual(response.data['submission'], pending.submission.pk)
+
+    def test_submit_bogus_xtc(self):
+
+        self.good_data['xtc'] = io.BytesIO(
+            open("/dev/urandom", "rb").read(1000))
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        response = self.client.post(url, self.good_data, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        call_command('validatesubmissions', stdout=io.StringIO())
+
+        self.assertEqual(Submission.objects.count(), 0)
+        pending = PendingSubmission.objects.get()
+        self.assertEqual(pending.status, PendingSubmission.REJECTED)
+        self.assertIn('xtc', pending.detail)
+
+    def test_validation_error_retried(self):
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        self.client.post(url, self.good_data, format='multipart')
+
+        # an error (not a verdict) doesn't stop the validator
+        with mock.patch.object(PendingSubmission, 'process',
+                               side_effect=OSError('gmx went missing')):
+            call_command('validatesubmissions', stdout=io.StringIO(),
+                         stderr=io.StringIO())
+
+        pending = PendingSubmission.objects.get()
+        self.assertEqual(pending.status, PendingSubmission.PENDING)
+        self.assertEqual(pending.attempts, 1)
+        self.assertIn('gmx went missing', pending.detail)
+        self.assertGreater(pending.not_before, timezone.now())
+
+        # it isn't retried straight away
+        self.assertEqual(list(PendingSubmission.ready()), [])
+        with mock.patch.object(PendingSubmission, 'process') as process:
+            call_command('validatesubmissions', stdout=io.StringIO())
+        process.assert_not_called()
+
+        # and backs off further each time
+        first = pending.not_before
+        pending.retry_later('again')
+        self.assertEqual(pending.attempts, 2)
+        self.assertGreater(pending.not_before, first)
+
+        PendingSubmission.objects.update(not_before=timezone.now())
+        call_command('validatesubmissions', stdout=io.StringIO())
+        self.assertEqual(PendingSubmission.objects.get().status,
+                         PendingSubmission.ACCEPTED)
+
+    def test_promotion_rolled_back(self):
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        self.client.post(url, self.good_data, format='multipart')
+
+        # the submission is stored, but recording that fails
+        with mock.patch.object(PendingSubmission, 'save', autospec=True,
+                               side_effect=OSError('disk full')):
+            call_command('validatesubmissions', stdout=io.StringIO(),
+                         stderr=io.StringIO())
+        self.assertEqual(Submission.objects.count(), 0)
+        self.assertFalse(ProjectStatistics.objects.filter(
+            n_submissions__gt=0).exists())
+
+        # so the retry doesn't ingest it twice
+        pending = PendingSubmission.objects.get()
+        self.assertEqual(pending.status, PendingSubmission.PENDING)
+        self.assertTrue(os.path.isfile(pending.xtc.path))
+
+        PendingSubmission.objects.update(not_before=timezone.now())
+        call_command('validatesubmissions', stdout=io.StringIO())
+
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, PendingSubmission.ACCEPTED)
+        self.assertEqual(Submission.objects.get(), pending.submission)
+        self.assertEqual(
+            ProjectStatistics.objects.get(project=self.project).n_submissions,
+            1)
+
+    def test_submit_missing_file(self):
+
+        del self.good_data['cpt']
+
+        url = reverse('project-submit', args=('plcg_sh2_wt',))
+        response = self.client.post(url, self.good_data, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(PendingSubmission.objects.count(), 0)
+
+
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'),
+                   ASYNC_SUBMISSIONS=True)
+class ChunkedUploadTests(APITestCase):
+
+    def setUp(self):
+        shutil.copytree(
+            os.path.join(settings.BASE_DIR, 'testdata'),
+            os.path.join(settings.MEDIA_ROOT, 'testdata'))
+
+        self.project = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+        )
+
+        self.contents = {}
+        for ftype in ['xtc', 'log', 'edr', 'gro', 'cpt']:
+            with open(os.path.join(settings.MEDIA_ROOT, 'testdata/submission',
+                                   'plcg_sh2_wt.' + ftype), 'rb') as f:
+                self.contents[ftype] = f.read()
+        with open(os.path.join(settings.MEDIA_ROOT,
+                               'testdata/plcg_sh2_wt.tpr'), 'rb') as f:
+            self.contents['tpr'] = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT)
+
+    def create_upload(self):
+
+        files = [{'kind': ftype, 'size': len(data),
+                  'sha256': hashlib.sha256(data).hexdigest()}
+                 for ftype, data in self.contents.items()]
+
+        response = self.client.post(
+            reverse('upload-list'),
+            {'project': self.project.pk, 'hostname': 'debug01',
+             'files': files},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        return response.data
+
+    def put_chunk(self, upload, ftype, start, end):
+
+        data = self.contents[ftype]
+        return self.client.put(
+            upload['url'] + 'files/%s/' % ftype, data[start:end],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes %s-%s/%s' % (start, end - 1, len(data)))
+
+    def test_chunked_upload(self):
+
+        upload = self.create_upload()
+        xtc_size = len(self.contents['xtc'])
+
+        # chunks can arrive in any order
+        half = xtc_size // 2
+        response = self.put_chunk(upload, 'xtc', half, xtc_size)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['missing'], [[0, half]])
+
+        response = self.client.get(upload['url'])
+        files = {f['kind']: f for f in response.data['files']}
+        self.assertEqual(files['xtc']['received'], [[half, xtc_size]])
+
+        # can't finalize until everything is here
+        response = self.client.post(upload['url'] + 'finalize/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.put_chunk(upload, 'xtc', 0, half)
+        for ftype in ['log', 'edr', 'gro', 'cpt', 'tpr']:
+            self.put_chunk(upload, ftype, 0, len(self.contents[ftype]))
+
+        response = self.client.post(upload['url'] + 'finalize/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        call_command('validatesubmissions', stdout=io.StringIO())
+
+        sub = Submission.objects.get()
+        self.assertEqual(sub.hostname, 'debug01')
+        for ftype, data in self.contents.items():
+            self.assertEqual(getattr(sub, ftype).read(), data)
+
+        self.assertFalse(os.path.exists(Upload.objects.get().root))
+
+    @override_settings(ASYNC_SUBMISSIONS=False)
+    def test_finalize_error_queued(self):
+
+        upload = self.create_upload()
+        for ftype, data in self.contents.items():
+            self.put_chunk(upload, ftype, 0, len(data))
+
+        with mock.patch.object(PendingSubmission, 'process',
+                               side_effect=OSError('gmx went missing')):
+            response = self.client.post(upload['url'] + 'finalize/')
+
+        # the upload isn't lost, just left for validatesubmissions
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        pending = PendingSubmission.objects.get()
+        self.assertEqual(pending.status, PendingSubmission.PENDING)
+        self.assertEqual(pending.attempts, 1)
+
+        response = self.client.post(upload['url'] + 'finalize/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        PendingSubmission.objects.update(not_before=timezone.now())
+        call_command('validatesubmissions', stdout=io.StringIO())
+        self.assertEqual(Submission.objects.get().hostname, 'debug01')
+
+    def test_corrupt_chunk(self):
+
+        upload = self.create_upload()
+
+        for ftype, data in self.contents.items():
+            self.put_chunk(upload, ftype, 0, len(data))
+
+        # overwrite the start of the xtc with garbage
+        self.client.put(
+            upload['url'] + 'files/xtc/', b'\x00' * 10,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes 0-9/%s' % len(self.contents['xtc']))
+
+        response = self.client.post(upload['url'] + 'finalize/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('sha256', response.data['detail'])
+
+    def test_bad_range(self):
+
+        upload = self.create_upload()
+        size = len(self.contents['gro'])
+
+        response = self.client.put(
+            upload['url'] + 'files/gro/', b'x' * 10,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes %s-%s/%s' % (size, size + 9, size))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.put(
+            upload['url'] + 'files/gro/', b'x' * 10,
+            content_type='application/octet-stream')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_known_tpr_not_sent(self):
+
+        self.contents['tpr'] = self.project.grompp().read()
+        upload = self.create_upload()
+
+        files = {f['kind']: f for f in upload['files']}
+        self.assertEqual(files['tpr']['missing'], [])
+        self.assertEqual(files['xtc']['missing'],
+                         [[0, len(self.contents['xtc'])]])
+
+    def test_stored_file_not_sent(self):
+
+        upload = self.create_upload()
+        for ftype, data in self.contents.items():
+            self.put_chunk(upload, ftype, 0, len(data))
+        self.client.post(upload['url'] + 'finalize/')
+        call_command('validatesubmissions', stdout=io.StringIO())
+
+        # everything in a second, identical upload is already stored
+        upload = self.create_upload()
+        for f in upload['files']:
+            self.assertEqual(f['missing'], [], f['kind'])
@@ -0,0 +1,176 @@
+import io
+import os
+import time
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management import call_command
+from django.test import (override_settings, SimpleTestCase,
+                         TransactionTestCase)
+
+from .models import (Project, Submission, Alignment, Blob, RetentionRule,
+                     ArchivedFile, ProjectStatistics)
+from . import tiering
+
+
+class ThrottleTests(SimpleTestCase):
+
+    def test_throttle(self):
+
+        throttle = tiering.Throttle(bytes_per_second=1000)
+
+        start = time.monotonic()
+        for i in range(3):
+            throttle.consume(100)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+        # no limit, no waiting
+        start = time.monotonic()
+        tiering.Throttle().consume(10 ** 12)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+
+# archived copies are removed once deletions commit, which TestCase's
+# transactions never do
+@override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, 'test-media'))
+class TieringTests(TransactionTestCase):
+
+    def setUp(self):
+        shutil.copytree(
+            os.path.join(settings.BASE_DIR, 'testdata'),
+            os.path.join(settings.MEDIA_ROOT, 'testdata'))
+
+        self.project = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top')
+
+        self.contents = {}
+        self.sub = Submission(project=self.project, hostname='debug01')
+        for ftype in ['xtc', 'log', 'edr', 'gro', 'cpt', 'tpr']:
+            path = os.path.join(settings.MEDIA_ROOT, 'testdata', 'submission',
+                                'plcg_sh2_wt.' + ftype)
+            if ftype == 'tpr':
+                path = os.path.join(settings.MEDIA_ROOT, 'testdata',
+                                    'plcg_sh2_wt.tpr')
+            with open(path, 'rb') as f:
+                self.contents[ftype] = f.read()
+            setattr(self.sub, ftype, File(io.BytesIO(self.contents[ftype]),
+                                          name='plcg_sh2_wt.' + ftype))
+        self.sub.save()
+
+        Alignment.objects.create(submission=self.sub, group='Protein',
+                                 tpr_subset='Prot-Masses')
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT)
+
+    def test_compress_and_restore(self):
+
+        RetentionRule.objects.create(project=self.project, kind='cpt',
+                                     action=RetentionRule.COMPRESS)
+        blob_path = self.sub.cpt.path
+        n_bytes = self.sub.n_bytes
+
+        call_command('tier', stdout=io.StringIO())
+
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.cpt.name, '')
+        self.assertEqual(self.sub.n_bytes,
+                         n_bytes - len(self.contents['cpt']))
+        self.assertEqual(ProjectStatistics.objects.get().n_bytes,
+                         self.sub.n_bytes)
+        self.assertFalse(os.path.exists(blob_path))
+        self.assertEqual(Blob.objects.count(), 5)
+
+        archived = ArchivedFile.objects.get()
+        self.assertEqual(archived.kind, 'cpt')
+        self.assertEqual(archived.size, len(self.contents['cpt']))
+        self.assertTrue(archived.path.startswith(
+            os.path.join(settings.MEDIA_ROOT, 'archive')))
+        self.assertTrue(os.path.isfile(archived.path))
+
+        # nothing left to do
+        call_command('tier', stdout=io.StringIO())
+        self.assertEqual(ArchivedFile.objects.count(), 1)
+
+        call_command('tier', '--restore', str(self.sub.pk),
+                     stdout=io.StringIO())
+
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.cpt.read(), self.contents['cpt'])
+        self.assertEqual(self.sub.n_bytes, n_bytes)
+        self.assertEqual(ProjectStatistics.objects.get().n_bytes, n_bytes)
+        self.assertEqual(ArchivedFile.objects.count(), 0)
+        self.assertFalse(os.path.exists(archived.path))
+
+    def test_cold_and_prune(self):
+
+        RetentionRule.objects.create(project=self.project, kind='xtc',
+                                     action=RetentionRule.COLD)
+        RetentionRule.objects.create(project=self.project, kind='edr',
+                                     action=RetentionRule.PRUNE)
+
+        cold = tempfile.mkdtemp()
+        try:
+            with override_settings(COLD_STORAGE_ROOT=cold):
+                call_command('tier', '--bandwidth', '100',
+                             stdout=io.StringIO())
+
+            xtc = ArchivedFile.objects.get(kind='xtc')
+            self.assertTrue(xtc.path.startswith(cold))
+            with open(xtc.path, 'rb') as f:
+                self.assertEqual(f.read(), self.contents['xtc'])
+
+            edr = ArchivedFile.objects.get(kind='edr')
+            self.assertEqual(edr.path, '')
+            with self.assertRaises(ValueError):
+                tiering.restore(edr)
+
+            self.sub.refresh_from_db()
+            self.assertEqual(self.sub.xtc.name, '')
+            self.assertEqual(self.sub.edr.name, '')
+
+            # deleting the submission takes its archived copies with it
+            self.sub.delete()
+            self.assertFalse(os.path.exists(xtc.path))
+        finally:
+            shutil.rmtree(cold)
+
+    def test_archived_copy_already_gone(self):
+
+        RetentionRule.objects.create(project=self.project, kind='cpt',
+                                     action=RetentionRule.COMPRESS)
+        call_command('tier', stdout=io.StringIO())
+
+        archived = ArchivedFile.objects.get()
+        os.remove(archived.path)
+
+        self.sub.delete()
+        self.assertEqual(ArchivedFile.objects.count(), 0)
+
+    def test_not_due(self):
+
+        RetentionRule.objects.create(project=self.project, kind='cpt',
+                                     action=RetentionRule.PRUNE,
+                                     after_hours=1)
+
+        unaligned = Submission.objects.create(
+            project=self.project, hostname='debug01',
+            cpt='testdata/submission/plcg_sh2_wt.cpt')
+        RetentionRule.objects.filter(project=self.project).update(
+            after_hours=0)
+        self.assertEqual(
+            [(sub, kind) for sub, kind, action in tiering.due()],
+            [(self.sub, 'cpt')])
+
+        RetentionRule.objects.filter(project=self.project).update(
+            after_hours=1)
+        self.assertEqual(list(tiering.due()), [])
+
+        unaligned.refresh_from_db()
+        self.assertEqual(unaligned.cpt.name,
+                         'testdata/submission/plcg_sh2_wt.cpt')
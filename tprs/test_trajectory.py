@@ -0,0 +1,87 @@
+import numpy as np
+
+from django.test import SimpleTestCase
+
+from . import trajectory
+
+
+def random_rotation(random):
+
+    q, r = np.linalg.qr(random.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] *= -1
+
+    return q
+
+
+class NojumpTests(SimpleTestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+
+        # a triclinic box, with atoms diffusing through it
+        self.box = np.array([[2.5, 0, 0], [0.8, 2.4, 0], [-0.8, 1.2, 2.1]])
+        steps = random.normal(scale=0.3, size=(50, 10, 3))
+        self.true_xyz = np.cumsum(steps, axis=0) + 1
+
+        frac = np.matmul(self.true_xyz, np.linalg.inv(self.box))
+        self.wrapped = np.matmul(frac % 1, self.box)
+        self.boxes = np.repeat(self.box[None], len(self.wrapped), axis=0)
+
+    def test_unwrap_nojump(self):
+
+        self.assertGreater(
+            np.abs(self.wrapped - self.true_xyz).max(), 1)
+
+        xyz, _ = trajectory.unwrap_nojump(self.wrapped.copy(), self.boxes)
+
+        # the first frame is taken as it is
+        np.testing.assert_allclose(
+            xyz - (self.true_xyz - self.true_xyz[0] + self.wrapped[0]), 0,
+            atol=1e-9)
+
+    def test_unwrap_in_batches(self):
+
+        whole, _ = trajectory.unwrap_nojump(
+            self.wrapped.copy(), self.boxes)
+
+        prev = None
+        batches = []
+        for i in range(0, len(self.wrapped), 7):
+            xyz, prev = trajectory.unwrap_nojump(
+                self.wrapped[i:i+7].copy(), self.boxes[i:i+7], prev)
+            batches.append(xyz)
+
+        np.testing.assert_allclose(np.concatenate(batches), whole)
+
+
+class SuperposeTests(SimpleTestCase):
+
+    def test_superpose(self):
+
+        random = np.random.RandomState(0)
+        reference = random.normal(size=(20, 3))
+
+        xyz = np.array([
+            np.matmul(reference, random_rotation(random)) +
+            random.normal(size=3)
+            for i in range(5)])
+
+        trajectory.superpose(xyz, reference)
+
+        np.testing.assert_allclose(
+            xyz, np.repeat(reference[None], 5, axis=0), atol=1e-9)
+
+    def test_no_reflection(self):
+
+        reference = np.random.RandomState(1).normal(size=(20, 3))
+        mirrored = reference * [-1, 1, 1]
+
+        xyz = trajectory.superpose(mirrored[None].copy(), reference)
+
+        def handedness(x):
+            return np.sign(np.linalg.det(x[1:4] - x[0]))
+
+        self.assertEqual(handedness(xyz[0]), handedness(mirrored))
+        self.assertGreater(np.abs(xyz[0] - reference).max(), 0.1)
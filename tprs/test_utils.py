@@ -56,3 +56,39 @@ class UtilTests(TestCase):
             ('System', 'Protein', 'Protein-H', 'C-alpha', 'Backbone',
              'MainChain', 'SideChain', 'SideChain-H'),
             groups)
+
+    def test_parse_mdp(self):
+
+        mdp = util.parse_mdp(
+            os.path.join(settings.MEDIA_ROOT, 'testdata/plcg_sh2_wt.mdp'))
+
+        self.assertEqual(mdp['nsteps'], '2500')
+        self.assertEqual(mdp['comm_mode'], 'linear')
+        self.assertEqual(mdp['gen_vel'], 'yes')
+        self.assertNotIn('gen_seed', mdp)
+
+    def test_align_to_file(self):
+
+        proj = Project.objects.create(
+            name='plcg_sh2_wt',
+            gro='testdata/plcg_sh2_wt.gro',
+            mdp='testdata/plcg_sh2_wt.mdp',
+            top='testdata/plcg_sh2_wt.top'
+            )
+
+        xtc = os.path.join(settings.MEDIA_ROOT,
+                           'testdata/submission/plcg_sh2_wt.xtc')
+        output = os.path.join(settings.MEDIA_ROOT, 'aligned.xtc')
+
+        path = util.align(xtc, proj.subset_tpr('Prot-Masses'), 'Protein',
+                          output=output)
+
+        self.assertEqual(path, output)
+        self.assertGreater(os.path.getsize(output), 0)
+
+        # by default, gets a temporary file that's ours to remove
+        path = util.align(xtc, proj.subset_tpr('Prot-Masses'), 'Protein')
+        try:
+            self.assertGreater(os.path.getsize(path), 0)
+        finally:
+            os.remove(path)
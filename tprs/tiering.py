@@ -0,0 +1,227 @@
+"""Moving aligned submissions' files off the primary volume.
+
+Once a submission is aligned, its full-system xtc, cpt and edr are
+rarely read again. Each project's RetentionRules say which kinds of
+file to compress (into MEDIA_ROOT/archive), move to cold storage
+(settings.COLD_STORAGE_ROOT) or prune, and how long after alignment.
+Every file dealt with gets an ArchivedFile, which serves as the
+manifest for restoring it.
+
+Archived copies are named for their contents' sha256, like blobs (see
+tprs.storage), so identical files are archived once.
+"""
+
+import os
+import time
+import shutil
+import datetime
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files import File
+from django.db import models as db_models, transaction
+from django.utils import timezone
+
+from .models import (Submission, Blob, RetentionRule, ArchivedFile,
+                     ProjectStatistics, SUBMISSION_STORAGE)
+from . import cache
+from . import compression
+
+# bytes read or written at a time
+CHUNK_SIZE = 1024 * 1024
+
+
+class Throttle(object):
+    """Limits the rate at which bytes are moved, across all the threads
+    that share it.
+
+    Parameters
+    ----------
+    bytes_per_second : float, optional
+        The limit. None (the default) means no limit.
+    """
+
+    def __init__(self, bytes_per_second=None):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, n_bytes):
+        """Wait until n_bytes more can be moved without going over the
+        limit.
+        """
+
+        if not self.bytes_per_second:
+            return
+
+        # each caller books the next slot, and then waits for it
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + n_bytes / self.bytes_per_second
+
+        if start > now:
+            time.sleep(start - now)
+
+
+class ThrottledReader(object):
+    """A read-only file wrapper that goes through a Throttle.
+    """
+
+    def __init__(self, f, throttle):
+        self.f = f
+        self.throttle = throttle
+
+    def read(self, size=CHUNK_SIZE):
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+
+        data = self.f.read(size)
+        self.throttle.consume(len(data))
+
+        return data
+
+
+def archive_root(action):
+    """The directory archived copies are kept in for an action.
+    """
+
+    if action == RetentionRule.COMPRESS:
+        return os.path.join(settings.MEDIA_ROOT, 'archive')
+
+    if not settings.COLD_STORAGE_ROOT:
+        raise ValueError("COLD_STORAGE_ROOT must be set to move files to "
+                         "cold storage.")
+
+    return settings.COLD_STORAGE_ROOT
+
+
+def due(project=None, now=None):
+    """Find the files that retention rules say should be dealt with now.
+
+    Yields
+    ------
+    submission, kind, action
+        The submission, the kind of its file, and the action from the
+        rule that applies to it.
+    """
+
+    now = now or timezone.now()
+
+    rules = RetentionRule.objects.select_related('project')
+    if project is not None:
+        rules = rules.filter(project__name=project)
+
+    for rule in rules:
+        cutoff = now - datetime.timedelta(hours=rule.after_hours)
+        subs = Submission.objects.filter(
+            project=rule.project,
+            alignment__created__lte=cutoff).exclude(**{rule.kind: ''})
+
+        for sub in subs.iterator():
+            yield sub, rule.kind, rule.action
+
+
+def archive(submission, kind, action, throttle=None):
+    """Compress, move or prune one of a submission's files, recording it
+    in an ArchivedFile. The submission's field for the file is cleared.
+
+    Returns
+    -------
+    archived : ArchivedFile
+    """
+
+    throttle = throttle or Throttle()
+    name = getattr(submission, kind).name
+    path = SUBMISSION_STORAGE.path(name)
+
+    blob = Blob.objects.filter(name=name).first()
+    archived = ArchivedFile(
+        submission=submission, kind=kind, action=action,
+        sha256=blob.sha256 if blob else cache.file_digest(path),
+        size=os.path.getsize(path))
+
+    if action != RetentionRule.PRUNE:
+        if action == RetentionRule.COMPRESS:
+            archived.encoding = compression.available()[0]
+
+        archived.path = os.path.join(
+            archive_root(action), archived.sha256[:2],
+            '%s.%s%s' % (archived.sha256, kind,
+                         compression.SUFFIXES.get(archived.encoding, '')))
+
+        # identical files are only archived once
+        if not os.path.isfile(archived.path):
+            os.makedirs(os.path.dirname(archived.path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(archived.path), suffix='.part')
+            try:
+                with open(path, 'rb') as fin, os.fdopen(fd, 'wb') as fout:
+                    reader = ThrottledReader(fin, throttle)
+                    if archived.encoding:
+                        compression.compress_to(
+                            reader, archived.encoding, fout)
+                    else:
+                        shutil.copyfileobj(reader, fout, CHUNK_SIZE)
+                os.replace(tmp, archived.path)
+            finally:
+                if os.path.isfile(tmp):
+                    os.remove(tmp)
+
+    # the file no longer counts towards what the submission stores
+    with transaction.atomic():
+        archived.save()
+        Submission.objects.filter(pk=submission.pk).update(**{
+            kind: '', 'n_bytes': db_models.F('n_bytes') - archived.size})
+        ProjectStatistics.add(submission.project, n_bytes=-archived.size)
+        SUBMISSION_STORAGE.delete(name)
+
+    return archived
+
+
+def restore(archived, throttle=None):
+    """Put an archived file back in its submission, and forget the
+    archived copy.
+
+    Raises
+    ------
+    ValueError
+        If the file was pruned, or the archived copy doesn't match the
+        original.
+    """
+
+    if not archived.path:
+        raise ValueError("%s was pruned, so can't be restored." % archived)
+
+    throttle = throttle or Throttle()
+    submission = archived.submission
+
+    with open(archived.path, 'rb') as fin, tempfile.TemporaryFile() as tmp:
+        reader = ThrottledReader(fin, throttle)
+        if archived.encoding:
+            compression.decompress_to(reader, archived.encoding, tmp)
+        else:
+            shutil.copyfileobj(reader, tmp, CHUNK_SIZE)
+
+        tmp.seek(0)
+        name = SUBMISSION_STORAGE.save(
+            '%s.%s' % (submission.project.name, archived.kind),
+            File(tmp, name='%s.%s' % (submission.project.name,
+                                      archived.kind)))
+
+    # blobs are named for their sha256
+    if not os.path.basename(name).startswith(archived.sha256):
+        SUBMISSION_STORAGE.release(name)
+        raise ValueError(
+            "Archived copy of %s doesn't match the original." % archived)
+
+    with transaction.atomic():
+        Submission.objects.filter(pk=submission.pk).update(**{
+            archived.kind: name,
+            'n_bytes': db_models.F('n_bytes') + archived.size})
+        ProjectStatistics.add(submission.project, n_bytes=archived.size)
+        # the archived copy goes too, once this commits
+        archived.delete()
+
+    return name
@@ -0,0 +1,272 @@
+"""An in-process alternative to `gmx trjconv` for aligning trajectories.
+
+Frames are decoded into NumPy arrays (with mdtraj's xtc reader, which is
+optional) and unwrapped and superposed in batches, so aligning a small
+submission doesn't cost a gmx process start and a round trip through
+temporary files. See Project.align_engine. The same machinery cuts
+atom subsets out of stored trajectories (see subset_xtc).
+"""
+
+import os
+
+import numpy as np
+
+try:
+    from mdtraj.formats import XTCTrajectoryFile
+except ImportError:
+    XTCTrajectoryFile = None
+
+from . import util
+from . import formats
+
+# frames decoded and processed at a time
+BATCH_SIZE = 1000
+
+
+def unwrap_nojump(xyz, box, prev=None):
+    """Remove jumps across periodic boundaries from a batch of frames,
+    like `gmx trjconv -pbc nojump`.
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_frames, n_atoms, 3)
+        Coordinates, as wrapped into the box by mdrun. Modified in place.
+    box : np.ndarray, shape=(n_frames, 3, 3)
+        Box vectors (as rows) of each frame, in GROMACS' lower-triangular
+        form.
+    prev : tuple of (np.ndarray, np.ndarray), optional
+        The last wrapped frame of the previous batch and the image shift
+        (as a count of each box vector) it had, so that unwrapping can
+        continue across batches.
+
+    Returns
+    -------
+    xyz : np.ndarray, shape=(n_frames, n_atoms, 3)
+        The unwrapped coordinates.
+    prev : tuple of (np.ndarray, np.ndarray)
+        The value to pass as prev for the next batch.
+    """
+
+    if prev is None:
+        prev = (xyz[0].copy(), np.zeros(xyz.shape[1:]))
+    last_wrapped, last_shift = prev
+
+    disp = np.diff(np.concatenate([last_wrapped[None], xyz]), axis=0)
+
+    # work down from z, as gmx does, since the z box vector also has x
+    # and y components (and likewise y has an x component)
+    jumps = np.zeros_like(disp)
+    for d in (2, 1, 0):
+        n = np.round(disp[..., d] / box[:, None, d, d])
+        jumps[..., d] = n
+        disp -= n[..., None] * box[:, None, d, :]
+
+    shifts = last_shift + np.cumsum(jumps, axis=0)
+    next_prev = (xyz[-1].copy(), shifts[-1])
+
+    xyz -= np.einsum('fnd,fdi->fni', shifts, box)
+
+    return xyz, next_prev
+
+
+def superpose(xyz, reference):
+    """Rotate and translate each frame onto a reference structure,
+    minimizing RMSD (the Kabsch algorithm).
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_frames, n_atoms, 3)
+        Frames to superpose. Modified in place.
+    reference : np.ndarray, shape=(n_atoms, 3)
+        Structure to superpose onto.
+    """
+
+    ref_center = reference.mean(axis=0)
+    xyz -= xyz.mean(axis=1, keepdims=True)
+
+    cov = np.einsum('fni,nj->fij', xyz, reference - ref_center)
+    u, _, vt = np.linalg.svd(cov)
+
+    # flip the last axis where needed, so we never return a reflection
+    u[:, :, -1] *= np.sign(np.linalg.det(np.matmul(u, vt)))[:, None]
+    rot = np.matmul(u, vt)
+
+    xyz[:] = np.matmul(xyz, rot) + ref_center
+
+    return xyz
+
+
+def read_pdb_xyz(pdb_file):
+    """Read the coordinates (in nm) of the first model in a PDB file.
+    """
+
+    xyz = []
+    with open(pdb_file, 'r') as f:
+        for line in f:
+            if line.startswith(('ATOM', 'HETATM')):
+                xyz.append([float(line[30:38]), float(line[38:46]),
+                            float(line[46:54])])
+            elif line.startswith('ENDMDL') and xyz:
+                break
+
+    return np.array(xyz) / 10
+
+
+def read_pdb_atoms(pdb_file):
+    """Read the serial number and name of each atom of the first model in
+    a PDB file.
+
+    Returns
+    -------
+    atoms : list of (int, str)
+    """
+
+    atoms = []
+    with open(pdb_file, 'r') as f:
+        for line in f:
+            if line.startswith(('ATOM', 'HETATM')):
+                atoms.append((int(line[6:11]), line[12:16].strip()))
+            elif line.startswith('ENDMDL') and atoms:
+                break
+
+    return atoms
+
+
+def select_atoms(pdb_file, serials=None, names=None):
+    """Choose atoms of a PDB file by serial number and/or name.
+
+    Parameters
+    ----------
+    pdb_file : str
+        Path to the PDB, such as an Alignment's group_pdb.
+    serials : set of int, optional
+        Serial numbers of the atoms to keep.
+    names : set of str, optional
+        Names (e.g. 'CA') of the atoms to keep.
+
+    Returns
+    -------
+    atom_indices : list of int
+        Indices (from 0) of the atoms matching both criteria.
+    """
+
+    return [i for i, (serial, name) in enumerate(read_pdb_atoms(pdb_file))
+            if (serials is None or serial in serials) and
+            (names is None or name in names)]
+
+
+def subset_xtc(xtc_file, extents, atom_indices, batch_size=BATCH_SIZE):
+    """Cut some frames (by byte extents, see formats.XtcIndex.extents)
+    out of a trajectory and keep only some of their atoms.
+
+    Parameters
+    ----------
+    xtc_file : str
+        Path to the trajectory.
+    extents : iterable of (int, int)
+        Offsets and lengths of the runs of frames wanted.
+    atom_indices : list of int
+        Indices (from 0) of the atoms to keep.
+    batch_size : int, default=BATCH_SIZE
+        Number of frames to hold in memory at once.
+
+    Yields
+    ------
+    chunk : bytes
+        Consecutive parts of the new trajectory, each a whole number of
+        frames.
+    """
+
+    if XTCTrajectoryFile is None:
+        raise RuntimeError(
+            "Selecting atoms needs mdtraj to read and write xtcs.")
+
+    # only the frames wanted are ever decoded
+    frames_file = util.temporary_path('.xtc')
+    output = util.temporary_path('.xtc')
+
+    try:
+        with open(xtc_file, 'rb') as fin, open(frames_file, 'wb') as fout:
+            for chunk in formats.read_extents(fin, extents):
+                fout.write(chunk)
+
+        if not os.path.getsize(frames_file):
+            return
+
+        with XTCTrajectoryFile(frames_file, 'r') as fin:
+            while True:
+                xyz, time, step, box = fin.read(
+                    n_frames=batch_size, atom_indices=atom_indices)
+                if not len(xyz):
+                    break
+
+                with XTCTrajectoryFile(output, 'w') as fout:
+                    fout.write(xyz, time=time, step=step, box=box)
+                with open(output, 'rb') as f:
+                    yield f.read()
+    finally:
+        for path in [frames_file, output]:
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def align(xtc_file, atom_indices, reference=None, batch_size=BATCH_SIZE,
+          output=None):
+    """Unwrap and superpose a trajectory, keeping only some of its atoms.
+    The NumPy counterpart of util.align.
+
+    Parameters
+    ----------
+    xtc_file : str
+        Path to the trajectory to align.
+    atom_indices : list of int
+        Indices (from 0) of the atoms to align on and output.
+    reference : np.ndarray, shape=(len(atom_indices), 3), optional
+        Structure to superpose every frame onto. Defaults to the first
+        frame of the trajectory.
+    batch_size : int, default=BATCH_SIZE
+        Number of frames to hold in memory at once.
+    output : str, optional
+        Path to write the aligned trajectory to. Any existing file there
+        is replaced. By default, a new temporary file is used.
+
+    Returns
+    -------
+    output : str
+        Path to the aligned trajectory.
+    """
+
+    if XTCTrajectoryFile is None:
+        raise RuntimeError(
+            "The numpy align engine needs mdtraj to read and write xtcs.")
+
+    atom_indices = np.asarray(atom_indices)
+
+    if output is None:
+        output = util.temporary_path('.xtc')
+
+    try:
+        with XTCTrajectoryFile(xtc_file, 'r') as fin, \
+                XTCTrajectoryFile(output, 'w') as fout:
+            prev = None
+            while True:
+                xyz, time, step, box = fin.read(
+                    n_frames=batch_size, atom_indices=atom_indices)
+                if not len(xyz):
+                    break
+
+                xyz = xyz.astype(np.float64)
+                xyz, prev = unwrap_nojump(xyz, box, prev)
+
+                if reference is None:
+                    reference = xyz[0].copy()
+                superpose(xyz, reference)
+
+                fout.write(xyz.astype(np.float32), time=time, step=step,
+                           box=box)
+    except:
+        if os.path.isfile(output):
+            os.remove(output)
+        raise
+
+    return output
@@ -3,11 +3,61 @@ import subprocess
 import tempfile
 import logging
 import re
+import functools
 
 logger = logging.getLogger(__name__)
 
 
-GROUP_REGEX_STR = 'Group[ ]*(?P<group_number>[0-9])+ "(?P<group_name>[\w-]+)"'
+GROUP_SIZE_REGEX_STR = (
+    r'Group[ ]*[0-9]+ "(?P<group_name>[\w-]+)"'
+    r'(?: \((?P<natoms>[0-9]+) atoms\))?')
+VERSION_REGEX_STR = r'GROMACS version:[ ]*(?P<version>.*)'
+
+
+@functools.lru_cache()
+def gmx_version():
+    """The version string reported by `gmx --version`. Only asked for
+    once per process.
+    """
+
+    p = subprocess.run(['gmx', '--version'],
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    match = re.search(VERSION_REGEX_STR, p.stdout.decode('latin'))
+    if match is None:
+        raise RuntimeError("Couldn't determine GROMACS version from "
+                           "'gmx --version'.")
+
+    return match.group('version').strip()
+
+
+def parse_mdp(mdp_file):
+    """Read the parameters set in an mdp file.
+
+    Parameters
+    ----------
+    mdp_file : str
+        Path to the mdp file to read.
+
+    Returns
+    -------
+    params : dict
+        Mapping from parameter name to (string) value. Names are
+        lowercased and use underscores rather than dashes, since
+        grompp treats 'gen-vel' and 'gen_vel' as the same parameter.
+    """
+
+    params = {}
+    with open(mdp_file, 'r') as f:
+        for line in f:
+            line = line.split(';', 1)[0].strip()
+            if '=' not in line:
+                continue
+
+            key, value = line.split('=', 1)
+            params[key.strip().lower().replace('-', '_')] = value.strip()
+
+    return params
 
 
 def subset_tpr(tpr_data, group):
@@ -46,80 +96,102 @@ def subset_tpr(tpr_data, group):
     return group_tpr
 
 
-def align(xtc_file, tpr_data, group):
+def temporary_path(suffix):
+    """Get the path of a new, empty temporary file. It's up to the caller
+    to remove it.
+    """
+
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+
+    return path
+
+
+def align(xtc_file, tpr_data, group, output=None):
     """Align an xtc file to a group of atoms using the topology
     information in a tpr.
 
     Parameters
     ----------
-    xtc_file : bytes-like
-        Trajectory, in xtc format, to align.
+    xtc_file : str
+        Path to the trajectory, in xtc format, to align.
     tpr_data : bytes-like
         Topology, in tpr format, to use for the alignment.
     group : string
         Name of the group to use for output and alignment.
+    output : str, optional
+        Path to write the aligned trajectory to. Any existing file there
+        is replaced. By default, a new temporary file is used.
+
+    Returns
+    -------
+    output : str
+        Path to the aligned trajectory. The trajectory is never held in
+        memory, so this works for trajectories of any size.
     """
 
+    if output is None:
+        output = temporary_path('.xtc')
+
+    # gmx would otherwise back up whatever is already there
+    if os.path.isfile(output):
+        os.remove(output)
+
     with tempfile.NamedTemporaryFile(suffix='.tpr') as tpr:
         tpr.write(tpr_data)
         tpr.flush()
 
-        with tempfile.NamedTemporaryFile(suffix='.xtc') as xtc_out:
-            xtc_out_name = xtc_out.name
-
         args = [
             'gmx', 'trjconv',
             '-f', xtc_file,
             '-s', tpr.name,
-            '-o', xtc_out_name,
+            '-o', output,
             '-pbc', 'nojump'
         ]
 
-        logger.info("Align cmd: args")
+        logger.info("Align cmd: %s", args)
         p = subprocess.Popen(args, stdin=subprocess.PIPE,
                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         out, err = p.communicate(group.encode('ascii'))
 
-        if not os.path.isfile(xtc_out_name):
-            raise RuntimeError(
-                "\n".join(out.decode('ascii').splitlines()[25:]))
+    if p.returncode != 0 or not os.path.isfile(output):
+        if os.path.isfile(output):
+            os.remove(output)
+        raise RuntimeError(
+            "\n".join(out.decode('ascii').splitlines()[25:]))
 
-        try:
-            with open(xtc_out_name, 'rb') as f:
-                xtc_data = f.read()
-        except:
-            print(out.decode('ascii'))
-            raise
-        finally:
-            if os.path.isfile(xtc_out_name):
-                os.remove(xtc_out_name)
+    return output
 
-    return xtc_data
 
+def make_pdb(xtc_file, tpr_data, group='System', pbc='nojump'):
+    """Build a PDB file without periodic boundary conditions out of the
+    first frame of an XTC and a TPR.
 
-def make_pdb(xtc_data, tpr_data, group='System', pbc='nojump'):
-    """Build a PDB file without periodic boundary conditions out of an
-    XTC and TPR.
+    Parameters
+    ----------
+    xtc_file : str
+        Path to the trajectory, in xtc format. Only its first frame is
+        read.
+    tpr_data : bytes-like
+        Topology, in tpr format.
+    group : str, default='System'
+        Name of the group to write out.
+    pbc : str, default='nojump'
+        Passed to trjconv's -pbc option.
     """
 
-    try:
-        # write the binary data to files for GMX to read
-        tpr = tempfile.NamedTemporaryFile(suffix='.tpr')
+    with tempfile.NamedTemporaryFile(suffix='.tpr') as tpr:
+        # write the binary data to a file for GMX to read
         tpr.write(tpr_data)
         tpr.flush()
 
-        xtc = tempfile.NamedTemporaryFile(suffix='.xtc')
-        xtc.write(xtc_data)
-        xtc.flush()
-
         # get a temp file name for the output pdb
-        pdb_out = tempfile.NamedTemporaryFile(suffix='.pdb')
-        pdb_out_name = pdb_out.name
-        pdb_out.close()
+        with tempfile.NamedTemporaryFile(suffix='.pdb') as pdb_out:
+            pdb_out_name = pdb_out.name
 
         args = [
             'gmx', 'trjconv',
-            '-f', xtc.name,
+            '-f', xtc_file,
             '-s', tpr.name,
             '-o', pdb_out_name,
             '-e', '1',
@@ -132,9 +204,6 @@ def make_pdb(xtc_data, tpr_data, group='System', pbc='nojump'):
             stderr=subprocess.STDOUT)
 
         out, _ = p.communicate(group.encode('ascii'))
-    finally:
-        xtc.close()
-        tpr.close()
 
     try:
         with open(pdb_out_name, 'rb') as f:
@@ -149,8 +218,8 @@ def make_pdb(xtc_data, tpr_data, group='System', pbc='nojump'):
     return pdb_data
 
 
-def get_tpr_groups(tpr_data):
-    """Find the named groups inside a tpr.
+def get_tpr_group_sizes(tpr_data):
+    """Find the named groups inside a tpr, and how many atoms are in each.
 
     Uses the gmx select command. Writes the given data to a file and
     passes that path off to gmx-select, and then processes the output
@@ -161,6 +230,12 @@ def get_tpr_groups(tpr_data):
     tpr_data : bytes
         The bytes that represent the TPR file. Actually, anything that
         can be written by NamedTemporaryFile.write() should do.
+
+    Returns
+    -------
+    groups : list of (str, int) tuples
+        The name and atom count of each group, in gmx's order. Atom
+        counts are None if gmx select didn't report them.
     """
 
     with tempfile.NamedTemporaryFile(suffix='.tpr') as tpr:
@@ -172,18 +247,94 @@ def get_tpr_groups(tpr_data):
             '-s', tpr.name,
         ]
 
-        p = subprocess.Popen(args, stderr=subprocess.PIPE,
+        p = subprocess.Popen(args, stdin=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
                              stdout=subprocess.PIPE)
 
         try:
-            output, error = p.communicate(timeout=1)
+            # gmx select waits for a selection on stdin after listing the
+            # groups; sending it EOF straight away lets it exit.
+            output, error = p.communicate(b'', timeout=10)
         except subprocess.TimeoutExpired:
-            # gmx select always waits for input, so we terminate it
-            # using the timeout parameter of run, but that means we have
-            # to catch a TimeoutExpired exception here.
             p.kill()
             output, error = p.communicate()
 
-        groups = re.findall(GROUP_REGEX_STR, error.decode('latin'))
+        groups = re.findall(GROUP_SIZE_REGEX_STR, error.decode('latin'))
+
+    return [(name, int(natoms) if natoms else None)
+            for name, natoms in groups]
+
+
+def read_ndx(ndx_data):
+    """Parse the contents of a GROMACS index file.
+
+    Returns
+    -------
+    groups : dict
+        Mapping from group name to a list of the (0-based) indices of
+        the atoms in it.
+    """
+
+    groups = {}
+    name = None
+    for line in ndx_data.decode('latin').splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            name = line.strip('[] ')
+            groups[name] = []
+        elif line and name is not None:
+            groups[name].extend(int(i) - 1 for i in line.split())
+
+    return groups
+
+
+def get_group_indices(tpr_data, group):
+    """Find the indices of the atoms in one of a tpr's groups.
+
+    Parameters
+    ----------
+    tpr_data : bytes
+        The TPR file's contents.
+    group : str
+        Name of the group, as listed by get_tpr_groups.
+
+    Returns
+    -------
+    indices : list of int
+        Indices (from 0) of the group's atoms.
+    """
+
+    with tempfile.NamedTemporaryFile(suffix='.tpr') as tpr, \
+            tempfile.NamedTemporaryFile(suffix='.ndx') as ndx:
+        tpr.write(tpr_data)
+        tpr.flush()
+
+        args = [
+            'gmx', 'select',
+            '-s', tpr.name,
+            '-select', 'group "%s"' % group,
+            '-on', ndx.name,
+        ]
+
+        p = subprocess.run(args, stdin=subprocess.DEVNULL,
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(
+                p.returncode, args, output=p.stdout)
+
+        groups = read_ndx(ndx.read())
+
+    if len(groups) != 1:
+        raise RuntimeError(
+            "Expected one group in gmx select output, got %s." % len(groups))
+
+    return list(groups.values())[0]
+
+
+def get_tpr_groups(tpr_data):
+    """Find the names of the groups inside a tpr. See
+    get_tpr_group_sizes.
+    """
 
-    return list(zip(*groups))[1]
+    return tuple(name for name, natoms in get_tpr_group_sizes(tpr_data))
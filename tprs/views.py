@@ -1,20 +1,40 @@
+import io
+import os
 import logging
+import datetime
+import re
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
 from django.urls import reverse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
+from django.utils import timezone
 
 from wsgiref.util import FileWrapper
 
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import api_view, detail_route
 from rest_framework.response import Response
 
 from . import seralizers
 from . import models
+from . import compression
+from . import scheduler
+from . import formats
+from . import trajectory
+from . import features
 
 logger = logging.getLogger(__name__)
 
+CONTENT_RANGE_REGEX = re.compile(
+    r'^bytes (?P<start>[0-9]+)-(?P<end>[0-9]+)/(?P<size>[0-9]+)$')
+
+# bytes of a file streamed at a time
+STREAM_CHUNK_SIZE = 1024 * 1024
+
 
 @api_view(['GET'])
 def tpr(request, protein):
@@ -23,24 +43,357 @@ def tpr(request, protein):
         models.Project.objects.all(),
         name=protein)
 
-    response = HttpResponse(
-        FileWrapper(proj.grompp()),
-        content_type='application/octet-stream')
+    encoding = compression.negotiate(
+        request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+    if proj.generates_velocities():
+        # every work unit gets its own TPR, so never reuse one
+        tpr_file = proj.work_unit_tpr()
+        if encoding is not None:
+            tpr_file = io.BytesIO(
+                compression.compress(tpr_file.read(), encoding))
+
+        response = HttpResponse(
+            FileWrapper(tpr_file),
+            content_type='application/octet-stream')
+        response['Cache-Control'] = 'no-store'
+    else:
+        # each encoding is a different representation, so needs its own tag
+        etag = '"%s"' % "-".join(
+            [proj.tpr_digest()] + ([encoding] if encoding else []))
+        last_modified = int(proj.tpr_modified())
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+
+        if response is None:
+            if encoding is None:
+                tpr_file = proj.work_unit_tpr()
+            else:
+                tpr_file = io.BytesIO(proj.compressed_tpr(encoding))
+
+            response = HttpResponse(
+                FileWrapper(tpr_file),
+                content_type='application/octet-stream')
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'no-cache'
+
+    if encoding is not None and response.status_code == 200:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    compression.advertise(response)
+
     response['Content-Disposition'] = 'attachment; filename=%s.zip' % protein
 
     return response
 
 
-class ProjectViewSet(viewsets.ModelViewSet):
+def parse_when(value):
+    """Parse a query parameter that's either an ISO 8601 date or datetime.
+    Dates are taken as midnight in the current timezone.
+    """
+
+    when = parse_datetime(value)
+    if when is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError("%r isn't a date or datetime." % value)
+        when = datetime.datetime.combine(date, datetime.time())
+
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+
+    return when
+
+
+def stream_files(fields, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield the contents of a sequence of FileFields one after the other,
+    a chunk at a time, so only one chunk is ever held in memory.
+    """
+
+    for field in fields:
+        with field.storage.open(field.name, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+
+
+@api_view(['GET'])
+def aligned_xtc(request, protein):
+    """The aligned trajectories of a project's submissions, concatenated
+    into one xtc in submission order and streamed as it is read.
+
+    The hostname, since and until query parameters restrict it to
+    submissions from one host or created in a range of dates. Frame
+    times are those of each submission, so restart at every boundary.
+    """
+
+    proj = get_object_or_404(models.Project.objects.all(), name=protein)
+
+    alignments = models.Alignment.objects.filter(
+        submission__project=proj).exclude(xtc='')
+
+    if 'hostname' in request.query_params:
+        alignments = alignments.filter(
+            submission__hostname=request.query_params['hostname'])
+
+    try:
+        if 'since' in request.query_params:
+            alignments = alignments.filter(submission__created__gte=parse_when(
+                request.query_params['since']))
+        if 'until' in request.query_params:
+            alignments = alignments.filter(submission__created__lt=parse_when(
+                request.query_params['until']))
+    except ValueError as e:
+        return Response({'detail': str(e)},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    alignments = alignments.order_by('submission__sequence')
+
+    response = StreamingHttpResponse(
+        stream_files(aln.xtc for aln in alignments.iterator()),
+        content_type='application/octet-stream')
+    response['Content-Disposition'] = \
+        'attachment; filename=%s-aligned.xtc' % protein
+
+    return response
+
+
+def parse_serials(text):
+    """Parse a list of serial numbers and ranges of them, like
+    '1-10,15', into a set.
+    """
+
+    serials = set()
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        try:
+            serials.update(range(int(first), int(last or first) + 1))
+        except ValueError:
+            raise ValueError("%r isn't a list of atom numbers." % text)
+
+    return serials
+
+
+def stream_extents(path, extents):
+    """Yield spans of a file (see formats.XtcIndex.extents), a chunk at a
+    time.
+    """
+
+    with open(path, 'rb') as f:
+        yield from formats.read_extents(f, extents, STREAM_CHUNK_SIZE)
+
+
+def xtc_slice(request, xtc, index, group_pdb=None):
+    """Respond with some of the frames, and optionally atoms, of a stored
+    xtc, as chosen by the request's query parameters:
+
+    start, stop, stride
+        Frames to keep, as in a Python slice.
+    atoms
+        Serial numbers (and ranges of them, like 1-10) of atoms in
+        group_pdb to keep.
+    names
+        Names (e.g. CA) of atoms in group_pdb to keep.
+
+    Frames are found with the xtc's frame index and copied without
+    decoding them, unless atoms are selected.
+    """
+
+    params = request.query_params
+
+    try:
+        stride = int(params.get('stride', 1))
+        if stride < 1:
+            raise ValueError("stride must be positive.")
+
+        frames = range(len(index))[slice(
+            int(params['start']) if 'start' in params else None,
+            int(params['stop']) if 'stop' in params else None,
+            stride)]
+
+        atom_indices = None
+        if 'atoms' in params or 'names' in params:
+            if group_pdb is None:
+                raise ValueError(
+                    "Atoms can only be selected from aligned trajectories.")
+
+            atom_indices = trajectory.select_atoms(
+                group_pdb.path,
+                serials=(parse_serials(params['atoms'])
+                         if 'atoms' in params else None),
+                names=(set(params['names'].split(','))
+                       if 'names' in params else None))
+            if not atom_indices:
+                raise ValueError("No atoms match the selection.")
+    except ValueError as e:
+        return Response({'detail': str(e)},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    extents = index.extents(frames, xtc.size)
+
+    if atom_indices is None:
+        content = stream_extents(xtc.path, extents)
+    elif trajectory.XTCTrajectoryFile is None:
+        return Response(
+            {'detail': 'Selecting atoms needs mdtraj on the server.'},
+            status=status.HTTP_501_NOT_IMPLEMENTED)
+    else:
+        content = trajectory.subset_xtc(xtc.path, extents, atom_indices)
+
+    response = StreamingHttpResponse(
+        content, content_type='application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename=%s' % (
+        os.path.basename(xtc.name))
+
+    return response
+
+
+@api_view(['GET'])
+def alignment_slice(request, pk):
+    """Some of the frames and atoms of an aligned trajectory. See
+    xtc_slice.
+    """
+
+    aln = get_object_or_404(models.Alignment.objects.exclude(xtc=''), pk=pk)
+
+    return xtc_slice(request, aln.xtc, aln.xtc_index(),
+                     aln.group_pdb or None)
+
+
+@api_view(['GET'])
+def submission_slice(request, pk):
+    """Some of the frames of a submitted trajectory. See xtc_slice.
+    """
+
+    sub = get_object_or_404(models.Submission.objects.exclude(xtc=''), pk=pk)
+
+    return xtc_slice(request, sub.xtc, sub.xtc_index())
+
+
+@api_view(['GET'])
+def feature_index(request, protein):
+    """The project-level index of its alignments' features (see
+    tprs.features): for each alignment with current features, in
+    submission order, where its frames start in the concatenation of
+    them all, how many there are, the names of the columns and where
+    to download the array.
+    """
+
+    proj = get_object_or_404(models.Project.objects.all(), name=protein)
+    key = features.features_key(features.project_features(proj))
+
+    feature_sets = models.FeatureSet.objects.filter(
+        alignment__submission__project=proj, key=key).select_related(
+        'alignment__submission').order_by('alignment__submission__sequence')
+
+    index = []
+    first_frame = 0
+    for fs in feature_sets:
+        index.append({
+            'submission': fs.alignment.submission.pk,
+            'sequence': fs.alignment.submission.sequence,
+            'first_frame': first_frame,
+            'n_frames': fs.n_frames,
+            'columns': fs.columns(),
+            'url': request.build_absolute_uri(
+                reverse('alignment-features', args=(fs.alignment.pk,))),
+        })
+        first_frame += fs.n_frames
+
+    return Response({'project': proj.name, 'n_frames': first_frame,
+                     'feature_sets': index})
+
+
+@api_view(['GET'])
+def alignment_features(request, pk):
+    """An alignment's features, as a float32 .npy array.
+    """
+
+    fs = get_object_or_404(models.FeatureSet.objects.all(), alignment=pk)
+
+    response = FileResponse(fs.array.storage.open(fs.array.name, 'rb'),
+                            content_type='application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename=%s' % (
+        os.path.basename(fs.array.name))
+
+    return response
+
+
+@api_view(['GET'])
+def manifest(request):
+    """The active projects and the sha256 of each one's TPR (see
+    models.tpr_manifest). Cheap enough for every client to poll, and
+    answered with a 304 if the client's copy is still current.
+    """
+
+    body, etag = models.tpr_manifest()
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+
+    return response
+
+
+@api_view(['POST'])
+def next_work(request):
+    """Lease a work unit from whichever project most needs one (see
+    tprs.scheduler) to the host named in the request. Responds 204 if no
+    project needs more work.
+    """
+
+    hostname = request.data.get('hostname')
+    if not hostname:
+        return Response({'detail': 'A hostname is required.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    lease = scheduler.next_work(hostname)
+    if lease is None:
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    s = seralizers.LeaseSerializer(lease, context={'request': request})
+
+    return Response(s.data, status=status.HTTP_201_CREATED,
+                    headers={'Location': s.data['url']})
+
+
+class AdvertiseEncodingsMixin(object):
+    """Add the Accept-Encoding header from compression.advertise to every
+    response, so clients know how they may compress uploaded files.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(AdvertiseEncodingsMixin, self).finalize_response(
+            request, response, *args, **kwargs)
+
+        return compression.advertise(response)
+
+
+class ProjectViewSet(AdvertiseEncodingsMixin, viewsets.ModelViewSet):
     """API endpoint that allows projects to be viewed or edited.
     """
-    queryset = models.Project.objects.all()
+    queryset = models.Project.objects.select_related('tpr_info')
     serializer_class = seralizers.ProjectSerializer
 
+    def perform_create(self, serializer):
+        serializer.save().current_tpr_info()
+
+    def perform_update(self, serializer):
+        serializer.save().current_tpr_info()
+
     @detail_route(methods=['post'])
     def submit(self, request, pk):
 
         request.data['project'] = reverse('project-detail', args=(pk,))
+
+        if settings.ASYNC_SUBMISSIONS:
+            return self.spool(request)
+
         s = seralizers.SubmissionSerializer(data=request.data)
 
         try:
@@ -52,9 +405,135 @@ class ProjectViewSet(viewsets.ModelViewSet):
 
         return Response({}, status=status.HTTP_201_CREATED)
 
+    def spool(self, request):
+        """Store the upload as a PendingSubmission to be validated later
+        by the validatesubmissions command.
+        """
+
+        s = seralizers.PendingSubmissionSerializer(
+            data=request.data, context={'request': request})
+        s.is_valid(raise_exception=True)
+        pending = s.save()
+
+        return pending_response(request, pending)
+
+
+def pending_response(request, pending):
+    """Tell the client where to find out what became of a spooled upload.
+    """
+
+    url = request.build_absolute_uri(
+        reverse('pendingsubmission-detail', args=(pending.pk,)))
+
+    return Response({'status': pending.status, 'url': url},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': url})
+
+
+class UploadViewSet(AdvertiseEncodingsMixin,
+                    mixins.CreateModelMixin,
+                    mixins.RetrieveModelMixin,
+                    mixins.DestroyModelMixin,
+                    viewsets.GenericViewSet):
+    """API endpoint for resumable, chunked uploads of submissions.
+
+    POST the project, hostname and the kind, size, sha256 and (optionally)
+    compression encoding of each file to create an upload; the response
+    lists the byte ranges still missing from each file (none, for files
+    the server already has).
+    PUT each missing range to files/<kind>/ with a Content-Range header,
+    GET the upload to see what has arrived, and POST to finalize/ once
+    everything has.
+    """
+    queryset = models.Upload.objects.prefetch_related('files')
+    serializer_class = seralizers.UploadSerializer
+
+    @detail_route(methods=['put'], url_path=r'files/(?P<kind>[a-z]+)')
+    def chunk(self, request, pk, kind):
+
+        upload = self.get_object()
+        upload_file = get_object_or_404(upload.files, kind=kind)
+
+        if upload.pending_id is not None:
+            return Response({'detail': 'Upload has already been finalized.'},
+                            status=status.HTTP_409_CONFLICT)
+
+        match = CONTENT_RANGE_REGEX.match(
+            request.META.get('HTTP_CONTENT_RANGE', ''))
+        if match is None or int(match.group('size')) != upload_file.size:
+            return Response(
+                {'detail': 'Expected a Content-Range header of the form '
+                           '"bytes START-END/%s".' % upload_file.size},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        start, end = int(match.group('start')), int(match.group('end'))
+
+        try:
+            # an empty body has no stream at all
+            upload_file.write(start, request.stream or io.BytesIO(),
+                              end + 1 - start)
+        except ValueError as e:
+            return Response({'detail': str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(seralizers.UploadFileSerializer(upload_file).data)
+
+    @detail_route(methods=['post'])
+    def finalize(self, request, pk):
+
+        upload = self.get_object()
+
+        try:
+            pending = upload.finalize()
+        except ValueError as e:
+            return Response({'detail': str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if settings.ASYNC_SUBMISSIONS:
+            return pending_response(request, pending)
+
+        try:
+            submission = pending.process()
+        except Exception as e:
+            # the files are safely spooled, and the upload can't be
+            # finalized again, so leave it for validatesubmissions
+            logger.error("Error validating %s: %s", pending, e)
+            pending.retry_later(e)
+            return pending_response(request, pending)
+
+        if submission is None:
+            return Response({'detail': pending.detail},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({}, status=status.HTTP_201_CREATED)
+
+
+class PendingSubmissionViewSet(viewsets.ReadOnlyModelViewSet):
+    """API endpoint that reports the status of uploaded submissions that
+    are awaiting validation.
+    """
+    queryset = models.PendingSubmission.objects.all()
+    serializer_class = seralizers.PendingSubmissionSerializer
+
 
 class SubmissionViewSet(viewsets.ModelViewSet):
     """API endpoint that allows submissions to be viewed or edited.
     """
     queryset = models.Submission.objects.all()
     serializer_class = seralizers.SubmissionSerializer
+
+
+class LeaseViewSet(viewsets.ReadOnlyModelViewSet):
+    """API endpoint listing the work units handed out by next-work, and
+    which submission (if any) fulfilled each.
+    """
+    queryset = models.Lease.objects.all()
+    serializer_class = seralizers.LeaseSerializer
+
+
+class ProjectStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
+    """API endpoint giving running totals (submissions, alignments, frames,
+    simulated time and storage) for each project.
+    """
+    queryset = models.ProjectStatistics.objects.all()
+    serializer_class = seralizers.ProjectStatisticsSerializer